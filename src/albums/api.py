@@ -12,9 +12,22 @@ from ninja import Router
 
 from .models import Album
 from .filters import AlbumFilters
+from .schema import ALBUM_RESPONSE_COLUMNS
 from .schema import AlbumRequestSchema
+from .schema import AlbumResponseSchema
 from .schema import SingleAlbumResponseSchema, MultipleAlbumResponseSchema
+from utils.fields import get_deferred_fields
+from utils.fields import sparse_response
+from utils.fields import validate_fields
+from utils.filters import SearchModeChoices
+from utils.pagination import get_sorting
+from utils.pagination import get_total
+from utils.pagination import paginate
+from utils.permissions import has_object_permission
 from utils.schema import ApiMessageSchema
+from utils.search import fuzzy_search
+from utils.search import search
+from utils.search import similarity_threshold
 
 logger = logging.getLogger("bma")
 
@@ -76,25 +89,39 @@ def album_list(request, filters: AlbumFilters = query):
         albums = albums.exclude(~query)
 
     if filters.search:
-        albums = albums.filter(title__icontains=filters.search) | albums.filter(
-            description__icontains=filters.search,
-        )
-
-    if filters.sorting:
-        if filters.sorting.endswith("_asc"):
-            # remove _asc and add +
-            albums = albums.order_by(f"{filters.sorting[:-4]}")
+        if filters.search_mode == SearchModeChoices.fuzzy:
+            albums = fuzzy_search(albums, filters.search, ["title"])
         else:
-            # remove _desc and add -
-            albums = albums.order_by(f"-{filters.sorting[:-5]}")
-
-    if filters.offset:
-        albums = albums[filters.offset :]
+            albums = search(albums, filters.search)
+
+    if filters.fields:
+        filters.fields = validate_fields(AlbumResponseSchema, filters.fields)
+        # only load the columns needed for the requested fields
+        albums = albums.defer(
+            *get_deferred_fields(
+                Album,
+                filters.fields,
+                ALBUM_RESPONSE_COLUMNS,
+                required=[get_sorting(filters.sorting)[0]],
+            ),
+        )
+    else:
+        # the search vector is never returned
+        albums = albums.defer("search_vector")
 
-    if filters.limit:
-        albums = albums[: filters.limit]
+    with similarity_threshold(filters.similarity_threshold):
+        page, next_cursor = paginate(albums, filters)
+        if filters.total:
+            # counted after paginate() has validated the cursor
+            total, total_exact = get_total(albums)
 
-    return albums
+    data = {"bma_response": page, "next_cursor": next_cursor}
+    if filters.total:
+        data.update({"total": total, "total_exact": total_exact})
+    if filters.fields:
+        # only return (and resolve) the requested fields
+        return sparse_response(request, router.api, MultipleAlbumResponseSchema, filters.fields, data)
+    return data
 
 
 @router.put(
@@ -127,7 +154,7 @@ def album_update(
 ):
     """Update (PATCH) or replace (PUT) an Album."""
     album = get_object_or_404(Album, uuid=album_uuid)
-    if not request.user.has_perm("change_album", album):
+    if not has_object_permission(request, "change_album", album):
         # no permission
         return 403, {"message": "Permission denied."}
     if check:
@@ -140,6 +167,8 @@ def album_update(
         del data["files"]
         Album.objects.filter(uuid=album.uuid).update(**data)
         album.refresh_from_db()
+        # .update() does not call save(), which updates the search vector
+        album.update_search_vector()
     else:
         # we are replacing the object, we do want defaults for absent fields
         for attr, value in payload.dict(exclude_unset=False).items():
@@ -151,7 +180,7 @@ def album_update(
         album.save()
     if "files" in payload.dict():
         album.files.set(payload.dict()["files"])
-    return album
+    return {"bma_response": album}
 
 
 @router.delete(
@@ -161,7 +190,7 @@ def album_update(
 )
 def album_delete(request, album_uuid: uuid.UUID, check: bool = None):
     album = get_object_or_404(Album, uuid=album_uuid)
-    if not request.user.has_perm("delete_album", album):
+    if not has_object_permission(request, "delete_album", album):
         # no permission
         return 403, {"message": "Permission denied."}
     if check:
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("albums", "0004_initial"),
+        ("files", "0003_alter_basefile_source"),
+        (
+            "taggit",
+            "0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx",
+        ),
+        ("utils", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="album",
+            index=models.Index(
+                fields=["created", "uuid"], name="album_created_uuid_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="album",
+            index=models.Index(
+                fields=["updated", "uuid"], name="album_updated_uuid_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="album",
+            index=models.Index(fields=["title", "uuid"], name="album_title_uuid_idx"),
+        ),
+    ]
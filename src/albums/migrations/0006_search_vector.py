@@ -0,0 +1,49 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:17
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+from utils.search import update_search_vectors
+
+
+def populate_search_vectors(apps, schema_editor):
+    """Build the search vector for all existing objects."""
+    update_search_vectors(
+        apps.get_model("albums", "Album").objects.all(),
+        tagged_item_model=apps.get_model("utils", "UUIDTaggedItem"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("albums", "0005_keyset_pagination_indexes"),
+        ("files", "0004_keyset_pagination_indexes"),
+        (
+            "taggit",
+            "0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx",
+        ),
+        ("utils", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="album",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False,
+                help_text="The full text search vector of the title, description and tags of this album.",
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="album",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="album_search_vector_idx"
+            ),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+    ]
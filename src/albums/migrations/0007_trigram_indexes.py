@@ -0,0 +1,32 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:30
+
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("albums", "0006_search_vector"),
+        ("files", "0005_search_vector"),
+        (
+            "taggit",
+            "0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx",
+        ),
+        ("utils", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name="album",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["title"],
+                name="album_title_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
@@ -1,11 +1,14 @@
 import uuid
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from taggit.managers import TaggableManager
 
 from files.models import BaseFile
 from users.sentinel import get_sentinel_user
 from utils.models import UUIDTaggedItem
+from utils.search import update_search_vectors
 
 
 class Album(models.Model):
@@ -13,6 +16,16 @@ class Album(models.Model):
 
     class Meta:
         ordering = ["created"]
+        indexes = [
+            # used for keyset pagination of the album list, see utils.pagination
+            models.Index(fields=["created", "uuid"], name="album_created_uuid_idx"),
+            models.Index(fields=["updated", "uuid"], name="album_updated_uuid_idx"),
+            models.Index(fields=["title", "uuid"], name="album_title_uuid_idx"),
+            # used for full text search, see utils.search
+            GinIndex(fields=["search_vector"], name="album_search_vector_idx"),
+            # used for fuzzy search, see utils.search
+            GinIndex(fields=["title"], name="album_title_trgm_idx", opclasses=["gin_trgm_ops"]),
+        ]
 
     uuid = models.UUIDField(
         primary_key=True,
@@ -60,6 +73,20 @@ class Album(models.Model):
         related_name="albums",
     )
 
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        help_text="The full text search vector of the title, description and tags of this album.",
+    )
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.update_search_vector()
+
+    def update_search_vector(self):
+        """Update the full text search vector of this album."""
+        update_search_vectors(Album.objects.filter(uuid=self.uuid))
+
 
 class AlbumMember(models.Model):
     """The through model linking Albums and files."""
@@ -7,7 +7,7 @@ from ninja import ModelSchema
 from ninja import Schema
 
 from albums.models import Album
-from utils.schema import ApiMessageSchema, ApiResponseSchema, ObjectPermissionSchema
+from utils.schema import ApiMessageSchema, ApiListResponseSchema, ApiResponseSchema, ObjectPermissionSchema
 
 
 class AlbumRequestSchema(ModelSchema):
@@ -25,6 +25,14 @@ class AlbumRequestSchema(ModelSchema):
 """Response schemas below here."""
 
 
+# the model fields needed by the response fields which are not model fields
+# themselves, used to defer the other columns for sparse fieldsets
+ALBUM_RESPONSE_COLUMNS = {
+    "links": [],
+    "files": [],
+}
+
+
 class AlbumResponseSchema(ModelSchema):
     """Schema for outputting Albums in API operations."""
 
@@ -43,7 +51,7 @@ class AlbumResponseSchema(ModelSchema):
         ]
 
     @staticmethod
-    def resolve_links(obj, request):
+    def resolve_links(obj, context):
         return {
             "self": reverse("api-v1-json:album_get", kwargs={"album_uuid": obj.uuid}),
         }
@@ -51,9 +59,9 @@ class AlbumResponseSchema(ModelSchema):
 
 class SingleAlbumResponseSchema(ApiResponseSchema):
     """The schema used to return a response with a single album object."""
-    response: AlbumResponseSchema
+    bma_response: AlbumResponseSchema
 
 
-class MultipleAlbumResponseSchema(ApiResponseSchema):
+class MultipleAlbumResponseSchema(ApiListResponseSchema):
     """The schema used to return a response with multiple album objects."""
-    response: List[AlbumResponseSchema]
+    bma_response: List[AlbumResponseSchema]
@@ -1,8 +1,12 @@
+from django.test.utils import override_settings
 from django.urls import reverse
+from guardian.shortcuts import assign_perm
 from oauth2_provider.models import get_access_token_model
 from oauth2_provider.models import get_application_model
 from oauth2_provider.models import get_grant_model
 
+from .models import Album
+from utils.fields import get_sparse_schema
 from utils.tests import ApiTestBase
 
 Application = get_application_model()
@@ -207,3 +211,127 @@ class TestAlbumsApi(ApiTestBase):
         assert response.status_code == 200
         assert len(response.json()) == 5
         assert response.json()[0]["title"] == "album5"
+
+    def test_album_list_cursor(self):
+        """Page through the album_list endpoint using cursors."""
+        for i in range(10):
+            Album.objects.create(owner=self.user1, title=f"album{i % 3}")
+        response = self.client.get(
+            reverse("api-v1-json:album_list"),
+            data={"sorting": "title_desc"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        expected = [a["uuid"] for a in response.json()["bma_response"]]
+        assert len(expected) == 10
+        uuids = []
+        data = {"limit": 3, "sorting": "title_desc"}
+        while True:
+            response = self.client.get(
+                reverse("api-v1-json:album_list"),
+                data=data,
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+            assert response.status_code == 200
+            uuids += [a["uuid"] for a in response.json()["bma_response"]]
+            if not response.json()["next_cursor"]:
+                break
+            data["cursor"] = response.json()["next_cursor"]
+        assert uuids == expected
+
+    def test_album_update_search(self):
+        """Make sure the search finds albums by their new title after a PATCH."""
+        album = Album.objects.create(owner=self.user1, title="oldtitle")
+        assign_perm("change_album", self.user1, album)
+
+        def search(text):
+            response = self.client.get(
+                reverse("api-v1-json:album_list"),
+                data={"search": text},
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+            return [a["uuid"] for a in response.json()["bma_response"]]
+
+        assert search("oldtitle") == [str(album.uuid)]
+        response = self.client.patch(
+            reverse("api-v1-json:album_get", kwargs={"album_uuid": album.uuid}),
+            {"title": "brandnew", "files": []},
+            HTTP_AUTHORIZATION=self.user1.auth,
+            content_type="application/json",
+        )
+        assert response.status_code == 200
+        assert search("brandnew") == [str(album.uuid)]
+        assert search("oldtitle") == []
+
+    def test_album_list_search(self):
+        """Test full text search in the album_list endpoint."""
+        camp = Album.objects.create(owner=self.user1, title="Camp 2024", description="Photos from the camp")
+        talks = Album.objects.create(owner=self.user1, title="Talks", description="Recordings")
+        talks.tags.add("camp")
+        Album.objects.create(owner=self.user1, title="Unrelated")
+        response = self.client.get(
+            reverse("api-v1-json:album_list"),
+            data={"search": "camps", "sorting": "relevance_desc"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 200
+        assert [a["uuid"] for a in response.json()["bma_response"]] == [
+            str(camp.uuid),
+            str(talks.uuid),
+        ]
+
+    def test_album_list_sparse_fields(self):
+        """Test that the fields parameter limits the returned album fields."""
+        for i in range(3):
+            Album.objects.create(owner=self.user1, title=f"album{i}", description="foo")
+        response = self.client.get(
+            reverse("api-v1-json:album_list"),
+            data={"fields": ["uuid", "title"], "sorting": "title_asc"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 200
+        assert [a["title"] for a in response.json()["bma_response"]] == ["album0", "album1", "album2"]
+        for album in response.json()["bma_response"]:
+            assert set(album) == {"uuid", "title"}
+
+        # the order and repetitions of the fields do not build new schemas
+        schemas = get_sparse_schema.cache_info().currsize
+        response = self.client.get(
+            reverse("api-v1-json:album_list"),
+            data={"fields": ["title", "uuid", "title"]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 200
+        assert list(response.json()["bma_response"][0]) == ["uuid", "title"]
+        assert get_sparse_schema.cache_info().currsize == schemas
+
+        # unknown fields
+        response = self.client.get(
+            reverse("api-v1-json:album_list"),
+            data={"fields": ["files", "nope"]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 422
+
+    def test_album_list_total(self):
+        """Test the exact and estimated totals in album lists."""
+        for i in range(3):
+            Album.objects.create(owner=self.user1, title=f"album{i}")
+        response = self.client.get(
+            reverse("api-v1-json:album_list"),
+            data={"limit": 1, "total": True, "fields": ["uuid"]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 200
+        assert len(response.json()["bma_response"]) == 1
+        assert response.json()["total"] == 3
+        assert response.json()["total_exact"] is True
+
+        with override_settings(TOTAL_EXACT_THRESHOLD=1):
+            response = self.client.get(
+                reverse("api-v1-json:album_list"),
+                data={"total": True},
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+        assert response.status_code == 200
+        assert response.json()["total"] >= 2
+        assert response.json()["total_exact"] is False
@@ -6,4 +6,4 @@ from audios.models import Audio
 class AudioOutSchema(ModelSchema):
     class Config:
         model = Audio
-        model_fields = "__all__"
+        model_exclude = ["search_vector"]
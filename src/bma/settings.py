@@ -11,6 +11,9 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 from pathlib import Path
 
+# the secret used to sign media urls, set in environment_settings, signing is disabled when empty
+MEDIA_SIGNING_SECRET = ""
+
 from .environment_settings import *  # noqa: F403
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -142,6 +145,11 @@ STATIC_ROOT = BASE_DIR / "static"  # collect all static files here
 STATIC_URL = "static/"  # serve the static files here
 
 MEDIA_URL = "media/"
+# the number of seconds signed media urls are valid for published and other files, see utils.signing
+MEDIA_URL_EXPIRY_PUBLIC = 7 * 24 * 60 * 60
+MEDIA_URL_EXPIRY_PRIVATE = 60 * 60
+# the number of seconds browsers and proxies may cache published media files before revalidating them
+MEDIA_PUBLIC_MAX_AGE = 5 * 60
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -211,6 +219,30 @@ GUARDIAN_GET_CONTENT_TYPE = (
 IMAGEKIT_CACHEFILE_DIR = ""
 IMAGEKIT_SPEC_CACHEFILE_NAMER = "imagekit.cachefiles.namers.source_name_dot_hash"
 
+# calculate the SHA-256 digest of uploaded files while they are received
+FILE_UPLOAD_HANDLERS = [
+    "utils.upload.SHA256MemoryFileUploadHandler",
+    "utils.upload.SHA256TemporaryFileUploadHandler",
+]
+
+# the number of uploads handled at the same time by all processes and all users together,
+# more are rejected with 429. This is a server wide limit to protect disk and memory, it
+# should be well above the number of uploads a single busy user or camp makes at once.
+UPLOAD_MAX_CONCURRENCY = 64
+# the number of seconds clients are asked to wait before retrying a rejected upload
+UPLOAD_RETRY_AFTER = 5
+# the number of seconds after the last chunk before an upload session expires and is removed by cleanup_upload_sessions
+UPLOAD_SESSION_EXPIRY = 7 * 24 * 60 * 60
+
+# lists with more objects than this return the planner estimate as total instead of an exact count
+TOTAL_EXACT_THRESHOLD = 10000
+
+# the number of rows read from the database and serialised at a time in streamed lists, see utils.streaming
+STREAM_CHUNK_SIZE = 500
+
+# the number of seconds the facet counts of a file list are cached for each user
+FILE_FACETS_CACHE_TIMEOUT = 60
+
 # save csrf tokens in session instead of using double cookie to ease api scripting
 CSRF_USE_SESSIONS = True
 CSRF_COOKIE_SECURE = not DEBUG  # noqa: F405
@@ -6,4 +6,4 @@ from documents.models import Document
 class DocumentOutSchema(ModelSchema):
     class Config:
         model = Document
-        model_fields = "__all__"
+        model_exclude = ["search_vector"]
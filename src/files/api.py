@@ -1,39 +1,82 @@
+import functools
+import hashlib
 import logging
 from django.http import HttpResponse
-from users.models import User
 import uuid
 from typing import List
 from typing import Union
 
 import magic
+import orjson
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Exists
+from django.db.models import OuterRef
+from django.db.models import Prefetch
+from django.db.models import prefetch_related_objects
+from django.http import Http404
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from guardian.shortcuts import assign_perm, remove_perm
+from guardian.shortcuts import assign_perm
 from guardian.shortcuts import get_objects_for_user, get_objects_for_group
+from ninja import File
 from ninja import Query
 from ninja import Router
+from ninja.decorators import decorate_view
 from ninja.files import UploadedFile
 
 from .models import BaseFile
+from .models import StatusChoices
+from .models import UploadSession
+from .filters import FileChangesFilters
+from .filters import encode_watermark
 from .filters import FileFilters
+from .schema import FileChangesResponseSchema
+from .schema import FileFacetsResponseSchema
+from .schema import FileResponseSchema
+from .serializers import get_file_serializer
 from .schema import SingleFileResponseSchema
 from .schema import MultipleFileResponseSchema
-from .schema import FileTypeChoices
 from .schema import FileUpdateRequestSchema
 from .schema import UploadRequestSchema
 from .schema import MultipleFileRequestSchema
+from .schema import DigestRequestSchema
+from .schema import DigestResponseSchema
+from .schema import BatchUploadRequestSchema
+from .schema import BatchUploadResponseSchema
+from .schema import UploadSessionRequestSchema
+from .schema import UploadSessionResponseSchema
+from albums.models import Album
+from albums.models import AlbumMember
 from audios.models import Audio
 from audios.schema import AudioOutSchema
 from documents.models import Document
 from documents.schema import DocumentOutSchema
 from pictures.models import Picture
+from pictures.models import RenditionJob
 from pictures.schema import PictureOutSchema
+from utils.fields import validate_fields
+from utils.filters import SearchModeChoices
+from utils.pagination import get_next_cursor
+from utils.pagination import get_sorting
+from utils.pagination import get_total
+from utils.pagination import paginate
+from utils.permissions import assign_owner_permissions
+from utils.permissions import has_object_permission
+from utils.permissions import prefetch_object_permissions
 from utils.schema import ApiMessageSchema
+from utils.schema import get_response_envelope
+from utils.search import fuzzy_search
+from utils.search import search
+from utils.search import similarity_threshold
+from utils.streaming import stream_response
+from utils.upload import get_sha256
+from utils.upload import get_upload_path
+from utils.upload import limit_concurrent_uploads
 from files.schema import SingleFileResponseSchema
 from videos.models import Video
 from videos.schema import VideoOutSchema
@@ -47,39 +90,48 @@ router = Router()
 query = Query(...)
 
 
-@router.post(
-    "/upload/",
-    response={
-        201: SingleFileResponseSchema,
-        403: ApiMessageSchema,
-        422: ApiMessageSchema,
-    },
-    summary="Upload a new file.",
-)
-def upload(request, f: UploadedFile, metadata: UploadRequestSchema):
-    """API endpoint for file uploads."""
-    # find the filetype using libmagic by reading the first bit of the file
-    mime = magic.from_buffer(f.read(512), mime=True)
-
+def get_file_model(mime):
+    """Return the file model for a mimetype, or None if the filetype is not supported."""
     if mime in settings.ALLOWED_PICTURE_TYPES:
-        from pictures.models import Picture as Model
+        return Picture
     elif mime in settings.ALLOWED_VIDEO_TYPES:
-        from videos.models import Video as Model
+        return Video
     elif mime in settings.ALLOWED_AUDIO_TYPES:
-        from audios.models import Audio as Model
+        return Audio
     elif mime in settings.ALLOWED_DOCUMENT_TYPES:
-        from documents.models import Document as Model
-    else:
-        return 422, {"message": "File type not supported"}
+        return Document
+    return None
 
-    uploaded_file = Model(
-        owner=request.user,
-        original=f,
-        original_filename=f.name,
-        file_size=f.size,
-        **metadata.dict(),
+
+def get_existing_files(request, digests):
+    """Return the sha256 and uuid of the files of the user with one of the digests.
+
+    Only the user's own files count, a file uploaded by someone else would
+    leave the user without a file of their own.
+    """
+    return (
+        BaseFile.objects.filter(owner=request.user, sha256__in=digests)
+        .exclude(status=StatusChoices.PENDING_DELETION)
+        .values_list("sha256", "uuid")
     )
 
+
+def check_digest(request, digest, sha256=None):
+    """Return an error response if the digest sent by the client does not match or the file already exists."""
+    if not digest:
+        return None
+    if sha256 and digest != sha256:
+        # the client sent the digest of the file, make sure it matches
+        return 422, {"message": "Digest mismatch", "details": {"digest": sha256}}
+    # skip storing the file if it already exists
+    existing = get_existing_files(request, [digest]).first()
+    if existing:
+        return 409, {"message": "File already exists", "details": {"files": [existing[1]]}}
+    return None
+
+
+def clean_uploaded_file(uploaded_file, validate_unique=True):
+    """Set the defaults for a new file and validate it. Return True if the file is valid."""
     if not uploaded_file.title:
         # title defaults to the original filename
         uploaded_file.title = uploaded_file.original_filename
@@ -91,30 +143,335 @@ def upload(request, f: UploadedFile, metadata: UploadRequestSchema):
         ]
 
     try:
-        uploaded_file.full_clean()
+        uploaded_file.full_clean(validate_unique=validate_unique)
     except ValidationError:
+        return False
+    return True
+
+
+def save_uploaded_file(request, uploaded_file, upload_session=None):
+    """Validate and save a new file, queue renditions and assign the owner permissions.
+
+    If upload_session is given the file received by it is moved into place
+    after validation, otherwise the file is saved by the storage as usual.
+    """
+    if not clean_uploaded_file(uploaded_file):
         return 422, {"message": "Validation error"}
 
+    if upload_session:
+        upload_session.move(uploaded_file.original.name)
+
     # save everything
     uploaded_file.save()
 
-    # if the filetype is picture then use the picture itself as thumbnail,
-    # this has to be done after .save() to ensure the uuid filename and
-    # full path is passed to the imagekit namer
-    if (
-        uploaded_file.filetype == "picture"
-        and uploaded_file.thumbnail_url == settings.DEFAULT_THUMBNAIL_URLS["picture"]
-    ):
-        # use the large_thumbnail size as default
-        uploaded_file.thumbnail_url = uploaded_file.large_thumbnail.url
-        uploaded_file.save()
+    # if the filetype is picture then queue a job to generate renditions, the
+    # worker also sets the large_thumbnail as thumbnail if the default is used
+    if uploaded_file.filetype == "picture":
+        RenditionJob.objects.create(picture=uploaded_file)
 
     # assign permissions (publish_basefile and unpublish_basefile are assigned after moderation)
     assign_perm("view_basefile", request.user, uploaded_file)
     assign_perm("change_basefile", request.user, uploaded_file)
     assign_perm("delete_basefile", request.user, uploaded_file)
 
-    return 201, uploaded_file
+    return 201, {"bma_response": uploaded_file}
+
+
+def prefetch_albums(files):
+    """Load the album uuids of all files in one query instead of one query per file in the schema."""
+    prefetch_related_objects(files, Prefetch("albums", queryset=Album.objects.only("uuid")))
+
+
+@router.post(
+    "/upload/",
+    response={
+        201: SingleFileResponseSchema,
+        403: ApiMessageSchema,
+        409: ApiMessageSchema,
+        422: ApiMessageSchema,
+        429: ApiMessageSchema,
+    },
+    summary="Upload a new file.",
+)
+@decorate_view(limit_concurrent_uploads(router))
+def upload(request, f: UploadedFile, metadata: UploadRequestSchema):
+    """API endpoint for file uploads."""
+    # find the filetype using libmagic by reading the first bit of the file
+    Model = get_file_model(magic.from_buffer(f.read(512), mime=True))
+    if Model is None:
+        return 422, {"message": "File type not supported"}
+
+    # the digest is calculated by the upload handlers while the file is received
+    sha256 = get_sha256(f)
+    metadata = metadata.dict()
+    error = check_digest(request, metadata.pop("digest"), sha256)
+    if error:
+        return error
+
+    uploaded_file = Model(
+        owner=request.user,
+        original=f,
+        original_filename=f.name,
+        file_size=f.size,
+        sha256=sha256,
+        **metadata,
+    )
+    return save_uploaded_file(request, uploaded_file)
+
+
+@router.post(
+    "/upload/batch/",
+    response={
+        200: BatchUploadResponseSchema,
+        422: ApiMessageSchema,
+        429: ApiMessageSchema,
+    },
+    summary="Upload multiple files with shared metadata.",
+)
+@decorate_view(limit_concurrent_uploads(router))
+def upload_batch(
+    request,
+    metadata: BatchUploadRequestSchema,
+    files: List[UploadedFile] = File(...),
+):
+    """API endpoint for uploading many files in one request.
+
+    Each file is checked like in the single file upload, and the result for
+    each file has the status code it would have gotten from that endpoint.
+    The valid files are inserted and given permissions in bulk.
+    """
+    metadata = metadata.dict()
+    digests = metadata.pop("digests")
+    if not digests:
+        digests = [""] * len(files)
+    elif len(digests) != len(files):
+        return 422, {"message": "The number of digests does not match the number of files"}
+
+    # find the files which already exist in one query
+    existing = dict(get_existing_files(request, {digest for digest in digests if digest}))
+
+    results = []
+    new_files = []
+    for f, digest in zip(files, digests):
+        result = {"filename": f.name}
+        results.append(result)
+        Model = get_file_model(magic.from_buffer(f.read(512), mime=True))
+        if Model is None:
+            result.update(status=422, message="File type not supported")
+            continue
+        sha256 = get_sha256(f)
+        if digest and digest != sha256:
+            result.update(status=422, message="Digest mismatch", details={"digest": sha256})
+            continue
+        if digest in existing:
+            result.update(
+                status=409,
+                message="File already exists",
+                details={"files": [existing[digest]]},
+            )
+            continue
+        uploaded_file = Model(
+            owner=request.user,
+            original=f,
+            original_filename=f.name,
+            file_size=f.size,
+            sha256=sha256,
+            **metadata,
+        )
+        # the primary key is a new uuid4, skip the uniqueness check query for each file
+        if not clean_uploaded_file(uploaded_file, validate_unique=False):
+            result.update(status=422, message="Validation error")
+            continue
+        result.update(status=201, file=uploaded_file)
+        new_files.append(uploaded_file)
+        if digest:
+            # the same file twice in the batch is only stored once
+            existing[digest] = uploaded_file.uuid
+
+    with transaction.atomic():
+        BaseFile.objects.bulk_create_files(new_files)
+        # queue jobs to generate renditions for the pictures
+        RenditionJob.objects.bulk_create(
+            [RenditionJob(picture=f) for f in new_files if f.filetype == "picture"],
+        )
+        # assign permissions (publish_basefile and unpublish_basefile are assigned after moderation)
+        assign_owner_permissions(
+            ["view_basefile", "change_basefile", "delete_basefile"],
+            {f.uuid: request.user.pk for f in new_files},
+            BaseFile,
+        )
+
+    prefetch_albums(new_files)
+    prefetch_object_permissions(request, new_files)
+    return {"bma_response": results}
+
+
+@router.post(
+    "/uploads/",
+    response={
+        201: UploadSessionResponseSchema,
+        409: ApiMessageSchema,
+    },
+    summary="Start a resumable chunked upload.",
+)
+def upload_session_create(request, data: UploadSessionRequestSchema):
+    """Create an upload session. The file is then sent in chunks and the upload finalized when all chunks are received."""
+    metadata = data.metadata.dict()
+    # no need to send anything if the file already exists
+    error = check_digest(request, metadata["digest"])
+    if error:
+        return error
+    upload_session = UploadSession.objects.create(
+        owner=request.user,
+        filename=data.filename,
+        size=data.size,
+        metadata=metadata,
+    )
+    return 201, {"bma_response": upload_session}
+
+
+@router.get(
+    "/uploads/{session_uuid}/",
+    response={
+        200: UploadSessionResponseSchema,
+        404: ApiMessageSchema,
+    },
+    summary="Return an upload session, including the offset where the next chunk must start.",
+)
+def upload_session_get(request, session_uuid: uuid.UUID):
+    """Return an upload session so a client can resume an interrupted upload from the offset."""
+    upload_session = get_object_or_404(
+        UploadSession.objects.active(),
+        uuid=session_uuid,
+        owner=request.user,
+    )
+    return {"bma_response": upload_session}
+
+
+@router.put(
+    "/uploads/{session_uuid}/chunk/",
+    response={
+        200: UploadSessionResponseSchema,
+        404: ApiMessageSchema,
+        409: ApiMessageSchema,
+        422: ApiMessageSchema,
+        429: ApiMessageSchema,
+    },
+    summary="Append a chunk to an upload session.",
+)
+@decorate_view(limit_concurrent_uploads(router))
+def upload_session_chunk(request, session_uuid: uuid.UUID, offset: int):
+    """Append the raw request body to the upload at offset, which must be the current offset of the session."""
+    upload_session = get_object_or_404(
+        UploadSession.objects.active(),
+        uuid=session_uuid,
+        owner=request.user,
+    )
+    if offset == upload_session.offset:
+        try:
+            # the body is streamed to the file, it is never read into memory
+            appended = upload_session.append(request)
+        except ValueError as e:
+            return 422, {"message": str(e)}
+        if appended:
+            return {"bma_response": upload_session}
+        upload_session.offset = (
+            UploadSession.objects.filter(uuid=session_uuid).values_list("offset", flat=True).first()
+        )
+    # another chunk was written first, or is being written
+    return 409, {
+        "message": "Wrong offset",
+        "details": {"offset": upload_session.offset},
+    }
+
+
+@router.post(
+    "/uploads/{session_uuid}/finalize/",
+    response={
+        201: SingleFileResponseSchema,
+        404: ApiMessageSchema,
+        409: ApiMessageSchema,
+        422: ApiMessageSchema,
+    },
+    summary="Finish an upload session and create the file.",
+)
+def upload_session_finalize(request, session_uuid: uuid.UUID):
+    """Create the file from a complete upload session, moving the received file into place."""
+    upload_session = get_object_or_404(
+        UploadSession.objects.active(),
+        uuid=session_uuid,
+        owner=request.user,
+    )
+    if upload_session.offset != upload_session.size:
+        return 409, {
+            "message": "Upload is incomplete",
+            "details": {"offset": upload_session.offset},
+        }
+
+    with upload_session.path.open("rb") as f:
+        Model = get_file_model(magic.from_buffer(f.read(512), mime=True))
+    if Model is None:
+        return 422, {"message": "File type not supported"}
+
+    # a complete upload does not change, so it is hashed before anything is locked
+    sha256 = upload_session.get_sha256()
+    metadata = dict(upload_session.metadata)
+    error = check_digest(request, metadata.pop("digest", ""), sha256)
+    if error:
+        return error
+
+    uploaded_file = Model(
+        owner=request.user,
+        original_filename=upload_session.filename,
+        file_size=upload_session.size,
+        sha256=sha256,
+        **metadata,
+    )
+    uploaded_file.original = str(get_upload_path(uploaded_file, upload_session.filename))
+    try:
+        with transaction.atomic():
+            # lock the session so it is only finalized once
+            get_object_or_404(UploadSession.objects.select_for_update(), uuid=upload_session.uuid)
+            status, response = save_uploaded_file(request, uploaded_file, upload_session)
+            if status == 201:
+                upload_session.delete()
+    except Exception:
+        # the file was not created, move the received file back so the upload can be finalized again
+        upload_session.restore(uploaded_file.original.name)
+        raise
+    return status, response
+
+
+@router.delete(
+    "/uploads/{session_uuid}/",
+    response={
+        204: None,
+        404: ApiMessageSchema,
+    },
+    summary="Abort an upload session.",
+)
+def upload_session_delete(request, session_uuid: uuid.UUID):
+    """Delete an upload session and the data received so far."""
+    upload_session = get_object_or_404(
+        UploadSession,
+        uuid=session_uuid,
+        owner=request.user,
+    )
+    upload_session.delete()
+    return 204, None
+
+
+@router.post(
+    "/digests/",
+    response={200: DigestResponseSchema},
+    summary="Return the files of the user for a list of SHA-256 digests.",
+)
+def file_digests(request, data: DigestRequestSchema):
+    """Return the uuid of a file of the user for each digest which already exists, so clients can skip uploading them."""
+    existing = {}
+    for sha256, file_uuid in get_existing_files(request, set(data.digests)):
+        existing.setdefault(sha256, file_uuid)
+    return {"bma_response": existing}
 
 
 @router.patch(
@@ -129,7 +486,6 @@ def upload(request, f: UploadedFile, metadata: UploadRequestSchema):
 def file_approve_multiple(request, data: MultipleFileRequestSchema, check: bool = None):
     """Change the status of files PENDING_MODERATION to UNPUBLISHED."""
     files = data.dict()["files"]
-    allfiles = BaseFile.objects.filter(uuid__in=files)
     dbfiles = get_objects_for_user(
         request.user,
         "approve_basefile",
@@ -139,33 +495,38 @@ def file_approve_multiple(request, data: MultipleFileRequestSchema, check: bool
         ),
     )
     # we want all files to have the right status and the user to have approve_basefile permissions for all files
-    if dbfiles.count() < len(files):
+    allowed = set(dbfiles.values_list("uuid", flat=True))
+    denied = [file_uuid for file_uuid in files if file_uuid not in allowed]
+    if denied:
         return 403, {
-            "message": f"Wrong status or no permission to approve these {allfiles.difference(dbfiles).count()} files (of total {len(files)} files)",
-            "details": {"files": [f.uuid for f in allfiles.difference(dbfiles)]},
+            "message": f"Wrong status or no permission to approve these {len(denied)} files (of total {len(files)} files)",
+            "details": {"files": denied},
         }
     if check:
         # check mode requested, don't change anything
         return 202, {"message": "OK"}
     else:
-        # not check mode, do the thing
-        for basefile in dbfiles:
-            # use .update() to avoid race conditions
-            BaseFile.objects.filter(uuid=basefile.uuid).update(
-                status="UNPUBLISHED",
-                updated=timezone.now(),
-            )
-            assign_perm("publish_basefile", basefile.owner, basefile)
-            assign_perm("unpublish_basefile", basefile.owner, basefile)
+        # not check mode, do the thing in a single conditional UPDATE to avoid race conditions
+        updated = BaseFile.objects.filter(uuid__in=allowed).update_status(
+            from_status="PENDING_MODERATION",
+            to_status="UNPUBLISHED",
+        )
+        # grant publish/unpublish permissions to the owners, in bulk per owner
+        assign_owner_permissions(
+            ["publish_basefile", "unpublish_basefile"],
+            updated,
+            BaseFile,
+        )
         # return the response
         if request.htmx:
             return HttpResponse(
                 """<button class="btn btn-success" data-bs-dismiss="modal"><i class="fas fa-check"></i> Close</button>""",
             )
         else:
-            return BaseFile.objects.filter(
-                uuid__in=dbfiles.values_list("uuid", flat=True),
-            )
+            files = list(BaseFile.objects.filter(uuid__in=updated).with_filetypes())
+            prefetch_albums(files)
+            prefetch_object_permissions(request, files)
+            return {"bma_response": files}
 
 
 @router.patch(
@@ -180,7 +541,6 @@ def file_approve_multiple(request, data: MultipleFileRequestSchema, check: bool
 def file_publish_multiple(request, data: MultipleFileRequestSchema, check: bool = None):
     """Change the status of files from UNPUBLISHED to PUBLISHED."""
     files = data.dict()["files"]
-    allfiles = BaseFile.objects.filter(uuid__in=files)
     dbfiles = get_objects_for_user(
         request.user,
         "publish_basefile",
@@ -190,33 +550,32 @@ def file_publish_multiple(request, data: MultipleFileRequestSchema, check: bool
         ),
     )
     # we want all files to have the right status and the user to have publish_basefile permissions for all files
-    if dbfiles.count() < len(files):
+    allowed = set(dbfiles.values_list("uuid", flat=True))
+    denied = [file_uuid for file_uuid in files if file_uuid not in allowed]
+    if denied:
         return 403, {
-            "message": f"Wrong status or no permission to publish these {allfiles.difference(dbfiles).count()} files (of total {len(files)} files)",
-            "details": {"files": [f.uuid for f in allfiles.difference(dbfiles)]},
+            "message": f"Wrong status or no permission to publish these {len(denied)} files (of total {len(files)} files)",
+            "details": {"files": denied},
         }
     if check:
         # check mode requested, don't change anything
         return 202, {"message": "OK"}
     else:
-        # not check mode, do the thing
-        for basefile in dbfiles:
-            # use .update() to avoid race conditions
-            BaseFile.objects.filter(uuid=basefile.uuid).update(
-                status="PUBLISHED",
-                updated=timezone.now(),
-            )
-        # assign view_basefile permission to the anonymous user for all published files
-        assign_perm("view_basefile", User.get_anonymous(), dbfiles)
+        # not check mode, do the thing in a single conditional UPDATE to avoid race conditions
+        updated = BaseFile.objects.filter(uuid__in=allowed).update_status(
+            from_status="UNPUBLISHED",
+            to_status="PUBLISHED",
+        )
         # return the response
         if request.htmx:
             return HttpResponse(
                 """<button class="btn btn-success" data-bs-dismiss="modal"><i class="fas fa-check"></i> Close</button>""",
             )
         else:
-            return BaseFile.objects.filter(
-                uuid__in=dbfiles.values_list("uuid", flat=True),
-            )
+            files = list(BaseFile.objects.filter(uuid__in=updated).with_filetypes())
+            prefetch_albums(files)
+            prefetch_object_permissions(request, files)
+            return {"bma_response": files}
 
 
 @router.patch(
@@ -231,7 +590,6 @@ def file_publish_multiple(request, data: MultipleFileRequestSchema, check: bool
 def file_unpublish_multiple(request, data: MultipleFileRequestSchema, check: bool = None):
     """Change the status of files from PUBLISHED to UNPUBLISHED."""
     files = data.dict()["files"]
-    allfiles = BaseFile.objects.filter(uuid__in=files)
     dbfiles = get_objects_for_user(
         request.user,
         "unpublish_basefile",
@@ -240,34 +598,33 @@ def file_unpublish_multiple(request, data: MultipleFileRequestSchema, check: boo
             status="PUBLISHED",
         ),
     )
-    # we want all files to have the right status and the user to have approve_basefile permissions for all files
-    if dbfiles.count() < len(files):
+    # we want all files to have the right status and the user to have unpublish_basefile permissions for all files
+    allowed = set(dbfiles.values_list("uuid", flat=True))
+    denied = [file_uuid for file_uuid in files if file_uuid not in allowed]
+    if denied:
         return 403, {
-            "message": f"Wrong status or no permission to unpublish these {allfiles.difference(dbfiles).count()} files (of total {len(files)} files)",
-            "details": {"files": [f.uuid for f in allfiles.difference(dbfiles)]},
+            "message": f"Wrong status or no permission to unpublish these {len(denied)} files (of total {len(files)} files)",
+            "details": {"files": denied},
         }
     if check:
         # check mode requested, don't change anything
         return 202, {"message": "OK"}
     else:
-        # not check mode, do the thing
-        for basefile in dbfiles:
-            # use .update() to avoid race conditions
-            BaseFile.objects.filter(uuid=basefile.uuid).update(
-                status="UNPUBLISHED",
-                updated=timezone.now(),
-            )
-        # remove view_basefile permission from the anonymous user for all unpublished files
-        remove_perm("view_basefile", User.get_anonymous(), dbfiles)
+        # not check mode, do the thing in a single conditional UPDATE to avoid race conditions
+        updated = BaseFile.objects.filter(uuid__in=allowed).update_status(
+            from_status="PUBLISHED",
+            to_status="UNPUBLISHED",
+        )
         # return the response
         if request.htmx:
             return HttpResponse(
                 """<button class="btn btn-success" data-bs-dismiss="modal"><i class="fas fa-check"></i> Close</button>""",
             )
         else:
-            return BaseFile.objects.filter(
-                uuid__in=dbfiles.values_list("uuid", flat=True),
-            )
+            files = list(BaseFile.objects.filter(uuid__in=updated).with_filetypes())
+            prefetch_albums(files)
+            prefetch_object_permissions(request, files)
+            return {"bma_response": files}
 
 
 @router.patch(
@@ -285,7 +642,7 @@ def file_unpublish_multiple(request, data: MultipleFileRequestSchema, check: boo
 def file_approve(request, file_uuid: uuid.UUID, check: bool = None):
     """Approve a file and grant publish/unpublish permissions to the owner."""
     basefile = get_object_or_404(BaseFile, uuid=file_uuid)
-    if not request.user.has_perm("approve_basefile", basefile):
+    if not has_object_permission(request, "approve_basefile", basefile):
         return 403, {"message": "Permission denied."}
     if not basefile.status == "PENDING_MODERATION":
         return 403, {"message": f"Wrong status: {basefile.status}."}
@@ -319,7 +676,7 @@ def file_approve(request, file_uuid: uuid.UUID, check: bool = None):
 def file_unpublish(request, file_uuid: uuid.UUID, check: bool = None):
     """Change the status of a file to UNPUBLISHED."""
     basefile = get_object_or_404(BaseFile, uuid=file_uuid)
-    if not request.user.has_perm("unpublish_basefile", basefile):
+    if not has_object_permission(request, "unpublish_basefile", basefile):
         return 403, {"message": "Permission denied."}
     if check:
         # check mode requested, don't change anything
@@ -330,8 +687,6 @@ def file_unpublish(request, file_uuid: uuid.UUID, check: bool = None):
             updated=timezone.now(),
         )
         basefile.refresh_from_db()
-        # remove view_basefile permission from the anonymous user
-        remove_perm("view_basefile", User.get_anonymous(), basefile)
         return basefile
 
 
@@ -349,7 +704,7 @@ def file_unpublish(request, file_uuid: uuid.UUID, check: bool = None):
 def file_publish(request, file_uuid: uuid.UUID, check: bool = None):
     """Change the status of a file to PUBLISHED."""
     basefile = get_object_or_404(BaseFile, uuid=file_uuid)
-    if not request.user.has_perm("publish_basefile", basefile):
+    if not has_object_permission(request, "publish_basefile", basefile):
         return 403, {"message": "Permission denied."}
     if check:
         # check mode requested, don't change anything
@@ -360,10 +715,104 @@ def file_publish(request, file_uuid: uuid.UUID, check: bool = None):
             updated=timezone.now(),
         )
         basefile.refresh_from_db()
-        # assign view_basefile permission to the anonymous user
-        assign_perm("view_basefile", User.get_anonymous(), basefile)
         return basefile
 
+def get_facets_cache_key(request, filters):
+    """Return the cache key for the facets of the files matching filters, for anonymous users or the user of the request."""
+    visibility = f"user:{request.user.pk}" if request.user.is_authenticated else "anonymous"
+    # pagination, sorting and output options do not change the counts
+    values = filters.dict(exclude={"limit", "offset", "cursor", "sorting", "fields", "stream", "total"})
+    digest = hashlib.sha256(orjson.dumps(values, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return f"bma:file_facets:{visibility}:{digest}"
+
+
+@router.get(
+    "/facets/",
+    response={200: FileFacetsResponseSchema},
+    summary="Return the number of files for each filetype, status, license, owner and album.",
+    auth=None,
+)
+def file_facets(request, filters: FileFilters = query):
+    """Return the number of matching files for each value of the filetypes, statuses, licenses, owners and albums filters."""
+    key = get_facets_cache_key(request, filters)
+    facets = cache.get(key)
+    if facets is None:
+        with similarity_threshold(filters.similarity_threshold):
+            facets = get_filtered_files(request, filters).facets()
+        # the counts may be a little out of date, refreshing them while typing a search is cheap
+        cache.set(key, facets, settings.FILE_FACETS_CACHE_TIMEOUT)
+    return {"bma_response": facets}
+
+
+def get_changes_horizon():
+    """Return the id of the oldest transaction which is still running, or the next transaction id if none are.
+
+    Changes from transactions before the horizon are all committed or rolled
+    back. The changes feed stops at the horizon, so a transaction which commits
+    late can not write changes behind a watermark handed out already.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+        return cursor.fetchone()[0]
+
+
+@router.get(
+    "/changes/",
+    response={200: FileChangesResponseSchema},
+    summary="Return the files changed since a watermark, with tombstones for files to remove.",
+    auth=None,
+)
+def file_changes(request, filters: FileChangesFilters = query):
+    """Return the files created or changed since the watermark in filters.since, in the order they were changed.
+
+    The watermark is a cursor over the id of the transaction which last changed
+    each file, set by a database trigger, and the transaction horizon when the
+    first sync of the client started. Files marked for deletion and files which
+    were unpublished after that are returned as tombstones, so a client is never
+    told about files which were hidden before it could see them.
+    """
+    horizon = get_changes_horizon()
+    start_xid = filters.start_xid if filters.since else horizon
+    visible = BaseFile.objects.visible_to(request.user).filter(uuid=OuterRef("uuid"))
+    files = (
+        BaseFile.objects.non_polymorphic()
+        .filter(change_xid__lt=horizon)
+        .annotate(visible=Exists(visible.non_polymorphic()))
+        .values_list("uuid", "change_xid", "updated", "status", "unpublished_xid", "visible", named=True)
+    )
+    page, next_cursor = paginate(files, filters)
+
+    changed = []
+    tombstones = []
+    for row in page:
+        deleted = row.status == StatusChoices.PENDING_DELETION
+        if row.visible and not deleted:
+            changed.append(row.uuid)
+        elif row.visible or (row.unpublished_xid is not None and row.unpublished_xid >= start_xid):
+            # the user can see the file, or it was unpublished after the client started syncing
+            reason = "deleted" if deleted else "hidden"
+            tombstones.append({"uuid": row.uuid, "updated": row.updated, "reason": reason})
+
+    serializer = get_file_serializer()
+    rows = serializer.get_rows(BaseFile.objects.filter(uuid__in=changed).order_by("change_xid", "uuid"))
+    if page:
+        watermark = encode_watermark(next_cursor or get_next_cursor(page[-1], filters), start_xid)
+    else:
+        # nothing changed, keep the watermark
+        watermark = filters.since or encode_watermark(None, start_xid)
+
+    # the serialiser output matches FileChangesResponseSchema, so it is not validated again
+    data = get_response_envelope(request)
+    data.update(
+        {
+            "bma_response": {"files": serializer.serialize(rows, request), "tombstones": tombstones},
+            "watermark": watermark,
+            "more": next_cursor is not None,
+        },
+    )
+    return router.api.create_response(request, data, status=200)
+
+
 @router.get(
     "/{file_uuid}/",
     response={
@@ -374,54 +823,43 @@ def file_publish(request, file_uuid: uuid.UUID, check: bool = None):
     summary="Return the metadata of a file.",
     auth=None,
 )
-def file_get(request, file_uuid: uuid.UUID):
+def file_get(request, file_uuid: uuid.UUID, fields: List[str] = Query(None)):
     """Return a file object."""
-    basefile = get_object_or_404(BaseFile, uuid=file_uuid)
-    if basefile.status == "PUBLISHED" or request.user.has_perm(
+    if fields:
+        fields = validate_fields(FileResponseSchema, fields)
+    serializer = get_file_serializer(fields or None)
+    rows = serializer.get_rows(BaseFile.objects.filter(uuid=file_uuid))
+    if not rows:
+        raise Http404()
+    if rows[0].status == StatusChoices.PUBLISHED or has_object_permission(
+        request,
         "view_basefile",
-        basefile,
+        BaseFile(uuid=file_uuid),
     ):
-        # https://github.com/vitalik/django-ninja/issues/610
-        #return 200, {"bma_response": basefile}
-        return HttpResponse(SingleFileResponseSchema.from_orm({"bma_response": basefile}).json(), content_type="application/json")
+        # the serialiser output matches SingleFileResponseSchema, so it is not validated again
+        data = get_response_envelope(request)
+        data["bma_response"] = serializer.serialize(rows, request)[0]
+        return router.api.create_response(request, data, status=200)
     else:
         return 403, {"message": "Permission denied."}
 
 
-@router.get(
-    "/",
-    response={200: MultipleFileResponseSchema},
-    summary="Return a list of files.",
-    auth=None,
-)
-def file_list(request, filters: FileFilters = query):
-    """Return a list of files."""
+def get_filtered_files(request, filters):
+    """Return the files visible to the user of the request which match the filters of file_list."""
     # start out with a list of all PUBLISHED files plus whatever else the user has explicit access to
-    files = BaseFile.objects.filter(status="PUBLISHED") | get_objects_for_user(
-        request.user,
-        "files.view_basefile",
-    )
-    files = files.distinct()
+    files = BaseFile.objects.visible_to(request.user)
 
     if filters.albums:
-        files = files.filter(albums__in=filters.albums)
+        # use a subquery so files in more than one of the albums are not returned twice
+        files = files.filter(
+            uuid__in=AlbumMember.objects.filter(album__in=filters.albums).values("basefile"),
+        )
 
     if filters.statuses:
         files = files.filter(status__in=filters.statuses)
 
     if filters.filetypes:
-        query = Q()
-        for filetype in filters.filetypes:
-            # this could probably be more clever somehow
-            if filetype == FileTypeChoices.picture:
-                query |= Q(instance_of=Picture)
-            elif filetype == FileTypeChoices.video:
-                query |= Q(instance_of=Video)
-            elif filetype == FileTypeChoices.audio:
-                query |= Q(instance_of=Audio)
-            elif filetype == FileTypeChoices.document:
-                query |= Q(instance_of=Document)
-        files = files.filter(query)
+        files = files.filter(filetype__in=filters.filetypes)
 
     if filters.owners:
         files = files.filter(owner__in=filters.owners)
@@ -439,26 +877,51 @@ def file_list(request, filters: FileFilters = query):
         files = files.filter(file_size__gt=filters.size_gt)
 
     if filters.search:
-        # we search title and description fields for now
-        files = files.filter(title__icontains=filters.search) | files.filter(
-            description__icontains=filters.search,
-        )
-
-    if filters.sorting:
-        if filters.sorting.endswith("_asc"):
-            # remove _asc and add +
-            files = files.order_by(f"{filters.sorting[:-4]}")
+        if filters.search_mode == SearchModeChoices.fuzzy:
+            files = fuzzy_search(files, filters.search, ["title", "original_filename"])
         else:
-            # remove _desc and add -
-            files = files.order_by(f"-{filters.sorting[:-5]}")
+            files = search(files, filters.search)
 
-    if filters.offset:
-        files = files[filters.offset :]
+    return files
+
+
+@router.get(
+    "/",
+    response={200: MultipleFileResponseSchema},
+    summary="Return a list of files.",
+    auth=None,
+)
+def file_list(request, filters: FileFilters = query):
+    """Return a list of files."""
+    files = get_filtered_files(request, filters)
+
+    if filters.fields:
+        filters.fields = validate_fields(FileResponseSchema, filters.fields)
+    # only read the columns needed for the requested fields, and the sort field for the cursor
+    serializer = get_file_serializer(filters.fields or None)
+    rows = serializer.get_rows(files, columns=[get_sorting(filters.sorting)[0]])
+
+    if filters.stream:
+        # serialise the files while they are read from the database, one chunk at a time
+        return stream_response(
+            request,
+            rows,
+            filters,
+            functools.partial(serializer.serialize, request=request),
+            total_queryset=files,
+        )
 
-    if filters.limit:
-        files = files[: filters.limit]
+    totals = {"total": None, "total_exact": None}
+    with similarity_threshold(filters.similarity_threshold):
+        rows, next_cursor = paginate(rows, filters)
+        if filters.total:
+            # counted after paginate() has validated the cursor
+            totals["total"], totals["total_exact"] = get_total(files)
 
-    return {"bma_response": list(files)}
+    # the serialiser output matches MultipleFileResponseSchema, so it is not validated again
+    data = get_response_envelope(request)
+    data.update({"bma_response": serializer.serialize(rows, request), "next_cursor": next_cursor, **totals})
+    return router.api.create_response(request, data, status=200)
 
 
 @router.put(
@@ -493,7 +956,7 @@ def file_update(
 ):
     """Update (PATCH) or replace (PUT) a file object."""
     basefile = get_object_or_404(BaseFile, uuid=file_uuid)
-    if not request.user.has_perm("change_basefile", basefile):
+    if not has_object_permission(request, "change_basefile", basefile):
         return 403, {"message": "Permission denied."}
     if check:
         # check mode requested, don't change anything
@@ -506,6 +969,8 @@ def file_update(
                     **metadata.dict(exclude_unset=True), updated=timezone.now()
                 )
                 basefile.refresh_from_db()
+                # .update() does not call save(), which updates the search vector
+                basefile.update_search_vector()
                 basefile.full_clean()
         except ValidationError:
             return 422, {"message": "Validation error"}
@@ -517,10 +982,12 @@ def file_update(
                     **metadata.dict(exclude_unset=False), updated=timezone.now()
                 )
                 basefile.refresh_from_db()
+                # .update() does not call save(), which updates the search vector
+                basefile.update_search_vector()
                 basefile.full_clean()
         except ValidationError:
             return 422, {"message": "Validation error"}
-    return basefile
+    return {"bma_response": basefile}
 
 
 @router.delete(
@@ -536,7 +1003,7 @@ def file_update(
 def file_delete(request, file_uuid: uuid.UUID, check: bool = None):
     """Mark a file for deletion."""
     basefile = get_object_or_404(BaseFile, uuid=file_uuid)
-    if not request.user.has_perm("delete_basefile", basefile):
+    if not has_object_permission(request, "delete_basefile", basefile):
         return 403, {"message": "Permission denied."}
     if check:
         # check mode requested, don't change anything
@@ -1,5 +1,11 @@
-from typing import Optional, List
-from utils.filters import ListFilters, SortingChoices
+import base64
+import binascii
+from typing import ClassVar, Optional, List
+import orjson
+from ninja import Field
+from ninja import Schema
+from ninja.errors import ValidationError
+from utils.filters import ListFilters, SortingChoices, StreamChoices
 from .models import FileTypeChoices
 import uuid
 from .models import LicenseChoices
@@ -17,3 +23,44 @@ class FileFilters(ListFilters):
     size: int = None
     size_lt: int = None
     size_gt: int = None
+    stream: StreamChoices = None
+
+
+def encode_watermark(cursor, start_xid):
+    """Return an opaque watermark for the file_changes endpoint.
+
+    cursor is the position in the changes feed, start_xid is the transaction
+    horizon when the first sync of the client started.
+    """
+    return base64.urlsafe_b64encode(orjson.dumps([cursor, start_xid])).decode()
+
+
+def decode_watermark(watermark):
+    """Return the cursor and start_xid from a watermark made by encode_watermark()."""
+    try:
+        cursor, start_xid = orjson.loads(base64.urlsafe_b64decode(watermark))
+        return cursor, int(start_xid)
+    except (binascii.Error, orjson.JSONDecodeError, ValueError, TypeError):
+        raise ValidationError([{"loc": ["query", "since"], "msg": "Invalid watermark"}])
+
+
+class FileChangesFilters(Schema):
+    """The filters used for the file_changes endpoint.
+
+    The watermark in since holds a cursor over the files sorted by change_xid,
+    so the filters can be used with utils.pagination.paginate().
+    """
+
+    since: str = None
+    limit: int = Field(1000, ge=1)
+
+    sorting: ClassVar[str] = "change_xid_asc"
+    offset: ClassVar[int] = None
+
+    @property
+    def cursor(self):
+        return decode_watermark(self.since)[0] if self.since else None
+
+    @property
+    def start_xid(self):
+        return decode_watermark(self.since)[1] if self.since else None
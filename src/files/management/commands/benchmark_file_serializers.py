@@ -0,0 +1,70 @@
+import statistics
+import time
+
+import orjson
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from files.models import BaseFile
+from files.schema import FileResponseSchema
+from files.serializers import get_file_serializer
+from utils.permissions import prefetch_object_permissions
+
+
+def serialize_schema(request, limit):
+    """Load and serialise files like file_list did, with one FileResponseSchema per file."""
+    files = list(BaseFile.objects.order_by("created").with_filetypes()[:limit])
+    prefetch_object_permissions(request, files)
+    return orjson.dumps(
+        [FileResponseSchema.model_validate(f, context={"request": request}).model_dump() for f in files],
+    )
+
+
+def serialize_fast(request, limit):
+    """Load and serialise files with the fast file serialiser."""
+    serializer = get_file_serializer()
+    rows = serializer.get_rows(BaseFile.objects.order_by("created"))[:limit]
+    return orjson.dumps(serializer.serialize(rows, request))
+
+
+SERIALIZERS = {
+    "schema": serialize_schema,
+    "fast": serialize_fast,
+}
+
+
+class Command(BaseCommand):
+    help = "Compare the throughput of FileResponseSchema and the fast file serialiser on the files in the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=1000,
+            help="The number of files to serialise in each run.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="The number of runs with each serialiser.",
+        )
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        count = min(options["limit"], BaseFile.objects.count())
+        if not count:
+            self.stdout.write("No files to serialise.")
+            return
+        for name, serialize in SERIALIZERS.items():
+            durations = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                serialize(request, options["limit"])
+                durations.append(time.perf_counter() - start)
+            duration = statistics.median(durations)
+            self.stdout.write(
+                f"  {name:<10} {duration * 1000:8.1f} ms   {count / duration:10.0f} files/s",
+            )
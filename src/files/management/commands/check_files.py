@@ -0,0 +1,42 @@
+import logging
+import os
+
+from django.core.management.base import BaseCommand
+
+from files.models import BaseFile
+
+logger = logging.getLogger("bma")
+
+
+class Command(BaseCommand):
+    help = "Check that the original of each file exists on disk, and update missing_on_disk and file_size."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of files to read from the database at a time.",
+        )
+
+    def handle(self, *args, **options):
+        missing = found = resized = 0
+        for basefile in BaseFile.objects.iterator(chunk_size=options["batch_size"]):
+            try:
+                size = os.stat(basefile.original.path).st_size
+            except OSError:
+                if not basefile.missing_on_disk:
+                    logger.warning(f"File {basefile.uuid} is missing from disk")
+                    # use .update() to avoid race conditions
+                    BaseFile.objects.filter(uuid=basefile.uuid).update(missing_on_disk=True)
+                    missing += 1
+                continue
+            if basefile.missing_on_disk:
+                logger.info(f"File {basefile.uuid} is back on disk")
+                BaseFile.objects.filter(uuid=basefile.uuid).update(missing_on_disk=False)
+                found += 1
+            if size != basefile.file_size:
+                logger.warning(f"File {basefile.uuid} is {size} bytes on disk but {basefile.file_size} bytes in the database")
+                BaseFile.objects.filter(uuid=basefile.uuid).update(file_size=size)
+                resized += 1
+        logger.info(f"Checked files, {missing} newly missing, {found} found again, {resized} with a changed size")
@@ -0,0 +1,39 @@
+import logging
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from files.models import UploadSession
+
+logger = logging.getLogger("bma")
+
+
+class Command(BaseCommand):
+    help = "Delete expired upload sessions, and .part files in MEDIA_ROOT/upload_sessions without a session."
+
+    def handle(self, *args, **options):
+        sessions = 0
+        for upload_session in UploadSession.objects.expired().iterator():
+            logger.info(f"Deleting expired upload session {upload_session.uuid}")
+            # delete() also removes the .part file
+            upload_session.delete()
+            sessions += 1
+
+        orphans = 0
+        directory = Path(settings.MEDIA_ROOT) / "upload_sessions"
+        # only files as old as an expired session, so a chunk being written right now is never removed
+        cutoff = time.time() - settings.UPLOAD_SESSION_EXPIRY
+        for path in directory.glob("*.part") if directory.exists() else []:
+            try:
+                session_uuid = uuid.UUID(path.stem)
+            except ValueError:
+                continue
+            if path.stat().st_mtime > cutoff or UploadSession.objects.filter(uuid=session_uuid).exists():
+                continue
+            logger.info(f"Deleting {path} which has no upload session")
+            path.unlink(missing_ok=True)
+            orphans += 1
+        logger.info(f"Deleted {sessions} expired upload sessions and {orphans} files without a session")
@@ -0,0 +1,27 @@
+import hashlib
+import logging
+
+from django.core.management.base import BaseCommand
+
+from files.models import BaseFile
+
+logger = logging.getLogger("bma")
+
+
+class Command(BaseCommand):
+    help = "Calculate the SHA-256 digest of files which do not have one."
+
+    def handle(self, *args, **options):
+        for basefile in BaseFile.objects.filter(sha256="").iterator():
+            sha256 = hashlib.sha256()
+            try:
+                with basefile.original.open("rb") as f:
+                    for chunk in f.chunks():
+                        sha256.update(chunk)
+            except OSError:
+                # maybe file is missing from disk
+                logger.warning(f"Unable to calculate the digest of file {basefile.uuid}")
+                continue
+            # use .update() to avoid race conditions
+            BaseFile.objects.filter(uuid=basefile.uuid).update(sha256=sha256.hexdigest())
+            logger.debug(f"Calculated the digest of file {basefile.uuid}")
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("files", "0003_alter_basefile_source"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="basefile",
+            index=models.Index(
+                fields=["created", "uuid"], name="basefile_created_uuid_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="basefile",
+            index=models.Index(
+                fields=["updated", "uuid"], name="basefile_updated_uuid_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="basefile",
+            index=models.Index(
+                fields=["title", "uuid"], name="basefile_title_uuid_idx"
+            ),
+        ),
+    ]
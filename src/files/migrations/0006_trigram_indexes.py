@@ -0,0 +1,35 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:30
+
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("files", "0005_search_vector"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name="basefile",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["title"],
+                name="basefile_title_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="basefile",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["original_filename"],
+                name="basefile_filename_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
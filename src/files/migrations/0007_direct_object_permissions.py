@@ -0,0 +1,164 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from guardian.conf import settings as guardian_settings
+
+
+def move_object_permissions(apps, schema_editor):
+    """Move file permissions from the generic guardian tables to the direct foreign key tables.
+
+    The view_basefile permissions of the anonymous user are dropped, anonymous
+    access to files is based on the status now.
+    """
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    try:
+        ctype = ContentType.objects.get(app_label="files", model="basefile")
+    except ContentType.DoesNotExist:
+        # new database, nothing to move
+        return
+    UserObjectPermission = apps.get_model("guardian", "UserObjectPermission")
+    GroupObjectPermission = apps.get_model("guardian", "GroupObjectPermission")
+    BaseFileUserObjectPermission = apps.get_model("files", "BaseFileUserObjectPermission")
+    BaseFileGroupObjectPermission = apps.get_model("files", "BaseFileGroupObjectPermission")
+    BaseFile = apps.get_model("files", "BaseFile")
+    pks = {str(pk) for pk in BaseFile.objects.values_list("uuid", flat=True)}
+
+    user_perms = UserObjectPermission.objects.filter(content_type=ctype)
+    BaseFileUserObjectPermission.objects.bulk_create(
+        [
+            BaseFileUserObjectPermission(
+                user_id=perm.user_id,
+                permission_id=perm.permission_id,
+                content_object_id=perm.object_pk,
+            )
+            for perm in user_perms.exclude(
+                user__username=guardian_settings.ANONYMOUS_USER_NAME,
+                permission__codename="view_basefile",
+            )
+            if perm.object_pk in pks
+        ],
+        ignore_conflicts=True,
+    )
+    user_perms.delete()
+
+    group_perms = GroupObjectPermission.objects.filter(content_type=ctype)
+    BaseFileGroupObjectPermission.objects.bulk_create(
+        [
+            BaseFileGroupObjectPermission(
+                group_id=perm.group_id,
+                permission_id=perm.permission_id,
+                content_object_id=perm.object_pk,
+            )
+            for perm in group_perms
+            if perm.object_pk in pks
+        ],
+        ignore_conflicts=True,
+    )
+    group_perms.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("files", "0006_trigram_indexes"),
+        ("guardian", "0002_generic_permissions_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BaseFileGroupObjectPermission",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="BaseFileUserObjectPermission",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name="basefile",
+            index=models.Index(
+                fields=["status", "created", "uuid"], name="basefile_status_created_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="basefilegroupobjectpermission",
+            name="content_object",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="files.basefile"
+            ),
+        ),
+        migrations.AddField(
+            model_name="basefilegroupobjectpermission",
+            name="group",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="auth.group"
+            ),
+        ),
+        migrations.AddField(
+            model_name="basefilegroupobjectpermission",
+            name="permission",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="auth.permission"
+            ),
+        ),
+        migrations.AddField(
+            model_name="basefileuserobjectpermission",
+            name="content_object",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="files.basefile"
+            ),
+        ),
+        migrations.AddField(
+            model_name="basefileuserobjectpermission",
+            name="permission",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="auth.permission"
+            ),
+        ),
+        migrations.AddField(
+            model_name="basefileuserobjectpermission",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="basefilegroupobjectpermission",
+            unique_together={("group", "permission", "content_object")},
+        ),
+        migrations.AlterUniqueTogether(
+            name="basefileuserobjectpermission",
+            unique_together={("user", "permission", "content_object")},
+        ),
+        migrations.RunPython(move_object_permissions, migrations.RunPython.noop),
+    ]
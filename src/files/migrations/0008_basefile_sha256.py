@@ -0,0 +1,24 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("files", "0007_direct_object_permissions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="basefile",
+            name="sha256",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                help_text="The SHA-256 digest of the file, as a hex string.",
+                max_length=64,
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("files", "0009_upload_sessions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="basefile",
+            name="missing_on_disk",
+            field=models.BooleanField(
+                default=False,
+                editable=False,
+                help_text="True if the file was missing from disk when last checked by the check_files command.",
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.3 on 2026-10-18 19:10
+
+from django.db import migrations, models
+from django.db.models import OuterRef
+from django.db.models import Subquery
+
+
+def backfill_filetype(apps, schema_editor):
+    """Set the filetype of existing files from the model of their polymorphic content type."""
+    BaseFile = apps.get_model("files", "BaseFile")
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    BaseFile.objects.update(
+        filetype=Subquery(
+            ContentType.objects.filter(pk=OuterRef("polymorphic_ctype")).values("model")[:1],
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("files", "0010_basefile_missing_on_disk"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="basefile",
+            name="filetype",
+            field=models.CharField(
+                choices=[
+                    ("picture", "Picture"),
+                    ("video", "Video"),
+                    ("audio", "Audio"),
+                    ("document", "Document"),
+                ],
+                db_index=True,
+                default="",
+                editable=False,
+                help_text="The filetype of this file, the name of the filetype model. Set when the file is created.",
+                max_length=20,
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_filetype, migrations.RunPython.noop),
+    ]
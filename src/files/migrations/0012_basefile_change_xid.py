@@ -0,0 +1,63 @@
+# Generated by Django 5.0.3 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+# the trigger sets change_xid on every write, and unpublished_xid when the status
+# changes from PUBLISHED, so the columns are correct whichever code writes the row
+CREATE_TRIGGER = """
+CREATE FUNCTION files_basefile_set_change_xid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id()::text::bigint;
+    IF TG_OP = 'INSERT' THEN
+        NEW.unpublished_xid := NULL;
+    ELSIF OLD.status = 'PUBLISHED' AND NEW.status <> 'PUBLISHED' THEN
+        NEW.unpublished_xid := NEW.change_xid;
+    ELSE
+        NEW.unpublished_xid := OLD.unpublished_xid;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER files_basefile_change_xid
+    BEFORE INSERT OR UPDATE ON files_basefile
+    FOR EACH ROW EXECUTE FUNCTION files_basefile_set_change_xid();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER files_basefile_change_xid ON files_basefile;
+DROP FUNCTION files_basefile_set_change_xid();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("files", "0011_basefile_filetype"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="basefile",
+            name="change_xid",
+            field=models.BigIntegerField(
+                default=0,
+                editable=False,
+                help_text="The id of the transaction which last changed this file. Set by the database.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="basefile",
+            name="unpublished_xid",
+            field=models.BigIntegerField(
+                editable=False,
+                help_text="The id of the transaction which last changed the status of this file from published. Set by the database.",
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="basefile",
+            index=models.Index(fields=["change_xid", "uuid"], name="basefile_change_xid_uuid_idx"),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
@@ -1,11 +1,29 @@
+import fcntl
+import hashlib
+import os
 import uuid
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
 
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection
 from django.db import models
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.query import ModelIterable
+from django.utils import timezone
+from guardian.models import GroupObjectPermissionBase
+from guardian.models import UserObjectPermissionBase
+from polymorphic.managers import PolymorphicManager
 from polymorphic.models import PolymorphicModel
+from polymorphic.query import PolymorphicQuerySet
 
 from .validators import validate_thumbnail_url
 from users.sentinel import get_sentinel_user
+from utils.search import update_search_vectors
 
 
 class StatusChoices(models.TextChoices):
@@ -37,6 +55,150 @@ class FileTypeChoices(models.TextChoices):
     document = ("document", "Document")
 
 
+class FileTypeIterable(ModelIterable):
+    """Yield the filetype model instance of each BaseFile row, from the tables joined by select_related()."""
+
+    def __iter__(self):
+        annotations = list(self.queryset.query.annotation_select)
+        for basefile in super().__iter__():
+            # polymorphic replaces the child accessors with a query, use the cached instance
+            instance = basefile._meta.get_field(basefile.filetype).get_cached_value(basefile)
+            for name in annotations:
+                # annotations like the search relevance are only set on the base instance
+                setattr(instance, name, getattr(basefile, name))
+            yield instance
+
+
+# the columns counted by BaseFileQuerySet.facets(), named like the file_list filters
+FACET_COLUMNS = {
+    "filetypes": "f.filetype",
+    "statuses": "f.status",
+    "licenses": "f.license",
+    "owners": "f.owner_id",
+    "albums": "m.album_id",
+}
+
+
+class BaseFileQuerySet(PolymorphicQuerySet):
+    """The queryset used by the BaseFile manager."""
+
+    def with_filetypes(self):
+        """Return the files as filetype model instances loaded with one joined query.
+
+        A polymorphic queryset loads the base table rows first and then runs one
+        query for each filetype found. This queryset joins the filetype tables
+        instead, and uses the filetype column to find the instance to return.
+        """
+        queryset = self.non_polymorphic().select_related(*FileTypeChoices.values)
+        queryset._iterable_class = FileTypeIterable
+        return queryset
+
+    def visible_to(self, user):
+        """Return the files the user is allowed to see.
+
+        Published files are visible to everyone based on the status alone. Other
+        files are visible to users with view_basefile permission for the file,
+        found with indexed lookups in the direct foreign key permission tables.
+        """
+        if user.is_superuser:
+            return self.all()
+        query = Q(status=StatusChoices.PUBLISHED)
+        if user.is_authenticated:
+            query |= Q(
+                uuid__in=BaseFileUserObjectPermission.objects.filter(
+                    user=user,
+                    permission__codename="view_basefile",
+                ).values("content_object_id"),
+            )
+            query |= Q(
+                uuid__in=BaseFileGroupObjectPermission.objects.filter(
+                    group__user=user,
+                    permission__codename="view_basefile",
+                ).values("content_object_id"),
+            )
+        return self.filter(query)
+
+    def bulk_create_files(self, files):
+        """Insert new files of any filetype with one INSERT for the base table and one for each filetype.
+
+        Django can not bulk_create() models using multi-table inheritance, so the
+        rows are inserted table by table. The files are written to storage while
+        inserting. save() is not called, so the search vectors are updated here.
+        """
+        files = list(files)
+        by_model = defaultdict(list)
+        for basefile in files:
+            # the parent link is the primary key of the filetype table
+            for field in basefile._meta.parents.values():
+                setattr(basefile, field.attname, basefile.uuid)
+            by_model[type(basefile)].append(basefile)
+        with transaction.atomic(using=self.db):
+            # inserts the base table rows only, the polymorphic content type is set by the queryset
+            self.bulk_create(files)
+            for model, objs in by_model.items():
+                model._base_manager._insert(
+                    objs,
+                    fields=model._meta.local_concrete_fields,
+                    using=self.db,
+                )
+            update_search_vectors(
+                self.model.objects.non_polymorphic().filter(uuid__in=[f.uuid for f in files]),
+            )
+        return files
+
+    def update_status(self, from_status, to_status):
+        """Change the status of the files in this queryset from from_status to to_status.
+
+        This is done in a single conditional UPDATE, so files which no longer have
+        from_status are skipped. Returns a dict of owner ids keyed by the uuid of
+        each changed file.
+        """
+        # the ORM has no UPDATE ... RETURNING, use the queryset as a subquery in a raw UPDATE
+        subquery, params = self.non_polymorphic().order_by().values("uuid").query.sql_with_params()
+        table = connection.ops.quote_name(BaseFile._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET status = %s, updated = %s "
+                f"WHERE status = %s AND uuid IN ({subquery}) RETURNING uuid, owner_id",
+                [to_status, timezone.now(), from_status, *params],
+            )
+            return dict(cursor.fetchall())
+
+    def facets(self):
+        """Return the number of files in this queryset for each value of the columns in FACET_COLUMNS.
+
+        All counts are found with one grouped query using grouping sets. Returns a
+        dict with a dict of counts keyed by value for each facet. Files are
+        counted once for each album they are in.
+        """
+        subquery, params = self.non_polymorphic().order_by().values("uuid").query.sql_with_params()
+        table = connection.ops.quote_name(BaseFile._meta.db_table)
+        members = connection.ops.quote_name(BaseFile._meta.get_field("albums").through._meta.db_table)
+        columns = ", ".join(FACET_COLUMNS.values())
+        grouping_sets = ", ".join(f"({column})" for column in FACET_COLUMNS.values())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {columns}, GROUPING({columns}), COUNT(DISTINCT f.uuid) "
+                f"FROM {table} f LEFT JOIN {members} m ON m.basefile_id = f.uuid "
+                f"WHERE f.uuid IN ({subquery}) GROUP BY GROUPING SETS ({grouping_sets})",
+                params,
+            )
+            rows = cursor.fetchall()
+        # GROUPING() sets the bits of the columns a row is not grouped by, the first column is the highest bit
+        all_bits = 2 ** len(FACET_COLUMNS) - 1
+        groupings = {
+            all_bits ^ 2 ** (len(FACET_COLUMNS) - 1 - index): (index, name)
+            for index, name in enumerate(FACET_COLUMNS)
+        }
+        facets = {name: {} for name in FACET_COLUMNS}
+        for *values, grouping, count in rows:
+            index, name = groupings[grouping]
+            # the album is null for files which are not in any album
+            if values[index] is not None:
+                facets[name][str(values[index])] = count
+        return facets
+
+
 class BaseFile(PolymorphicModel):
     """The polymorphic base model inherited by the Picture, Video, Audio, and Document models."""
 
@@ -47,6 +209,34 @@ class BaseFile(PolymorphicModel):
             ("unpublish_basefile", "Unpublish file"),
             ("publish_basefile", "Publish file"),
         )
+        indexes = [
+            # used for keyset pagination of the file list, see utils.pagination
+            models.Index(fields=["created", "uuid"], name="basefile_created_uuid_idx"),
+            models.Index(fields=["updated", "uuid"], name="basefile_updated_uuid_idx"),
+            models.Index(fields=["title", "uuid"], name="basefile_title_uuid_idx"),
+            # used for the file changes feed, see files.api.file_changes()
+            models.Index(fields=["change_xid", "uuid"], name="basefile_change_xid_uuid_idx"),
+            # used for the public file list, see BaseFileQuerySet.visible_to()
+            models.Index(
+                fields=["status", "created", "uuid"],
+                name="basefile_status_created_idx",
+            ),
+            # used for full text search, see utils.search
+            GinIndex(fields=["search_vector"], name="basefile_search_vector_idx"),
+            # used for fuzzy search, see utils.search
+            GinIndex(
+                fields=["title"],
+                name="basefile_title_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+            GinIndex(
+                fields=["original_filename"],
+                name="basefile_filename_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ]
+
+    objects = PolymorphicManager.from_queryset(BaseFileQuerySet)()
 
     uuid = models.UUIDField(
         primary_key=True,
@@ -72,6 +262,19 @@ class BaseFile(PolymorphicModel):
         help_text="The date and time when this object was last updated.",
     )
 
+    # both set by a database trigger on every write, see migration 0012
+    change_xid = models.BigIntegerField(
+        default=0,
+        editable=False,
+        help_text="The id of the transaction which last changed this file. Set by the database.",
+    )
+
+    unpublished_xid = models.BigIntegerField(
+        null=True,
+        editable=False,
+        help_text="The id of the transaction which last changed the status of this file from published. Set by the database.",
+    )
+
     title = models.CharField(
         max_length=255,
         blank=False,
@@ -108,24 +311,62 @@ class BaseFile(PolymorphicModel):
         help_text="The status of this file. Only published files are visible on the public website.",
     )
 
+    filetype = models.CharField(
+        max_length=20,
+        choices=FileTypeChoices.choices,
+        db_index=True,
+        editable=False,
+        help_text="The filetype of this file, the name of the filetype model. Set when the file is created.",
+    )
+
     original_filename = models.CharField(
         max_length=255,
         help_text="The original (uploaded) filename.",
     )
 
-    file_size = models.PositiveIntegerField(
+    file_size = models.PositiveBigIntegerField(
         help_text="The size of the file.",
     )
 
+    missing_on_disk = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="True if the file was missing from disk when last checked by the check_files command.",
+    )
+
+    sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        editable=False,
+        help_text="The SHA-256 digest of the file, as a hex string.",
+    )
+
     thumbnail_url = models.CharField(
         max_length=255,
         validators=[validate_thumbnail_url],
         help_text="Relative URL to the image to use as thumbnail for this file.",
     )
 
-    @property
-    def filetype(self):
-        return self._meta.model_name
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        help_text="The full text search vector of the title, description and tags of this file.",
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not args and not self.filetype:
+            # a new file, instances loaded from the database get positional args
+            self.filetype = self._meta.model_name
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.update_search_vector()
+
+    def update_search_vector(self):
+        """Update the full text search vector of this file."""
+        update_search_vectors(BaseFile.objects.non_polymorphic().filter(uuid=self.uuid))
 
     @property
     def filetype_icon(self):
@@ -134,3 +375,152 @@ class BaseFile(PolymorphicModel):
     @property
     def status_icon(self):
         return settings.FILESTATUS_ICONS[self.status]
+
+
+class BaseFileUserObjectPermission(UserObjectPermissionBase):
+    """Direct foreign key user object permissions for files, used by guardian instead of the generic table."""
+
+    content_object = models.ForeignKey(BaseFile, on_delete=models.CASCADE)
+
+
+class BaseFileGroupObjectPermission(GroupObjectPermissionBase):
+    """Direct foreign key group object permissions for files, used by guardian instead of the generic table."""
+
+    content_object = models.ForeignKey(BaseFile, on_delete=models.CASCADE)
+
+
+class UploadSessionQuerySet(models.QuerySet):
+    def expired(self):
+        """Return the upload sessions which have not received a chunk for UPLOAD_SESSION_EXPIRY seconds."""
+        return self.filter(updated__lt=timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY))
+
+    def active(self):
+        """Return the upload sessions which have not expired."""
+        return self.filter(updated__gte=timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY))
+
+
+class UploadSession(models.Model):
+    """A resumable chunked upload in progress.
+
+    Chunks are appended to a temporary file below MEDIA_ROOT, so the finished
+    file can be renamed into place instead of copied. Sessions which do not
+    receive a chunk for UPLOAD_SESSION_EXPIRY seconds expire, and are removed
+    by the cleanup_upload_sessions command.
+    """
+
+    objects = UploadSessionQuerySet.as_manager()
+
+    uuid = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+        help_text="The unique ID (UUID4) of this upload session.",
+    )
+
+    owner = models.ForeignKey(
+        "users.User",
+        on_delete=models.CASCADE,
+        related_name="upload_sessions",
+        help_text="The uploader of this file.",
+    )
+
+    created = models.DateTimeField(
+        auto_now_add=True,
+        help_text="The date and time when this upload session was created.",
+    )
+
+    updated = models.DateTimeField(
+        auto_now=True,
+        help_text="The date and time when the last chunk was received.",
+    )
+
+    filename = models.CharField(
+        max_length=255,
+        help_text="The original filename.",
+    )
+
+    size = models.PositiveBigIntegerField(
+        help_text="The size of the complete file.",
+    )
+
+    offset = models.PositiveBigIntegerField(
+        default=0,
+        help_text="The number of bytes received so far. The next chunk must start here.",
+    )
+
+    metadata = models.JSONField(
+        default=dict,
+        help_text="The metadata for the file, used when the upload is finalized.",
+    )
+
+    @property
+    def path(self):
+        return Path(settings.MEDIA_ROOT) / "upload_sessions" / f"{self.uuid}.part"
+
+    def get_sha256(self):
+        """Return the SHA-256 digest of the data received so far.
+
+        The hash state of a session can not be saved between chunks, which may
+        be handled by different processes, so the file is hashed once when the
+        upload is finalized, before the session is locked.
+        """
+        hasher = hashlib.sha256()
+        with self.path.open("rb") as f:
+            remaining = self.offset
+            while remaining and (data := f.read(min(remaining, 1024 * 1024))):
+                hasher.update(data)
+                remaining -= len(data)
+        return hasher.hexdigest()
+
+    def append(self, stream, chunk_size=1024 * 1024):
+        """Append the data in stream to the file at the current offset and save the new offset.
+
+        No transaction is held while the data is received. The file is locked
+        while the chunk is written, and the new offset is only saved if no
+        other chunk moved the offset first. Returns False if another chunk is
+        being written or moved the offset. Raises ValueError if the data would
+        make the file larger than the size given when the session was created.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        offset = self.offset
+        with os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), "r+b") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            # another chunk may have been written before the lock was taken
+            if not UploadSession.objects.filter(uuid=self.uuid, offset=offset).exists():
+                return False
+            # remove anything left over from an interrupted chunk
+            f.seek(offset)
+            f.truncate()
+            while data := stream.read(chunk_size):
+                if offset + len(data) > self.size:
+                    raise ValueError("The chunk is larger than the rest of the file.")
+                f.write(data)
+                offset += len(data)
+            # the data must be on disk before the offset says it is there
+            f.flush()
+            now = timezone.now()
+            if not UploadSession.objects.filter(uuid=self.uuid, offset=self.offset).update(offset=offset, updated=now):
+                return False
+        self.offset = offset
+        self.updated = now
+        return True
+
+    def move(self, name):
+        """Move the finished file to name under MEDIA_ROOT."""
+        path = Path(settings.MEDIA_ROOT) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # a rename, the file is not copied
+        os.replace(self.path, path)
+
+    def restore(self, name):
+        """Move the file moved to name by move() back, when creating the file was rolled back."""
+        path = Path(settings.MEDIA_ROOT) / name
+        if path.exists():
+            os.replace(path, self.path)
+
+    def delete(self, *args, **kwargs):
+        self.path.unlink(missing_ok=True)
+        return super().delete(*args, **kwargs)
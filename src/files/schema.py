@@ -1,27 +1,32 @@
-import os
 from utils.schema import RequestMetadataSchema
 from django.utils import timezone
 from guardian.shortcuts import get_perms, get_user_perms, get_group_perms
+import datetime
 import uuid
 from pathlib import Path
+from typing import Annotated
+from typing import Dict
 from typing import List
 from typing import Optional
 
 from django.urls import reverse
+from ninja import Field
 from ninja import ModelSchema
 from ninja import Schema
 
 from .models import FileTypeChoices
 from .models import LicenseChoices
 from .models import StatusChoices
+from .models import UploadSession
 from files.models import BaseFile, StatusChoices
 from utils.filters import SortingChoices
-from utils.schema import ApiMessageSchema, ApiResponseSchema, ObjectPermissionSchema
+from utils.schema import ApiMessageSchema, ApiListResponseSchema, ApiResponseSchema, ObjectPermissionSchema
 from utils.permissions import get_object_permissions_schema
 from utils.request import context_request
+from utils.signing import sign_media_url
 
 
-class UploadRequestSchema(ModelSchema):
+class FileMetadataSchema(ModelSchema):
     """File metatata."""
 
     license: LicenseChoices
@@ -42,6 +47,24 @@ class UploadRequestSchema(ModelSchema):
         ]
 
 
+# an empty string or the hex SHA-256 digest of a file
+DIGEST_PATTERN = "^([0-9a-f]{64})?$"
+
+
+class UploadRequestSchema(FileMetadataSchema):
+    """File metadata and the optional SHA-256 digest of the uploaded file."""
+    digest: str = Field("", pattern=DIGEST_PATTERN)
+
+
+class BatchUploadRequestSchema(FileMetadataSchema):
+    """Metadata shared by all files in a batch upload.
+
+    The optional digests list has the SHA-256 digest of each file, in the same
+    order as the files.
+    """
+    digests: List[Annotated[str, Field(pattern=DIGEST_PATTERN)]] = []
+
+
 class FileUpdateRequestSchema(ModelSchema):
     title: Optional[str] = ""
     description: Optional[str] = ""
@@ -67,6 +90,18 @@ class MultipleFileRequestSchema(Schema):
     files: List[uuid.UUID]
 
 
+class UploadSessionRequestSchema(Schema):
+    """The schema used to start a resumable chunked upload."""
+    filename: str = Field(..., min_length=1, max_length=255)
+    size: int = Field(..., gt=0)
+    metadata: UploadRequestSchema
+
+
+class DigestRequestSchema(Schema):
+    """The schema used for checking which file digests already exist."""
+    digests: List[str] = Field(..., max_length=10000)
+
+
 """Response schemas below here."""
 
 
@@ -96,25 +131,28 @@ class FileResponseSchema(ModelSchema):
             "status",
             "original_filename",
             "thumbnail_url",
+            "sha256",
+            "missing_on_disk",
         ]
 
     @staticmethod
-    def resolve_albums(obj, request):
-        return [str(x) for x in obj.albums.values_list("uuid", flat=True)]
+    def resolve_albums(obj, context):
+        # use the prefetched albums if the endpoint loaded them, see files.api.prefetch_albums
+        return [str(album.uuid) for album in obj.albums.all()]
 
     @staticmethod
-    def resolve_filename(obj, request):
+    def resolve_filename(obj, context):
         return Path(obj.original.path).name
 
     @staticmethod
-    def resolve_size_bytes(obj, request):
-        if os.path.exists(obj.original.path):
-            return obj.original.size
-        else:
+    def resolve_size_bytes(obj, context):
+        # use the stored size, never touch storage here, see the check_files command
+        if obj.missing_on_disk:
             return 0
+        return obj.file_size
 
     @staticmethod
-    def resolve_links(obj, request):
+    def resolve_links(obj, context):
         links = {
             "self": reverse("api-v1-json:file_get", kwargs={"file_uuid": obj.uuid}),
             "approve": reverse(
@@ -134,30 +172,28 @@ class FileResponseSchema(ModelSchema):
             },
         }
         if obj.filetype == "picture":
-            try:
-                links["downloads"].update(
-                    {
-                        "small_thumbnail": obj.small_thumbnail.url,
-                        "medium_thumbnail": obj.medium_thumbnail.url,
-                        "large_thumbnail": obj.large_thumbnail.url,
-                        "small": obj.small.url,
-                        "medium": obj.medium.url,
-                        "large": obj.large.url,
-                        "slideshow": obj.slideshow.url,
-                    },
-                )
-            except OSError:
-                # maybe file is missing from disk
-                pass
+            # only use the renditions manifest here, never touch storage
+            links["downloads"].update(
+                {name: rendition["url"] for name, rendition in obj.renditions.items()},
+            )
+        # signed urls can be served by nginx without a permission check in bma_media_view
+        public = obj.status == StatusChoices.PUBLISHED
+        links["downloads"] = {
+            name: sign_media_url(url, public) for name, url in links["downloads"].items()
+        }
         return links
 
     @staticmethod
-    def resolve_status(obj, request):
+    def resolve_thumbnail_url(obj, context):
+        return sign_media_url(obj.thumbnail_url, obj.status == StatusChoices.PUBLISHED)
+
+    @staticmethod
+    def resolve_status(obj, context):
         return StatusChoices[obj.status].label
 
     @staticmethod
-    def resolve_permissions(obj, request):
-        return get_object_permissions_schema(obj, request)
+    def resolve_permissions(obj, context):
+        return get_object_permissions_schema(obj, context["request"])
 
 
 class SingleFileResponseSchema(ApiResponseSchema):
@@ -165,6 +201,80 @@ class SingleFileResponseSchema(ApiResponseSchema):
     bma_response: FileResponseSchema
 
 
-class MultipleFileResponseSchema(ApiResponseSchema):
+class MultipleFileResponseSchema(ApiListResponseSchema):
     """The schema used to return a response with multiple file objects."""
     bma_response: List[FileResponseSchema]
+
+
+class FileFacetsSchema(Schema):
+    """The number of files for each value of the file_list filters, keyed by value."""
+    filetypes: Dict[str, int]
+    statuses: Dict[str, int]
+    licenses: Dict[str, int]
+    owners: Dict[str, int]
+    albums: Dict[str, int]
+
+
+class FileFacetsResponseSchema(ApiResponseSchema):
+    """The schema used to return the facet counts of a file list."""
+    bma_response: FileFacetsSchema
+
+
+class FileTombstoneSchema(Schema):
+    """A file which was marked for deletion, or is no longer visible to the user, since the last sync."""
+    uuid: uuid.UUID
+    updated: datetime.datetime
+    reason: str
+
+
+class FileChangesSchema(Schema):
+    """The files changed since a watermark, and tombstones for the files to remove."""
+    files: List[FileResponseSchema]
+    tombstones: List[FileTombstoneSchema]
+
+
+class FileChangesResponseSchema(ApiResponseSchema):
+    """The schema used to return the file changes feed.
+
+    The watermark is passed as since in the next request, more is true if
+    there are more changes to fetch right away.
+    """
+    bma_response: FileChangesSchema
+    watermark: Optional[str] = None
+    more: bool
+
+
+class DigestResponseSchema(ApiResponseSchema):
+    """The schema used to return the existing file for each known digest."""
+    bma_response: Dict[str, uuid.UUID]
+
+
+class BatchUploadResultSchema(Schema):
+    """The result of one file in a batch upload.
+
+    The status is the HTTP status code the file would get from the single file
+    upload endpoint.
+    """
+    filename: str
+    status: int
+    message: Optional[str] = None
+    details: Optional[dict] = None
+    file: Optional[FileResponseSchema] = None
+
+
+class BatchUploadResponseSchema(ApiResponseSchema):
+    """The schema used to return the results of a batch upload, one for each file in the order they were sent."""
+    bma_response: List[BatchUploadResultSchema]
+
+
+class UploadSessionSchema(ModelSchema):
+    """The schema used for resumable chunked upload sessions."""
+
+    class Config:
+        model = UploadSession
+        model_fields = ["uuid", "created", "updated", "filename", "size", "offset"]
+
+
+class UploadSessionResponseSchema(ApiResponseSchema):
+    """The schema used to return an upload session."""
+    bma_response: UploadSessionSchema
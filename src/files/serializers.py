@@ -0,0 +1,153 @@
+"""A fast serialiser for files, with the same output as FileResponseSchema.
+
+Validating every file in a list through FileResponseSchema builds model
+instances and pydantic objects and runs the resolvers for each row. The
+serialiser here reads only the columns the requested fields need as named
+values_list() tuples, loads albums and permissions for all rows at once, and
+turns each row into a dict with precompiled getters. The dicts are ready for
+orjson. The output must match FileResponseSchema, see the contract test in
+files.tests and the benchmark_file_serializers command.
+"""
+import functools
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+
+from .models import BaseFile
+from .models import FileTypeChoices
+from .models import StatusChoices
+from .schema import FileResponseSchema
+from albums.models import AlbumMember
+from utils.permissions import get_object_permissions_map
+from utils.permissions import get_permission_user
+from utils.signing import sign_media_url
+
+# reverse() is slow, the api links are made by replacing this uuid in reversed urls
+PLACEHOLDER_UUID = str(uuid.UUID(int=0))
+
+
+@functools.cache
+def get_link_templates():
+    """Return the api links of a file with PLACEHOLDER_UUID as the file uuid."""
+    return {
+        name: reverse(f"api-v1-json:{view}", kwargs={"file_uuid": PLACEHOLDER_UUID})
+        for name, view in [
+            ("self", "file_get"),
+            ("approve", "file_approve"),
+            ("unpublish", "file_unpublish"),
+            ("publish", "file_publish"),
+        ]
+    }
+
+
+def get_links(row, side):
+    """Return the links of a file like FileResponseSchema.resolve_links()."""
+    file_uuid = str(row.uuid)
+    links = {
+        name: template.replace(PLACEHOLDER_UUID, file_uuid)
+        for name, template in get_link_templates().items()
+    }
+    downloads = {"original": default_storage.url(row.original)}
+    if row.filetype == FileTypeChoices.picture and row.renditions:
+        # only use the renditions manifest here, never touch storage
+        downloads.update({name: rendition["url"] for name, rendition in row.renditions.items()})
+    public = row.status == StatusChoices.PUBLISHED
+    links["downloads"] = {name: sign_media_url(url, public) for name, url in downloads.items()}
+    return links
+
+
+# the columns needed by each field and the function returning its value from a row and the side data
+FIELD_GETTERS = {
+    "albums": ([], lambda row, side: side["albums"].get(row.uuid, [])),
+    "filename": (["original"], lambda row, side: Path(row.original).name),
+    "links": (["original", "renditions", "filetype", "status"], get_links),
+    "filetype_icon": (["filetype"], lambda row, side: settings.FILETYPE_ICONS[row.filetype]),
+    "status": (["status"], lambda row, side: StatusChoices[row.status].label),
+    "status_icon": (["status"], lambda row, side: settings.FILESTATUS_ICONS[row.status]),
+    "size_bytes": (
+        ["file_size", "missing_on_disk"],
+        lambda row, side: 0 if row.missing_on_disk else row.file_size,
+    ),
+    "permissions": ([], lambda row, side: side["permissions"][str(row.uuid)].model_dump()),
+    "thumbnail_url": (
+        ["thumbnail_url", "status"],
+        lambda row, side: sign_media_url(row.thumbnail_url, row.status == StatusChoices.PUBLISHED),
+    ),
+}
+
+# the columns of the filetype tables, annotated on the base table rows
+FILETYPE_COLUMNS = {
+    "original": Coalesce(*[F(f"{filetype}__original") for filetype in FileTypeChoices.values]),
+    "renditions": F("picture__renditions"),
+}
+
+
+def get_model_field_getter(name):
+    """Return a getter for a response field which is a model field, read from the column with the same name."""
+    return lambda row, side: getattr(row, name)
+
+
+class FileSerializer:
+    """Serialise files to dicts with the fields of FileResponseSchema, or a subset of them."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        # the uuid and status are always read, for the side data and permission checks
+        self.columns = {"uuid": None, "status": None}
+        self.getters = []
+        for name in fields:
+            columns, getter = FIELD_GETTERS.get(name, ([name], get_model_field_getter(name)))
+            self.columns.update(dict.fromkeys(columns))
+            self.getters.append((name, getter))
+
+    def get_rows(self, queryset, columns=()):
+        """Return queryset as the named rows this serialiser needs.
+
+        columns are extra model fields to read, like the sort field. Annotations
+        on queryset, like the search relevance, are always read.
+        """
+        names = list(self.columns)
+        annotations = {name: FILETYPE_COLUMNS[name] for name in names if name in FILETYPE_COLUMNS}
+        queryset = queryset.non_polymorphic().annotate(**annotations)
+        model_fields = {field.name for field in BaseFile._meta.concrete_fields}
+        names += [name for name in columns if name in model_fields and name not in names]
+        names += [name for name in queryset.query.annotations if name not in names]
+        return queryset.values_list(*names, named=True)
+
+    def get_side_data(self, rows, request):
+        """Return the albums and permissions of all rows, loaded with a fixed number of queries."""
+        side = {}
+        if "albums" in self.fields:
+            albums = defaultdict(list)
+            # in the default album ordering, like the prefetched albums in the schema
+            for basefile, album in AlbumMember.objects.filter(
+                basefile__in=[row.uuid for row in rows],
+            ).order_by("album__created").values_list("basefile", "album"):
+                albums[basefile].append(str(album))
+            side["albums"] = albums
+        if "permissions" in self.fields:
+            side["permissions"] = get_object_permissions_map(
+                [BaseFile(uuid=row.uuid) for row in rows],
+                get_permission_user(request),
+            )
+        return side
+
+    def serialize(self, rows, request):
+        """Return a list of dicts with the fields of the rows from get_rows()."""
+        rows = list(rows)
+        side = self.get_side_data(rows, request)
+        getters = self.getters
+        return [{name: getter(row, side) for name, getter in getters} for row in rows]
+
+
+# the fields tuples come from clients, so only the most used serialisers are kept
+@functools.lru_cache(maxsize=256)
+def get_file_serializer(fields=None):
+    """Return the serialiser for the tuple of fields from validate_fields(), or for all fields of FileResponseSchema."""
+    return FileSerializer(fields or tuple(FileResponseSchema.model_fields))
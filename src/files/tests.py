@@ -1,11 +1,55 @@
+import fcntl
+import hashlib
+import json
+import logging
 import os
-
+import uuid
+from datetime import timedelta
+from unittest.mock import patch
+
+import orjson
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db import connections
+from django.test import Client
+from django.test import RequestFactory
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
 from django.urls import reverse
+from django.utils import timezone
+from guardian.models import UserObjectPermission
+from guardian.shortcuts import assign_perm
+from imagekit.cachefiles import ImageCacheFile
 from oauth2_provider.models import get_access_token_model
 from oauth2_provider.models import get_application_model
 from oauth2_provider.models import get_grant_model
 
 from .models import BaseFile
+from .models import BaseFileGroupObjectPermission
+from .models import BaseFileUserObjectPermission
+from .models import StatusChoices
+from .models import UploadSession
+from .schema import FileResponseSchema
+from .serializers import get_file_serializer
+from albums.models import Album
+from pictures.models import Picture
+from pictures.models import RenditionJob
+from users.factories import UserFactory
+from users.models import User
+from utils.permissions import get_object_permissions_map
+from utils.permissions import get_anonymous_user
+from utils.permissions import get_object_permissions_schema
+from utils.permissions import get_permission_user
+from utils.permissions import has_object_permission
+from utils.permissions import prefetch_object_permissions
+from utils import upload
+from utils.fields import get_sparse_schema
 from utils.tests import ApiTestBase
 
 Application = get_application_model()
@@ -629,13 +673,1333 @@ class TestFilesApi(ApiTestBase):
         """Test the case where a file has gone missing from disk for some reason."""
         self.file_upload()
         basefile = BaseFile.objects.get(uuid=self.file_uuid)
-        os.unlink(basefile.original.path)
+        size = basefile.file_size
+        os.rename(basefile.original.path, f"{basefile.original.path}.moved")
+
+        def get_file():
+            response = self.client.get(
+                reverse("api-v1-json:file_list"),
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+            assert response.status_code == 200
+            return response.json()["bma_response"][0]
+
+        # the api does not look at the disk, so the file is missing after the next check
+        assert get_file()["size_bytes"] == size
+        assert not get_file()["missing_on_disk"]
+        call_command("check_files")
+        assert get_file()["size_bytes"] == 0
+        assert get_file()["missing_on_disk"]
+
+        # the file is back
+        os.rename(f"{basefile.original.path}.moved", basefile.original.path)
+        call_command("check_files")
+        assert get_file()["size_bytes"] == size
+        assert not get_file()["missing_on_disk"]
+
+    def test_file_permissions_map_query_count(self):
+        """Make sure the bulk permission lookup uses the same number of queries no matter how many files."""
+        for i in range(10):
+            self.file_upload(title=f"title{i}")
+        files = list(BaseFile.objects.all())
+        # add some group and anonymous permissions to the mix
+        group = Group.objects.create(name="moderators")
+        self.user2.groups.add(group)
+        assign_perm("approve_basefile", group, files[0])
+        assign_perm("view_basefile", User.get_anonymous(), files[1])
+        request = RequestFactory().get("/")
+        for user in [self.user1, self.user2, self.superuser, AnonymousUser()]:
+            with CaptureQueriesContext(connection) as small:
+                get_object_permissions_map(files[:2], user)
+            with CaptureQueriesContext(connection) as large:
+                permissions = get_object_permissions_map(files, user)
+            assert len(small) == len(large)
+            # make sure the result matches the per-object guardian lookups
+            request.user = user
+            for basefile in files:
+                assert permissions[str(basefile.pk)] == get_object_permissions_schema(
+                    basefile,
+                    request,
+                )
+
+    def test_file_list_cursor(self):
+        """Page through the file_list endpoint using cursors."""
+        for i in range(15):
+            self.file_upload(title=f"title{i % 5}")
+        for sorting in ["title_asc", "title_desc", "created_asc", "updated_desc"]:
+            response = self.client.get(
+                reverse("api-v1-json:file_list"),
+                data={"sorting": sorting},
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+            assert response.json()["next_cursor"] is None
+            expected = [f["uuid"] for f in response.json()["bma_response"]]
+            uuids = []
+            data = {"limit": 4, "sorting": sorting}
+            while True:
+                response = self.client.get(
+                    reverse("api-v1-json:file_list"),
+                    data=data,
+                    HTTP_AUTHORIZATION=self.user1.auth,
+                )
+                assert response.status_code == 200
+                uuids += [f["uuid"] for f in response.json()["bma_response"]]
+                if not response.json()["next_cursor"]:
+                    break
+                data["cursor"] = response.json()["next_cursor"]
+            assert uuids == expected
+
+        # a cursor is only valid for the sorting it was created with
         response = self.client.get(
-            reverse(
-                "api-v1-json:file_get",
-                kwargs={"file_uuid": self.file_uuid},
-            ),
+            reverse("api-v1-json:file_list"),
+            data={"limit": 4, "sorting": "title_asc"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"sorting": "title_desc", "cursor": response.json()["next_cursor"]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 422
+
+        # garbage cursor
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"cursor": "notacursor"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 422
+
+    def test_file_list_renditions_manifest(self):
+        """Make sure listing pictures only reads the renditions manifest."""
+        self.file_upload()
+        call_command("rendition_worker", once=True, processes=0)
+        picture = Picture.objects.get(uuid=self.file_uuid)
+        assert set(picture.renditions) == set(Picture.RENDITIONS)
+        assert picture.renditions["small_thumbnail"]["width"] == 100
+        assert picture.thumbnail_url == picture.renditions["large_thumbnail"]["url"]
+        # listing must not generate or open any images
+        with patch.object(ImageCacheFile, "generate", side_effect=AssertionError), patch(
+            "PIL.Image.open",
+            side_effect=AssertionError,
+        ):
+            response = self.client.get(
+                reverse("api-v1-json:file_list"),
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+        assert response.status_code == 200
+        downloads = response.json()["bma_response"][0]["links"]["downloads"]
+        for name, rendition in picture.renditions.items():
+            assert downloads[name] == rendition["url"]
+
+    def test_rendition_worker(self):
+        """Make sure uploads queue rendition jobs and the worker processes them."""
+        self.file_upload()
+        picture = Picture.objects.get(uuid=self.file_uuid)
+        assert picture.renditions == {}
+        assert picture.thumbnail_url == "/static/images/file-image-solid.png"
+        assert RenditionJob.objects.filter(picture=picture).count() == 1
+
+        # a job for a picture missing on disk fails and is kept with the error
+        self.file_upload()
+        missing = Picture.objects.get(uuid=self.file_uuid)
+        os.unlink(missing.original.path)
+
+        call_command("rendition_worker", once=True, processes=0, max_attempts=2)
+        picture.refresh_from_db()
+        assert set(picture.renditions) == set(Picture.RENDITIONS)
+        assert picture.thumbnail_url == picture.renditions["large_thumbnail"]["url"]
+        assert not RenditionJob.objects.filter(picture=picture).exists()
+        job = RenditionJob.objects.get(picture=missing)
+        assert job.attempts == 2
+        assert "FileNotFoundError" in job.error
+
+        # jobs claimed by another worker are skipped until the lease runs out
+        RenditionJob.objects.update(attempts=0, claimed_until=timezone.now() + timedelta(minutes=5))
+        call_command("rendition_worker", once=True, processes=0, max_attempts=1)
+        assert RenditionJob.objects.get(picture=missing).attempts == 0
+        RenditionJob.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        call_command("rendition_worker", once=True, processes=0, max_attempts=1)
+        job = RenditionJob.objects.get(picture=missing)
+        assert job.attempts == 1
+        assert job.claimed_until is None
+
+    def test_file_update_search(self):
+        """Make sure the search finds files by their new title after a PATCH."""
+        self.file_upload(title="oldtitle")
+
+        def search(text):
+            response = self.client.get(
+                reverse("api-v1-json:file_list"),
+                data={"search": text},
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+            return [f["uuid"] for f in response.json()["bma_response"]]
+
+        assert search("oldtitle") == [self.file_uuid]
+        response = self.client.patch(
+            reverse("api-v1-json:file_get", kwargs={"file_uuid": self.file_uuid}),
+            {"title": "brandnew"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+            content_type="application/json",
+        )
+        assert response.status_code == 200
+        assert response.json()["bma_response"]["title"] == "brandnew"
+        assert search("brandnew") == [self.file_uuid]
+        assert search("oldtitle") == []
+
+    def test_file_list_search(self):
+        """Test full text search and sorting by relevance in the file_list endpoint."""
+        uuids = {}
+        for title, description in [
+            ("Sunset over the lake", ""),
+            ("Lake", "Swimming in the lake at sunset"),
+            ("Workshop", "Soldering badges"),
+        ]:
+            uuids[title] = self.file_upload(title=title)
+            basefile = BaseFile.objects.get(uuid=uuids[title])
+            basefile.description = description
+            basefile.save()
+        # tags are searchable too
+        Picture.objects.get(uuid=uuids["Workshop"]).tags.add("sunsets")
+
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"search": "sunset", "sorting": "relevance_desc"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 200
+        # title matches rank above description matches, which rank above tag matches
+        assert [f["uuid"] for f in response.json()["bma_response"]] == [
+            uuids["Sunset over the lake"],
+            uuids["Lake"],
+            uuids["Workshop"],
+        ]
+
+        # stemming and web search syntax
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"search": "swim -sunset"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.json()["bma_response"] == []
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"search": "solder", "limit": 1, "sorting": "relevance_desc"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert [f["uuid"] for f in response.json()["bma_response"]] == [uuids["Workshop"]]
+
+        # page through relevance sorted results using cursors
+        seen = []
+        data = {"search": "lake OR sunset", "limit": 1, "sorting": "relevance_desc"}
+        while True:
+            response = self.client.get(
+                reverse("api-v1-json:file_list"),
+                data=data,
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+            assert response.status_code == 200
+            seen += [f["uuid"] for f in response.json()["bma_response"]]
+            if not response.json()["next_cursor"]:
+                break
+            data["cursor"] = response.json()["next_cursor"]
+        assert len(seen) == len(set(seen)) == 3
+
+        # relevance sorting needs a search
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"sorting": "relevance_desc"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 422
+
+    def test_file_list_fuzzy_search(self):
+        """Test the typo tolerant trigram search mode in the file_list endpoint."""
+        camp = self.file_upload(title="Opening ceremony at BornHack")
+        self.file_upload(title="Soldering workshop")
+
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"search": "bornhak", "search_mode": "fuzzy"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 200
+        assert [f["uuid"] for f in response.json()["bma_response"]] == [camp]
+        # the full text search does not find misspelled words
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"search": "bornhak"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.json()["bma_response"] == []
+
+        # original filenames are searched too
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"search": "logo_wide_blak", "search_mode": "fuzzy"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert len(response.json()["bma_response"]) == 2
+
+        # a lower threshold finds less similar words
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"search": "soldier", "search_mode": "fuzzy"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.json()["bma_response"] == []
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"search": "soldier", "search_mode": "fuzzy", "similarity_threshold": 0.3},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert [f["title"] for f in response.json()["bma_response"]] == ["Soldering workshop"]
+
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"search": "soldier", "search_mode": "fuzzy", "similarity_threshold": 2},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 422
+
+    def test_file_list_visibility(self):
+        """Make sure file visibility comes from the status and the direct foreign key permission tables."""
+        published, pending, shared = (self.file_upload(title=f"file{i}") for i in range(3))
+        BaseFile.objects.filter(uuid=published).update(status="PUBLISHED")
+        group = Group.objects.create(name="crew")
+        self.user3.groups.add(group)
+        assign_perm("view_basefile", self.user2, BaseFile.objects.get(uuid=shared))
+        assign_perm("view_basefile", group, BaseFile.objects.get(uuid=shared))
+        assert BaseFileUserObjectPermission.objects.filter(content_object_id=shared).exists()
+        assert BaseFileGroupObjectPermission.objects.filter(content_object_id=shared).exists()
+        # nothing is written to the generic guardian tables, and nothing for the anonymous user
+        assert not UserObjectPermission.objects.exists()
+        assert not BaseFileUserObjectPermission.objects.filter(user=User.get_anonymous()).exists()
+
+        for auth, expected in [
+            ({}, {published}),
+            ({"HTTP_AUTHORIZATION": self.user1.auth}, {published, pending, shared}),
+            ({"HTTP_AUTHORIZATION": self.user2.auth}, {published, shared}),
+            ({"HTTP_AUTHORIZATION": self.user3.auth}, {published, shared}),
+            ({"HTTP_AUTHORIZATION": self.user4.auth}, {published}),
+            ({"HTTP_AUTHORIZATION": self.superuser.auth}, {published, pending, shared}),
+        ]:
+            response = self.client.get(reverse("api-v1-json:file_list"), **auth)
+            assert response.status_code == 200
+            assert {f["uuid"] for f in response.json()["bma_response"]} == expected
+
+        # the anonymous listing is a plain filter on the status
+        with CaptureQueriesContext(connection) as context:
+            list(BaseFile.objects.visible_to(AnonymousUser()))
+        assert "guardian" not in context.captured_queries[0]["sql"]
+        assert "objectpermission" not in context.captured_queries[0]["sql"]
+
+    def test_file_bulk_status_transitions(self):
+        """Make sure the bulk approve, publish and unpublish endpoints use a fixed number of queries."""
+        files = [self.file_upload() for _ in range(12)]
+        queries = []
+        for batch in [files[:2], files[2:]]:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.patch(
+                    reverse("api-v1-json:file_approve_multiple"),
+                    {"files": batch},
+                    HTTP_AUTHORIZATION=self.superuser.auth,
+                    content_type="application/json",
+                )
+            assert response.status_code == 200
+            assert {f["uuid"] for f in response.json()["bma_response"]} == set(batch)
+            assert {f["status"] for f in response.json()["bma_response"]} == {"Unpublished"}
+            # the albums of each file are still looked up one by one when the response is serialized
+            queries.append(
+                len([q for q in context.captured_queries if "albums_album" not in q["sql"]]),
+            )
+            assert len([q for q in context.captured_queries if q["sql"].startswith("UPDATE")]) == 1
+            assert len([q for q in context.captured_queries if q["sql"].startswith("INSERT")]) == 2
+        assert queries[0] == queries[1]
+        # the owner can now publish and unpublish the files
+        for basefile in BaseFile.objects.all():
+            assert self.user1.has_perm("publish_basefile", basefile)
+            assert self.user1.has_perm("unpublish_basefile", basefile)
+
+        # files with the wrong status are listed in the 403 response
+        BaseFile.objects.filter(uuid=files[0]).update(status="PUBLISHED")
+        response = self.client.patch(
+            reverse("api-v1-json:file_publish_multiple"),
+            {"files": files[:3]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+            content_type="application/json",
+        )
+        assert response.status_code == 403
+        assert response.json()["details"]["files"] == [files[0]]
+        assert BaseFile.objects.filter(status="PUBLISHED").count() == 1
+
+        response = self.client.patch(
+            reverse("api-v1-json:file_publish_multiple"),
+            {"files": files[1:]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+            content_type="application/json",
+        )
+        assert response.status_code == 200
+        assert BaseFile.objects.filter(status="PUBLISHED").count() == 12
+
+        response = self.client.patch(
+            reverse("api-v1-json:file_unpublish_multiple"),
+            {"files": files},
+            HTTP_AUTHORIZATION=self.user1.auth,
+            content_type="application/json",
+        )
+        assert response.status_code == 200
+        assert len(response.json()["bma_response"]) == 12
+        assert not BaseFile.objects.filter(status="PUBLISHED").exists()
+
+    def test_file_upload_digest(self):
+        """Test the server side digest, deduplication and the digest pre-flight endpoint."""
+        filepath = "static_src/images/logo_wide_black_500_RGB.png"
+        with open(filepath, "rb") as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+
+        def upload(digest):
+            with open(filepath, "rb") as f:
+                return self.client.post(
+                    reverse("api-v1-json:upload"),
+                    {
+                        "f": f,
+                        "metadata": json.dumps(
+                            {"license": "CC_ZERO_1_0", "attribution": "fotoarne", "digest": digest},
+                        ),
+                    },
+                    HTTP_AUTHORIZATION=self.user1.auth,
+                )
+
+        response = self.client.post(
+            reverse("api-v1-json:file_digests"),
+            {"digests": [sha256, "0" * 64]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+            content_type="application/json",
+        )
+        assert response.json()["bma_response"] == {}
+
+        # the digest is calculated by the upload handlers while the file is received
+        with patch(
+            "files.api.get_sha256",
+            side_effect=lambda uploaded_file: uploaded_file.sha256,
+        ):
+            response = upload(sha256)
+        assert response.status_code == 201
+        file_uuid = response.json()["bma_response"]["uuid"]
+        assert response.json()["bma_response"]["sha256"] == sha256
+
+        # the same file again is not stored
+        response = upload(sha256)
+        assert response.status_code == 409
+        assert response.json()["details"]["files"] == [file_uuid]
+        assert BaseFile.objects.count() == 1
+
+        # a wrong client digest is rejected
+        response = upload("0" * 64)
+        assert response.status_code == 422
+        response = upload("notadigest")
+        assert response.status_code == 422
+
+        # uploads without a digest are not deduplicated
+        response = upload("")
+        assert response.status_code == 201
+        assert BaseFile.objects.filter(sha256=sha256).count() == 2
+
+        response = self.client.post(
+            reverse("api-v1-json:file_digests"),
+            {"digests": [sha256, "0" * 64]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+            content_type="application/json",
+        )
+        assert list(response.json()["bma_response"]) == [sha256]
+        # files the user can not see are not revealed
+        response = self.client.post(
+            reverse("api-v1-json:file_digests"),
+            {"digests": [sha256]},
+            HTTP_AUTHORIZATION=self.user2.auth,
+            content_type="application/json",
+        )
+        assert response.json()["bma_response"] == {}
+
+        # files of other users are not used for deduplication, even when they are published
+        BaseFile.objects.filter(sha256=sha256).update(status=StatusChoices.PUBLISHED)
+        response = self.client.post(
+            reverse("api-v1-json:file_digests"),
+            {"digests": [sha256]},
+            HTTP_AUTHORIZATION=self.user2.auth,
+            content_type="application/json",
+        )
+        assert response.json()["bma_response"] == {}
+        with open(filepath, "rb") as f:
+            response = self.client.post(
+                reverse("api-v1-json:upload"),
+                {
+                    "f": f,
+                    "metadata": json.dumps(
+                        {"license": "CC_ZERO_1_0", "attribution": "fotoarne", "digest": sha256},
+                    ),
+                },
+                HTTP_AUTHORIZATION=self.user2.auth,
+            )
+        assert response.status_code == 201
+        assert response.json()["bma_response"]["owner"] == str(self.user2.uuid)
+
+    def test_file_upload_chunked(self):
+        """Test a resumable chunked upload, including resuming after an interrupted chunk."""
+        with open("static_src/images/logo_wide_black_500_RGB.png", "rb") as f:
+            data = f.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        response = self.client.post(
+            reverse("api-v1-json:upload_session_create"),
+            {
+                "filename": "logo.png",
+                "size": len(data),
+                "metadata": {"license": "CC_ZERO_1_0", "attribution": "fotoarne", "digest": sha256},
+            },
+            HTTP_AUTHORIZATION=self.user1.auth,
+            content_type="application/json",
+        )
+        assert response.status_code == 201
+        session_uuid = response.json()["bma_response"]["uuid"]
+
+        def put_chunk(offset, chunk):
+            return self.client.put(
+                reverse("api-v1-json:upload_session_chunk", kwargs={"session_uuid": session_uuid})
+                + f"?offset={offset}",
+                chunk,
+                HTTP_AUTHORIZATION=self.user1.auth,
+                content_type="application/octet-stream",
+            )
+
+        response = put_chunk(0, data[:1000])
+        assert response.status_code == 200
+        assert response.json()["bma_response"]["offset"] == 1000
+
+        # the connection dropped halfway through the next chunk, which is left
+        # in the file but not counted
+        session = UploadSession.objects.get(uuid=session_uuid)
+        with session.path.open("ab") as f:
+            f.write(data[1000:1500])
+
+        # finalizing an incomplete upload is not possible
+        response = self.client.post(
+            reverse("api-v1-json:upload_session_finalize", kwargs={"session_uuid": session_uuid}),
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 409
+
+        # the client asks for the offset and resumes from there
+        response = self.client.get(
+            reverse("api-v1-json:upload_session_get", kwargs={"session_uuid": session_uuid}),
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.json()["bma_response"]["offset"] == 1000
+        response = put_chunk(1500, data[1500:])
+        assert response.status_code == 409
+        assert response.json()["details"]["offset"] == 1000
+        # a chunk being written by another request locks the file
+        with session.path.open("r+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            response = put_chunk(1000, data[1000:])
+        assert response.status_code == 409
+        assert response.json()["details"]["offset"] == 1000
+        response = put_chunk(1000, data[1000:] + b"toolong")
+        assert response.status_code == 422
+        response = put_chunk(1000, data[1000:])
+        assert response.status_code == 200
+        assert response.json()["bma_response"]["offset"] == len(data)
+
+        # a failure after the file was moved into place moves it back
+        with patch("files.api.assign_perm", side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.client.post(
+                reverse("api-v1-json:upload_session_finalize", kwargs={"session_uuid": session_uuid}),
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+        assert session.path.read_bytes() == data
+        assert UploadSession.objects.filter(uuid=session_uuid).exists()
+        assert not BaseFile.objects.exists()
+
+        response = self.client.post(
+            reverse("api-v1-json:upload_session_finalize", kwargs={"session_uuid": session_uuid}),
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 201
+        result = response.json()["bma_response"]
+        assert result["sha256"] == sha256
+        assert result["size_bytes"] == len(data)
+        assert result["title"] == "logo.png"
+        basefile = BaseFile.objects.get(uuid=result["uuid"])
+        assert basefile.original.name.endswith(f"bma_picture_{basefile.uuid}.png")
+        with basefile.original.open("rb") as f:
+            assert f.read() == data
+        # the file was moved into place
+        assert not session.path.exists()
+        assert not UploadSession.objects.filter(uuid=session_uuid).exists()
+        assert RenditionJob.objects.filter(picture=basefile).exists()
+
+        # the same file is not uploaded again
+        response = self.client.post(
+            reverse("api-v1-json:upload_session_create"),
+            {
+                "filename": "logo.png",
+                "size": len(data),
+                "metadata": {"license": "CC_ZERO_1_0", "attribution": "fotoarne", "digest": sha256},
+            },
+            HTTP_AUTHORIZATION=self.user1.auth,
+            content_type="application/json",
+        )
+        assert response.status_code == 409
+
+    def test_cleanup_upload_sessions(self):
+        """Test that expired upload sessions and files without a session are deleted."""
+        sessions = []
+        for _ in range(2):
+            response = self.client.post(
+                reverse("api-v1-json:upload_session_create"),
+                {"filename": "notes.txt", "size": 10, "metadata": {"license": "CC_ZERO_1_0", "attribution": "fotoarne"}},
+                HTTP_AUTHORIZATION=self.user1.auth,
+                content_type="application/json",
+            )
+            assert response.status_code == 201
+            session = UploadSession.objects.get(uuid=response.json()["bma_response"]["uuid"])
+            response = self.client.put(
+                reverse("api-v1-json:upload_session_chunk", kwargs={"session_uuid": session.uuid}) + "?offset=0",
+                b"some",
+                HTTP_AUTHORIZATION=self.user1.auth,
+                content_type="application/octet-stream",
+            )
+            assert response.status_code == 200
+            sessions.append(session)
+        expired, active = sessions
+        old = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY + 1)
+        UploadSession.objects.filter(uuid=expired.uuid).update(updated=old)
+        orphan = expired.path.with_name(f"{uuid.uuid4()}.part")
+        orphan.write_bytes(b"some")
+        os.utime(orphan, (old.timestamp(), old.timestamp()))
+
+        # expired sessions can not be resumed
+        response = self.client.get(
+            reverse("api-v1-json:upload_session_get", kwargs={"session_uuid": expired.uuid}),
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 404
+
+        call_command("cleanup_upload_sessions")
+        assert list(UploadSession.objects.all()) == [active]
+        assert not expired.path.exists()
+        assert not orphan.exists()
+        assert active.path.exists()
+        active.delete()
+
+    def test_file_upload_batch(self):
+        """Test uploading multiple files in one request."""
+        paths = [
+            "static_src/images/logo_wide_black_500_RGB.png",
+            "static_src/images/logo_wide_white_500_RGB.png",
+            "static_src/images/logo_wide_black_500_RGB.png",
+        ]
+        digests = []
+        for path in paths:
+            with open(path, "rb") as f:
+                digests.append(hashlib.sha256(f.read()).hexdigest())
+        files = [open(path, "rb") for path in paths]
+        files.append(SimpleUploadedFile("notes.bin", b"\x00\x01\x02" * 100))
+        digests.append("")
+        try:
+            response = self.client.post(
+                reverse("api-v1-json:upload_batch"),
+                {
+                    "files": files,
+                    "metadata": json.dumps(
+                        {"license": "CC_ZERO_1_0", "attribution": "fotoarne", "digests": digests},
+                    ),
+                },
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+        finally:
+            for f in files[:3]:
+                f.close()
+        assert response.status_code == 200
+        results = response.json()["bma_response"]
+        assert [r["status"] for r in results] == [201, 201, 409, 422]
+        # the same file twice in the batch is only stored once
+        assert results[2]["details"]["files"] == [results[0]["file"]["uuid"]]
+        assert results[3]["message"] == "File type not supported"
+        assert BaseFile.objects.count() == 2
+        assert RenditionJob.objects.count() == 2
+        for result, digest in zip(results[:2], digests):
+            assert result["file"]["sha256"] == digest
+            assert result["file"]["permissions"]["user_permissions"] == [
+                "change_basefile",
+                "delete_basefile",
+                "view_basefile",
+            ]
+            basefile = BaseFile.objects.get(uuid=result["file"]["uuid"])
+            assert isinstance(basefile, Picture)
+            assert basefile.original.name.endswith(f"bma_picture_{basefile.uuid}.png")
+            assert os.path.exists(basefile.original.path)
+            assert self.user1.has_perm("change_basefile", basefile)
+            # the search vector was updated
+            assert BaseFile.objects.filter(uuid=basefile.uuid, search_vector__isnull=False).exists()
+
+        # the number of digests must match the number of files
+        with open(paths[0], "rb") as f:
+            response = self.client.post(
+                reverse("api-v1-json:upload_batch"),
+                {
+                    "files": [f],
+                    "metadata": json.dumps(
+                        {"license": "CC_ZERO_1_0", "attribution": "fotoarne", "digests": digests},
+                    ),
+                },
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+        assert response.status_code == 422
+
+    def test_file_upload_saturated(self):
+        """Test that uploads are rejected with 429 and Retry-After when the server is handling too many."""
+        # another process is handling an upload in the only slot
+        other = connections.create_connection("default")
+        with other.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s, 0)", [upload.UPLOAD_SLOT_LOCK_KEY])
+        try:
+            with override_settings(UPLOAD_MAX_CONCURRENCY=1, UPLOAD_RETRY_AFTER=7):
+                with open("static_src/images/logo_wide_black_500_RGB.png", "rb") as f:
+                    response = self.client.post(
+                        reverse("api-v1-json:upload"),
+                        {
+                            "f": f,
+                            "metadata": json.dumps({"license": "CC_ZERO_1_0", "attribution": "fotoarne"}),
+                        },
+                        HTTP_AUTHORIZATION=self.user1.auth,
+                    )
+        finally:
+            # the database releases the slot when the process goes away
+            other.close()
+        assert response.status_code == 429
+        assert response["Retry-After"] == "7"
+        assert not BaseFile.objects.exists()
+        # the slot is released after each upload
+        with override_settings(UPLOAD_MAX_CONCURRENCY=1):
+            self.file_upload()
+            self.file_upload()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND classid = %s",
+                [upload.UPLOAD_SLOT_LOCK_KEY],
+            )
+            assert cursor.fetchone()[0] == 0
+
+    @override_settings(MEDIA_SIGNING_SECRET="not-so-secret", MEDIA_URL_EXPIRY_PRIVATE=3600)
+    def test_file_download_signed_url(self):
+        """Test that media urls in API responses are signed and can be downloaded without a permission check."""
+        self.file_upload()
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        url = response.json()["bma_response"][0]["links"]["downloads"]["original"]
+        path, query = url.split("?")
+        params = dict(param.split("=") for param in query.split("&"))
+        assert set(params) == {"st", "ts", "e"}
+        assert params["e"] == "3600"
+        # the signed url works without logging in, even though the file is unpublished
+        response = self.client.get(url)
+        assert response.status_code == 200
+        # the unsigned url does not
+        response = self.client.get(path)
+        assert response.status_code == 404
+        # and neither does a tampered or expired signature
+        response = self.client.get(url.replace("e=3600", "e=7200"))
+        assert response.status_code == 404
+        with patch("utils.signing.time.time", return_value=int(params["ts"]) + 3601):
+            response = self.client.get(url)
+        assert response.status_code == 404
+        # the urls stay the same for a while so they can be cached
+        with patch("utils.signing.time.time", return_value=int(params["ts"]) + 899):
+            response = self.client.get(
+                reverse("api-v1-json:file_list"),
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+        assert response.json()["bma_response"][0]["links"]["downloads"]["original"] == url
+
+    def test_file_download_range_and_caching(self):
+        """Test range requests, validators and cache headers for media files served without nginx."""
+        self.file_upload()
+        self.client.force_login(self.user1)
+        basefile = BaseFile.objects.get(uuid=self.file_uuid)
+        url = basefile.original.url
+        with basefile.original.open("rb") as f:
+            data = f.read()
+
+        response = self.client.get(url)
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == data
+        assert response["ETag"] == f'"{basefile.sha256}"'
+        assert response["Accept-Ranges"] == "bytes"
+        assert response["Cache-Control"] == "private, no-cache"
+        last_modified = response["Last-Modified"]
+
+        # conditional requests
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{basefile.sha256}"')
+        assert response.status_code == 304
+        assert response["ETag"] == f'"{basefile.sha256}"'
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert response.status_code == 304
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"something-else"')
+        assert response.status_code == 200
+
+        # range requests
+        for header, start, end in [
+            ("bytes=0-99", 0, 99),
+            ("bytes=100-", 100, len(data) - 1),
+            ("bytes=-10", len(data) - 10, len(data) - 1),
+            (f"bytes=10-{len(data) + 1000}", 10, len(data) - 1),
+        ]:
+            response = self.client.get(url, HTTP_RANGE=header)
+            assert response.status_code == 206, header
+            assert response["Content-Range"] == f"bytes {start}-{end}/{len(data)}"
+            assert int(response["Content-Length"]) == end - start + 1
+            assert b"".join(response.streaming_content) == data[start : end + 1]
+        response = self.client.get(url, HTTP_RANGE=f"bytes={len(data)}-")
+        assert response.status_code == 416
+        assert response["Content-Range"] == f"bytes */{len(data)}"
+        # a range for an older version of the file gets the whole file
+        response = self.client.get(url, HTTP_RANGE="bytes=0-99", HTTP_IF_RANGE='"outdated"')
+        assert response.status_code == 200
+        response = self.client.get(url, HTTP_RANGE="bytes=0-99", HTTP_IF_RANGE=f'"{basefile.sha256}"')
+        assert response.status_code == 206
+
+        # published files are revalidated soon, as they can be unpublished without the url changing
+        BaseFile.objects.filter(uuid=self.file_uuid).update(status="PUBLISHED")
+        picture = Picture.objects.get(uuid=self.file_uuid)
+        picture.create_renditions()
+        self.client.logout()
+        rendition_url = picture.renditions["small_thumbnail"]["url"]
+        response = self.client.get(rendition_url)
+        assert response.status_code == 200
+        assert response["Cache-Control"] == f"public, max-age={settings.MEDIA_PUBLIC_MAX_AGE}, must-revalidate"
+        etag = response["ETag"]
+        response = self.client.get(url)
+        assert response["Cache-Control"] == f"public, max-age={settings.MEDIA_PUBLIC_MAX_AGE}, must-revalidate"
+        # and revalidating an unpublished file fails
+        BaseFile.objects.filter(uuid=self.file_uuid).update(status="UNPUBLISHED")
+        response = self.client.get(rendition_url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 404
+
+    def test_permission_checker_cache(self):
+        """Test that permission checks after the first one on a request, and anonymous user lookups, cost no queries."""
+        self.file_upload()
+        basefile = BaseFile.objects.get(uuid=self.file_uuid)
+
+        request = RequestFactory().get("/")
+        request.user = self.user1
+        assert has_object_permission(request, "view_basefile", basefile)
+        with self.assertNumQueries(0):
+            assert has_object_permission(request, "change_basefile", basefile)
+            assert has_object_permission(request, "files.delete_basefile", basefile)
+            assert not has_object_permission(request, "approve_basefile", basefile)
+
+        # permissions prefetched for a list are used by the checker
+        request = RequestFactory().get("/")
+        request.user = self.user1
+        prefetch_object_permissions(request, [basefile])
+        with self.assertNumQueries(0):
+            assert has_object_permission(request, "change_basefile", basefile)
+
+        # the anonymous user is only looked up once per process
+        get_anonymous_user.cache_clear()
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        assert not has_object_permission(request, "view_basefile", basefile)
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        with self.assertNumQueries(2):
+            # the user and group permissions for the file
+            assert not has_object_permission(request, "view_basefile", basefile)
+        anonymous = User.get_anonymous()
+        with self.assertNumQueries(0):
+            assert get_permission_user(request) == anonymous
+
+    def test_file_list_sparse_fields(self):
+        """Test that the fields parameter limits the returned fields and the work done to get them."""
+        for _ in range(3):
+            self.file_upload()
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"fields": ["uuid", "title", "links"]},
             HTTP_AUTHORIZATION=self.user1.auth,
         )
         assert response.status_code == 200
-        assert response.json()["size_bytes"] == 0
+        assert response.json()["next_cursor"] is None
+        assert len(response.json()["bma_response"]) == 3
+        for f in response.json()["bma_response"]:
+            assert set(f) == {"uuid", "title", "links"}
+            assert f["links"]["self"] == reverse("api-v1-json:file_get", kwargs={"file_uuid": f["uuid"]})
+
+        # the albums and permissions resolvers do not run, so the number of queries is flat
+        def get_queries(fields):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(
+                    reverse("api-v1-json:file_list"),
+                    data={"fields": fields},
+                    HTTP_AUTHORIZATION=self.user1.auth,
+                )
+            assert response.status_code == 200
+            return context.captured_queries
+
+        sparse = get_queries(["uuid", "title"])
+        full = get_queries(["uuid", "title", "albums", "permissions"])
+        assert len(full) > len(sparse)
+        self.file_upload()
+        assert len(get_queries(["uuid", "title"])) == len(sparse)
+        # the base table query only selects the needed columns
+        query = next(q["sql"] for q in sparse if '"files_basefile"."title"' in q["sql"])
+        assert '"files_basefile"."description"' not in query
+
+        # the order and repetitions of the fields do not make new serialisers
+        serializers = get_file_serializer.cache_info().currsize
+        get_queries(["title", "uuid", "title"])
+        assert get_file_serializer.cache_info().currsize == serializers
+
+        # a single file
+        response = self.client.get(
+            reverse("api-v1-json:file_get", kwargs={"file_uuid": self.file_uuid}),
+            data={"fields": ["uuid", "size_bytes", "status"]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 200
+        assert response.json()["bma_response"] == {
+            "uuid": self.file_uuid,
+            "size_bytes": BaseFile.objects.get(uuid=self.file_uuid).original.size,
+            "status": "Pending Moderation",
+        }
+
+        # unknown fields
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"fields": ["uuid", "nope"]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 422
+
+    def test_file_list_albums_query_count(self):
+        """Make sure the albums of the files in a list are loaded with the same number of queries no matter the page size."""
+        albums = [Album.objects.create(owner=self.user1, title=f"album{i}") for i in range(2)]
+        for _ in range(6):
+            self.file_upload()
+            for album in albums:
+                album.files.add(self.file_uuid)
+
+        def get_queries(limit):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(
+                    reverse("api-v1-json:file_list"),
+                    data={"limit": limit},
+                    HTTP_AUTHORIZATION=self.user1.auth,
+                )
+            assert response.status_code == 200
+            assert len(response.json()["bma_response"]) == limit
+            for f in response.json()["bma_response"]:
+                assert set(f["albums"]) == {str(album.uuid) for album in albums}
+            return len(context.captured_queries)
+
+        assert get_queries(2) == get_queries(6)
+
+    def test_file_list_mixed_filetypes(self):
+        """Make sure a page with several filetypes is loaded with one query, and the filetype column is used for filtering."""
+        for i in range(2):
+            self.file_upload()
+            response = self.client.post(
+                reverse("api-v1-json:upload"),
+                {
+                    "f": SimpleUploadedFile(f"notes{i}.txt", f"some notes {i}\n".encode()),
+                    "metadata": json.dumps({"license": "CC_ZERO_1_0", "attribution": "fotoarne"}),
+                },
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+            assert response.status_code == 201
+        assert sorted(BaseFile.objects.values_list("filetype", flat=True)) == [
+            "document",
+            "document",
+            "picture",
+            "picture",
+        ]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse("api-v1-json:file_list"),
+                data={"fields": ["uuid", "filetype", "links"]},
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+        assert response.status_code == 200
+        files = response.json()["bma_response"]
+        assert sorted(f["filetype"] for f in files) == ["document", "document", "picture", "picture"]
+        for f in files:
+            assert f"/{f['filetype']}/bma_{f['filetype']}_" in f["links"]["downloads"]["original"]
+        # the base table and the filetype tables are read in the same query
+        file_queries = [q["sql"] for q in context.captured_queries if "files_basefile" in q["sql"]]
+        assert len(file_queries) == 1
+        assert "pictures_picture" in file_queries[0]
+        assert "documents_document" in file_queries[0]
+
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"filetypes": ["document"]},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert [f["filetype"] for f in response.json()["bma_response"]] == ["document", "document"]
+
+    @override_settings(STREAM_CHUNK_SIZE=2)
+    def test_file_list_stream(self):
+        """Test that streamed file lists return the same files and cursors as the normal response."""
+        for i in range(5):
+            self.file_upload(title=f"title{i}")
+
+        def get(**data):
+            response = self.client.get(
+                reverse("api-v1-json:file_list"),
+                data=data,
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+            assert response.status_code == 200
+            return response
+
+        for limit in [2, 3, 5, 10]:
+            expected = get(limit=limit, sorting="title_asc").json()
+            response = get(limit=limit, sorting="title_asc", stream="json")
+            assert response.streaming
+            assert response["Content-Type"] == "application/json"
+            with CaptureQueriesContext(connection) as context:
+                streamed = json.loads(b"".join(response.streaming_content))
+            # no transaction is kept open while the response is sent
+            assert not [q for q in context.captured_queries if "SAVEPOINT" in q["sql"]]
+            assert streamed["bma_request"]["username"] == "user1"
+            assert streamed["bma_response"] == expected["bma_response"]
+            assert streamed["next_cursor"] == expected["next_cursor"]
+
+            response = get(limit=limit, sorting="title_asc", stream="ndjson")
+            assert response["Content-Type"] == "application/x-ndjson"
+            lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+            if expected["next_cursor"]:
+                assert lines.pop() == {"next_cursor": expected["next_cursor"]}
+            assert lines == expected["bma_response"]
+
+        # sparse fieldsets and cursors
+        first = get(limit=3, stream="json", fields=["uuid", "title"])
+        first = json.loads(b"".join(first.streaming_content))
+        assert all(set(f) == {"uuid", "title"} for f in first["bma_response"])
+        second = get(limit=3, stream="json", fields=["uuid", "title"], cursor=first["next_cursor"])
+        second = json.loads(b"".join(second.streaming_content))
+        assert len(second["bma_response"]) == 2
+        assert second["next_cursor"] is None
+
+        # errors are returned before streaming starts
+        response = self.client.get(
+            reverse("api-v1-json:file_list"),
+            data={"stream": "json", "cursor": "notacursor"},
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 422
+
+    def test_file_list_total(self):
+        """Test the exact and estimated totals in file lists."""
+        for i in range(3):
+            self.file_upload(title=f"title{i}")
+
+        def get(**data):
+            response = self.client.get(
+                reverse("api-v1-json:file_list"),
+                data=data,
+                HTTP_AUTHORIZATION=self.user1.auth,
+            )
+            assert response.status_code == 200
+            return response
+
+        # no total unless asked for
+        response = get(limit=1).json()
+        assert response["total"] is None
+        assert response["total_exact"] is None
+
+        response = get(limit=1, total=True).json()
+        assert len(response["bma_response"]) == 1
+        assert response["total"] == 3
+        assert response["total_exact"] is True
+
+        # the total follows the filters
+        response = get(total=True, search="title1").json()
+        assert response["total"] == 1
+
+        # above the threshold the total is estimated, but never lower than what was counted
+        with override_settings(TOTAL_EXACT_THRESHOLD=1):
+            response = get(limit=1, total=True).json()
+            assert response["total_exact"] is False
+            assert response["total"] >= 2
+
+            streamed = json.loads(b"".join(get(limit=1, total=True, stream="json").streaming_content))
+            assert streamed["total_exact"] is False
+            assert streamed["total"] == response["total"]
+
+            # ndjson has the total on the last line
+            response = get(limit=5, total=True, stream="ndjson")
+            lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+            assert len(lines) == 4
+            assert lines[-1]["next_cursor"] is None
+            assert lines[-1]["total_exact"] is False
+
+        # bad cursors are rejected before counting
+        for stream in [None, "json", "ndjson"]:
+            data = {"total": True, "cursor": "notacursor", **({"stream": stream} if stream else {})}
+            with patch("files.api.get_total") as files_get_total, patch("utils.streaming.get_total") as stream_get_total:
+                response = self.client.get(
+                    reverse("api-v1-json:file_list"),
+                    data=data,
+                    HTTP_AUTHORIZATION=self.user1.auth,
+                )
+            assert response.status_code == 422
+            assert not files_get_total.called
+            assert not stream_get_total.called
+
+    @override_settings(MEDIA_SIGNING_SECRET="secret")
+    def test_file_serializer_contract(self):
+        """Make sure the fast file serialiser returns the same as FileResponseSchema."""
+        album = Album.objects.create(owner=self.user1, title="album")
+        self.file_upload()
+        call_command("rendition_worker", once=True, processes=0)
+        album.files.add(self.file_uuid)
+        self.file_upload()
+        BaseFile.objects.filter(uuid=self.file_uuid).update(status=StatusChoices.PUBLISHED, missing_on_disk=True)
+        response = self.client.post(
+            reverse("api-v1-json:upload"),
+            {
+                "f": SimpleUploadedFile("notes.txt", b"some notes\n"),
+                "metadata": json.dumps({"license": "CC_ZERO_1_0", "attribution": "fotoarne"}),
+            },
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        album.files.add(response.json()["bma_response"]["uuid"])
+
+        for user in [self.user1, self.user2, AnonymousUser()]:
+            request = RequestFactory().get("/")
+            request.user = user
+            files = BaseFile.objects.order_by("created")
+            for fields in [None, ("uuid", "links", "albums", "size_bytes"), ("permissions", "status")]:
+                serializer = get_file_serializer(fields)
+                output = serializer.serialize(serializer.get_rows(files.order_by("created")), request)
+                schema = FileResponseSchema
+                if fields:
+                    schema = get_sparse_schema(FileResponseSchema, fields)
+                expected = [
+                    schema.model_validate(basefile, context={"request": request}).model_dump()
+                    for basefile in files
+                ]
+                assert orjson.loads(orjson.dumps(output)) == orjson.loads(orjson.dumps(expected))
+                assert [list(f) for f in output] == [list(f) for f in expected]
+
+    def test_file_facets(self):
+        """Test the facet counts of the file list, and that they are cached for each user."""
+        album = Album.objects.create(owner=self.user1, title="album")
+        for i in range(3):
+            self.file_upload(title=f"camp {i}" if i else "other")
+            if i:
+                album.files.add(self.file_uuid)
+        BaseFile.objects.filter(uuid=self.file_uuid).update(status=StatusChoices.PUBLISHED)
+        response = self.client.post(
+            reverse("api-v1-json:upload"),
+            {
+                "f": SimpleUploadedFile("notes.txt", b"some notes\n"),
+                "metadata": json.dumps({"title": "camp notes", "license": "CC_BY_4_0", "attribution": "fotoarne"}),
+            },
+            HTTP_AUTHORIZATION=self.user1.auth,
+        )
+        assert response.status_code == 201
+        cache.clear()
+
+        def get_facets(user=None, **filters):
+            headers = {"HTTP_AUTHORIZATION": user.auth} if user else {}
+            response = self.client.get(reverse("api-v1-json:file_facets"), data=filters, **headers)
+            assert response.status_code == 200
+            return response.json()["bma_response"]
+
+        with CaptureQueriesContext(connection) as context:
+            get_facets()
+        # the counts for all facets are found with one query
+        queries = [q["sql"] for q in context.captured_queries if "SAVEPOINT" not in q["sql"]]
+        assert len(queries) == 1
+        assert get_facets(self.user1) == {
+            "filetypes": {"picture": 3, "document": 1},
+            "statuses": {"PENDING_MODERATION": 3, "PUBLISHED": 1},
+            "licenses": {"CC_ZERO_1_0": 3, "CC_BY_4_0": 1},
+            "owners": {str(self.user1.uuid): 4},
+            "albums": {str(album.uuid): 2},
+        }
+        assert get_facets(self.user1, search="camp", filetypes=["picture"]) == {
+            "filetypes": {"picture": 2},
+            "statuses": {"PENDING_MODERATION": 1, "PUBLISHED": 1},
+            "licenses": {"CC_ZERO_1_0": 2},
+            "owners": {str(self.user1.uuid): 2},
+            "albums": {str(album.uuid): 2},
+        }
+        # anonymous users only count published files
+        assert get_facets() == {
+            "filetypes": {"picture": 1},
+            "statuses": {"PUBLISHED": 1},
+            "licenses": {"CC_ZERO_1_0": 1},
+            "owners": {str(self.user1.uuid): 1},
+            "albums": {str(album.uuid): 1},
+        }
+        assert get_facets(self.user2)["statuses"] == {"PUBLISHED": 1}
+
+        # cached until the timeout, pagination does not change the cache key
+        BaseFile.objects.update(status=StatusChoices.PUBLISHED)
+        with self.assertNumQueries(0):
+            assert get_facets(limit=1)["statuses"] == {"PUBLISHED": 1}
+        cache.clear()
+        assert get_facets()["statuses"] == {"PUBLISHED": 4}
+
+
+class TestFileChanges(TransactionTestCase):
+    """Test the file changes feed.
+
+    The watermark is made of transaction ids, so each change must be committed
+    in its own transaction, which TestCase does not do.
+    """
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.client = Client()
+        self.user1 = UserFactory.create(username="user1")
+
+    def tearDown(self):
+        # the database is flushed after each test, which removes the cached anonymous user
+        get_anonymous_user.cache_clear()
+
+    def upload(self, title):
+        """Upload a file as user1 and return the uuid."""
+        self.client.force_login(self.user1)
+        with open("static_src/images/logo_wide_black_500_RGB.png", "rb") as f:
+            response = self.client.post(
+                reverse("api-v1-json:upload"),
+                {"f": f, "metadata": json.dumps({"title": title, "license": "CC_ZERO_1_0", "attribution": "fotoarne"})},
+            )
+        assert response.status_code == 201
+        return response.json()["bma_response"]["uuid"]
+
+    def get(self, user=None, **data):
+        """Return the changes feed for user, or for an anonymous mirror."""
+        if user:
+            self.client.force_login(user)
+        else:
+            self.client.logout()
+        response = self.client.get(reverse("api-v1-json:file_changes"), data=data)
+        assert response.status_code == 200
+        return response.json()
+
+    def test_file_changes(self):
+        """Test syncing files with the changes feed."""
+        uuids = [self.upload(f"title{i}") for i in range(3)]
+
+        # the first sync returns all visible files, in the order they were changed
+        first = self.get(self.user1, limit=2)
+        assert [f["uuid"] for f in first["bma_response"]["files"]] == uuids[:2]
+        assert first["more"] is True
+        second = self.get(self.user1, since=first["watermark"])
+        assert [f["uuid"] for f in second["bma_response"]["files"]] == uuids[2:]
+        assert second["bma_response"]["tombstones"] == []
+        assert second["more"] is False
+        watermark = second["watermark"]
+
+        # nothing changed, the watermark stays
+        response = self.get(self.user1, since=watermark)
+        assert response["bma_response"] == {"files": [], "tombstones": []}
+        assert response["watermark"] == watermark
+
+        # an updated and a deleted file
+        BaseFile.objects.filter(uuid=uuids[0]).update(title="new title")
+        response = self.client.delete(reverse("api-v1-json:file_get", kwargs={"file_uuid": uuids[1]}))
+        assert response.status_code == 204
+        response = self.get(self.user1, since=watermark)
+        assert [f["title"] for f in response["bma_response"]["files"]] == ["new title"]
+        assert [(t["uuid"], t["reason"]) for t in response["bma_response"]["tombstones"]] == [
+            (uuids[1], "deleted"),
+        ]
+
+        # the watermark is validated
+        response = self.client.get(reverse("api-v1-json:file_changes"), data={"since": "nope"})
+        assert response.status_code == 422
+
+    def test_file_changes_anonymous(self):
+        """Test that anonymous mirrors only get published files, and tombstones only for files they could see."""
+        published = self.upload("published")
+        private = self.upload("private")
+        response = self.get()
+        assert response["bma_response"] == {"files": [], "tombstones": []}
+        watermark = response["watermark"]
+
+        BaseFile.objects.filter(uuid=published).update(status=StatusChoices.PUBLISHED)
+        response = self.get(since=watermark)
+        assert [f["uuid"] for f in response["bma_response"]["files"]] == [published]
+        watermark = response["watermark"]
+
+        # changes to files the mirror never saw, including new uploads, are not revealed
+        BaseFile.objects.filter(uuid=private).update(title="still private")
+        new = self.upload("new private file")
+        response = self.get(since=watermark)
+        assert response["bma_response"] == {"files": [], "tombstones": []}
+        watermark = response["watermark"]
+
+        # a published file which is unpublished gets a tombstone
+        BaseFile.objects.filter(uuid=published).update(status=StatusChoices.UNPUBLISHED)
+        BaseFile.objects.filter(uuid=new).update(status=StatusChoices.PENDING_DELETION)
+        response = self.get(since=watermark)
+        assert response["bma_response"]["files"] == []
+        assert [(t["uuid"], t["reason"]) for t in response["bma_response"]["tombstones"]] == [
+            (published, "hidden"),
+        ]
+
+    def test_file_changes_initial_sync(self):
+        """Test that a paged first sync only gets tombstones for files unpublished after it started."""
+        first = self.upload("first")
+        hidden = self.upload("hidden")
+        BaseFile.objects.filter(uuid__in=[first, hidden]).update(status=StatusChoices.PUBLISHED)
+        # unpublished before the mirror ever synced
+        BaseFile.objects.filter(uuid=hidden).update(status=StatusChoices.UNPUBLISHED)
+
+        response = self.get(limit=1)
+        assert [f["uuid"] for f in response["bma_response"]["files"]] == [first]
+        assert response["more"] is True
+
+        # a file the mirror got on the first page is unpublished during the sync
+        BaseFile.objects.filter(uuid=first).update(status=StatusChoices.UNPUBLISHED)
+        response = self.get(since=response["watermark"])
+        assert response["bma_response"]["files"] == []
+        assert [(t["uuid"], t["reason"]) for t in response["bma_response"]["tombstones"]] == [
+            (first, "hidden"),
+        ]
+        assert response["more"] is False
+
+    def test_file_changes_uncommitted(self):
+        """Test that a transaction which commits late is not skipped by the watermark."""
+        uuids = [self.upload(f"title{i}") for i in range(2)]
+        watermark = self.get(self.user1)["watermark"]
+
+        # another process changes a file but has not committed yet
+        other = connections.create_connection("default")
+        with other.cursor() as cursor:
+            cursor.execute("BEGIN")
+            cursor.execute("UPDATE files_basefile SET title = 'late' WHERE uuid = %s", [uuids[0]])
+        try:
+            # a later transaction commits first, the feed waits for the earlier one
+            BaseFile.objects.filter(uuid=uuids[1]).update(title="early")
+            response = self.get(self.user1, since=watermark)
+            assert response["bma_response"]["files"] == []
+            assert response["watermark"] == watermark
+            with other.cursor() as cursor:
+                cursor.execute("COMMIT")
+        finally:
+            other.close()
+
+        response = self.get(self.user1, since=watermark)
+        assert [f["title"] for f in response["bma_response"]["files"]] == ["late", "early"]
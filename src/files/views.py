@@ -1,8 +1,9 @@
 import logging
+import mimetypes
 import re
+import time
 from pathlib import Path
 from urllib.parse import quote
-from users.models import User
 
 from django.conf import settings
 from django.contrib import messages
@@ -10,7 +11,10 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import FileResponse
 from django.http import Http404
 from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.urls import reverse_lazy
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views.generic import DeleteView
 from django.views.generic import DetailView
 from django.views.generic import FormView
@@ -27,6 +31,8 @@ from files.mixins import FilesApprovalMixin
 from files.models import BaseFile
 from files.models import StatusChoices
 from pictures.models import Picture
+from utils.permissions import has_object_permission
+from utils.signing import check_signature
 from videos.models import Video
 
 logger = logging.getLogger("bma")
@@ -126,8 +132,133 @@ class FilesUnpublishUpdateView(PermissionRequiredMixin, FilesApprovalMixin, Upda
     success_msg_postfix = "unpublished"
 
 
+# renditions are named with a hash of the rendition spec by imagekit, see IMAGEKIT_SPEC_CACHEFILE_NAMER
+RENDITION_NAME_REGEX = re.compile(r"/bma_(?:picture|video|audio|document)_[0-9a-f-]{36}\.[0-9a-f]{12}\.\w+$")
+
+# a single byte range, multiple ranges are answered with the whole file
+RANGE_REGEX = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def get_cache_control(path, public, max_age=None):
+    """Return the Cache-Control header for the media file at path.
+
+    Published files can be unpublished without their url changing, so they are
+    cached for MEDIA_PUBLIC_MAX_AGE seconds and then revalidated, which the 304
+    responses to conditional requests make cheap. Files which are not
+    published may only be cached by the browser, for max_age seconds if given,
+    otherwise the browser must revalidate them. Hash named renditions never
+    change, so they are immutable for as long as they may be cached.
+    """
+    if public:
+        return f"public, max-age={settings.MEDIA_PUBLIC_MAX_AGE}, must-revalidate"
+    if max_age is None:
+        return "private, no-cache"
+    immutable = ", immutable" if RENDITION_NAME_REGEX.search(path) else ""
+    return f"private, max-age={max_age}{immutable}"
+
+
+def get_range(request, size, etag, last_modified):
+    """Return the (start, end) byte positions of the requested range, None for the whole file or False if unsatisfiable."""
+    header = request.headers.get("Range")
+    if not header:
+        return None
+    if_range = request.headers.get("If-Range")
+    if if_range and if_range not in (etag, http_date(last_modified)):
+        # the file changed since the client got the first part, send all of it
+        return None
+    match = RANGE_REGEX.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if not start:
+        # the last end bytes
+        if int(end) == 0:
+            return False
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        # an invalid range is ignored
+        return None
+    if start >= size:
+        return False
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def read_range(f, start, end, block_size=64 * 1024):
+    """Yield the bytes from start to end (inclusive) of the file f, and close it."""
+    try:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining and (data := f.read(min(block_size, remaining))):
+            remaining -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def media_response(request, path, accel, cache_control, etag=None):
+    """Return a response serving the media file at path, using nginx x-accel-redirect if accel is True.
+
+    Conditional requests are answered with 304 Not Modified using the ETag and
+    Last-Modified validators. The ETag defaults to the mtime and size in the
+    same format as nginx, a content hash can be given instead.
+    """
+    fullpath = Path(settings.MEDIA_ROOT) / Path(path)
+    try:
+        stat = fullpath.stat()
+    except FileNotFoundError:
+        raise Http404()
+    last_modified = int(stat.st_mtime)
+    if etag is None:
+        etag = f'"{last_modified:x}-{stat.st_size:x}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if accel:
+            # we are using nginx x-accel-redirect, nginx handles range requests
+            response = HttpResponse(status=200)
+            # remove the Content-Type header to allow nginx to add it
+            del response["Content-Type"]
+            response["X-Accel-Redirect"] = f"/public/{quote(path)}"
+        else:
+            # we are serving the file locally
+            byte_range = get_range(request, stat.st_size, etag, last_modified)
+            if byte_range is False:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{stat.st_size}"
+            elif byte_range:
+                start, end = byte_range
+                response = StreamingHttpResponse(
+                    read_range(open(fullpath, "rb"), start, end),
+                    status=206,
+                    content_type=mimetypes.guess_type(fullpath)[0] or "application/octet-stream",
+                )
+                response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+                response["Content-Length"] = end - start + 1
+            else:
+                response = FileResponse(open(fullpath, "rb"), status=200)
+            response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = cache_control
+    # all good
+    return response
+
+
 def bma_media_view(request, path, accel):
     """Serve media files using nginx x-accel-redirect, or serve directly for dev use."""
+    if check_signature(request.path, request.GET):
+        # a signed url from the API, the permissions were checked when it was signed,
+        # so the browser can cache the file until the signature expires
+        max_age = int(request.GET["ts"]) + int(request.GET["e"]) - int(time.time())
+        return media_response(
+            request,
+            path,
+            accel,
+            get_cache_control(path, public=False, max_age=max_age),
+        )
+
     # get BaseFile uuid from the path
     if match := re.match(
         r".*?/bma_(?:picture|video|audio|document)_([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}).*?",
@@ -142,8 +273,12 @@ def bma_media_view(request, path, accel):
             )
             raise Http404()
 
-        if not request.user.has_perm("files.view_basefile", dbfile) and not User.get_anonymous().has_perm("files.view_basefile", dbfile):
-            # neither the current user nor the anonymous user has permissions to view this file
+        if dbfile.status != StatusChoices.PUBLISHED and not has_object_permission(
+            request,
+            "files.view_basefile",
+            dbfile,
+        ):
+            # the file is not published and the current user has no permission to view it
             raise Http404()
 
         # check if the file exists in the filesystem
@@ -151,18 +286,17 @@ def bma_media_view(request, path, accel):
             raise Http404()
 
         # OK, show the file
-        if accel:
-            # we are using nginx x-accel-redirect
-            response = HttpResponse(status=200)
-            # remove the Content-Type header to allow nginx to add it
-            del response["Content-Type"]
-            response["X-Accel-Redirect"] = f"/public/{quote(path)}"
-        else:
-            # we are serving the file locally
-            f = open(Path(settings.MEDIA_ROOT) / Path(path), "rb")
-            response = FileResponse(f, status=200)
-        # all good
-        return response
+        etag = None
+        if dbfile.sha256 and path == dbfile.original.name and not accel:
+            # the digest of the original is a strong validator, nginx makes its own etag
+            etag = f'"{dbfile.sha256}"'
+        return media_response(
+            request,
+            path,
+            accel,
+            get_cache_control(path, public=dbfile.status == StatusChoices.PUBLISHED),
+            etag=etag,
+        )
     else:
         # regex parsing failed
         logger.debug("Unable to parse filename regex to find file UUID, returning 404")
@@ -0,0 +1,69 @@
+import multiprocessing
+import resource
+import statistics
+
+from django.core.management.base import BaseCommand
+from imagekit.processors import ResizeToFit
+from pilkit.utils import open_image
+from pilkit.utils import process_image
+
+from pictures.models import Picture
+from pictures.renditions import render_renditions
+
+
+def render_imagekit(path):
+    """Create all renditions like imagekit does, decoding the original once for each rendition."""
+    for box in Picture.RENDITIONS.values():
+        with open(path, "rb") as f:
+            process_image(open_image(f), processors=[ResizeToFit(*box)], format="JPEG")
+
+
+def render_cascade(path):
+    """Create all renditions with the cascading rendition engine."""
+    with open(path, "rb") as f:
+        for _ in render_renditions(f, Picture.RENDITIONS):
+            pass
+
+
+ENGINES = {
+    "imagekit": render_imagekit,
+    "cascade": render_cascade,
+}
+
+
+def measure(engine, path):
+    """Render path with engine and return the CPU seconds used and the peak RSS increase in MiB."""
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    ENGINES[engine](path)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+    # ru_maxrss is in KiB on Linux
+    return cpu, (after.ru_maxrss - before.ru_maxrss) / 1024
+
+
+class Command(BaseCommand):
+    help = "Compare CPU time and peak memory use per picture for imagekit and the cascading rendition engine."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="The pictures to render.")
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="The number of times to render each picture with each engine.",
+        )
+
+    def handle(self, *args, **options):
+        # every run gets a fresh process so the peak RSS of one run does not hide the next
+        with multiprocessing.get_context("fork").Pool(processes=1, maxtasksperchild=1) as pool:
+            for path in options["paths"]:
+                self.stdout.write(path)
+                for engine in ENGINES:
+                    results = [
+                        pool.apply(measure, (engine, path)) for _ in range(options["repeat"])
+                    ]
+                    cpu = statistics.median(r[0] for r in results)
+                    rss = statistics.median(r[1] for r in results)
+                    self.stdout.write(
+                        f"  {engine:<10} cpu {cpu:8.3f} s   peak rss +{rss:8.1f} MiB",
+                    )
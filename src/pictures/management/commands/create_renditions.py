@@ -0,0 +1,31 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from pictures.models import Picture
+
+logger = logging.getLogger("bma")
+
+
+class Command(BaseCommand):
+    help = "Generate renditions and the renditions manifest for pictures which do not have one."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recreate the renditions manifest for all pictures, not just the ones without one.",
+        )
+
+    def handle(self, *args, **options):
+        pictures = Picture.objects.all()
+        if not options["all"]:
+            pictures = pictures.filter(renditions={})
+        for picture in pictures.iterator():
+            try:
+                picture.create_renditions()
+            except OSError:
+                # maybe file is missing from disk
+                logger.warning(f"Unable to create renditions for picture {picture.uuid}")
+                continue
+            logger.debug(f"Created renditions for picture {picture.uuid}")
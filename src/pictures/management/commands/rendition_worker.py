@@ -0,0 +1,133 @@
+import logging
+import multiprocessing
+import os
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Q
+from django.utils import timezone
+
+from pictures.models import Picture
+from pictures.models import RenditionJob
+
+logger = logging.getLogger("bma")
+
+
+def create_picture_renditions(picture_uuid):
+    """Create renditions for a picture. Runs in the pool worker processes.
+
+    Returns None on success or the error message on failure.
+    """
+    try:
+        Picture.objects.get(uuid=picture_uuid).create_renditions()
+    except Exception as e:
+        logger.exception(f"Unable to create renditions for picture {picture_uuid}")
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+class Command(BaseCommand):
+    help = "Process queued rendition jobs using a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count(),
+            help="The number of worker processes. Use 0 to process jobs in the main process. Defaults to the number of CPUs.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=20,
+            help="The number of jobs to claim from the queue at a time.",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=3,
+            help="Skip jobs which have failed this many times.",
+        )
+        parser.add_argument(
+            "--lease",
+            type=float,
+            default=600,
+            help="Seconds a claimed batch is reserved for this worker, after which other workers can claim the jobs again.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5,
+            help="Seconds to sleep when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when the queue is empty instead of waiting for more jobs.",
+        )
+
+    def handle(self, *args, **options):
+        pool = None
+        if options["processes"]:
+            # close database connections before forking so each worker process opens its own
+            connections.close_all()
+            pool = multiprocessing.Pool(processes=options["processes"])
+        try:
+            while True:
+                if not self.process_jobs(pool, options["batch_size"], options["max_attempts"], options["lease"]):
+                    if options["once"]:
+                        break
+                    time.sleep(options["sleep"])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def claim_jobs(self, batch_size, max_attempts, lease):
+        """Claim a batch of jobs for lease seconds and return them.
+
+        The row locks are only held while claiming, other workers skip locked
+        jobs and jobs with a lease which has not run out.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(
+                RenditionJob.objects.select_for_update(skip_locked=True)
+                .filter(attempts__lt=max_attempts)
+                .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))[:batch_size],
+            )
+            RenditionJob.objects.filter(uuid__in=[job.uuid for job in jobs]).update(
+                claimed_until=now + timedelta(seconds=lease),
+            )
+        return jobs
+
+    def process_jobs(self, pool, batch_size, max_attempts, lease):
+        """Claim a batch of jobs and process them. Returns the number of jobs processed."""
+        jobs = self.claim_jobs(batch_size, max_attempts, lease)
+        if not jobs:
+            return 0
+        # no transaction is open while the renditions are created
+        picture_uuids = [job.picture_id for job in jobs]
+        if pool:
+            results = pool.map(create_picture_renditions, picture_uuids)
+        else:
+            results = [create_picture_renditions(uuid) for uuid in picture_uuids]
+        done = []
+        with transaction.atomic():
+            for job, error in zip(jobs, results):
+                if error is None:
+                    done.append(job.uuid)
+                else:
+                    # use .update() to avoid race conditions, and release the job to be retried
+                    RenditionJob.objects.filter(uuid=job.uuid).update(
+                        attempts=F("attempts") + 1,
+                        error=error,
+                        claimed_until=None,
+                    )
+            RenditionJob.objects.filter(uuid__in=done).delete()
+        logger.info(f"Processed {len(jobs)} rendition jobs, {len(jobs) - len(done)} failed")
+        return len(jobs)
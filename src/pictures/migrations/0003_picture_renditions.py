@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pictures", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="picture",
+            name="renditions",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text="The manifest of generated renditions of this picture. Maps rendition name to url, width, height and size in bytes.",
+            ),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:11
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pictures", "0003_picture_renditions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RenditionJob",
+            fields=[
+                (
+                    "uuid",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        help_text="The unique ID (UUID4) of this object.",
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        help_text="The date and time when this job was queued.",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="The number of failed attempts to process this job.",
+                    ),
+                ),
+                (
+                    "error",
+                    models.TextField(
+                        blank=True,
+                        help_text="The error from the last failed attempt to process this job.",
+                    ),
+                ),
+                (
+                    "picture",
+                    models.ForeignKey(
+                        help_text="The picture to generate renditions for.",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rendition_jobs",
+                        to="pictures.picture",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["created"],
+            },
+        ),
+    ]
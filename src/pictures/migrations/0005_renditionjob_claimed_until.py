@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pictures", "0004_renditionjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="renditionjob",
+            name="claimed_until",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="The job is being processed by a worker until this time, after which it can be claimed again.",
+                null=True,
+            ),
+        ),
+    ]
@@ -1,8 +1,14 @@
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
 from django.db import models
+from imagekit.cachefiles.backends import CacheFileState
 from imagekit.models import ImageSpecField
 from imagekit.processors import ResizeToFit
 from taggit.managers import TaggableManager
 
+from .renditions import render_renditions
 from files.models import BaseFile
 from utils.models import UUIDTaggedItem
 from utils.upload import get_upload_path
@@ -11,6 +17,18 @@ from utils.upload import get_upload_path
 class Picture(BaseFile):
     """The Picture model."""
 
+    # the maximum (width, height) of each rendition, smallest first. Each
+    # rendition is an ImageSpecField below
+    RENDITIONS = {
+        "small_thumbnail": (100, 100),
+        "medium_thumbnail": (200, 200),
+        "large_thumbnail": (300, 300),
+        "small": (700, 700),
+        "medium": (1000, 1000),
+        "large": (1500, 1500),
+        "slideshow": (2400, 1600),
+    }
+
     original = models.ImageField(
         upload_to=get_upload_path,
         max_length=255,
@@ -19,43 +37,43 @@ class Picture(BaseFile):
 
     small_thumbnail = ImageSpecField(
         source="original",
-        processors=[ResizeToFit(100, 100)],
+        processors=[ResizeToFit(*RENDITIONS["small_thumbnail"])],
         format="JPEG",
     )
 
     medium_thumbnail = ImageSpecField(
         source="original",
-        processors=[ResizeToFit(200, 200)],
+        processors=[ResizeToFit(*RENDITIONS["medium_thumbnail"])],
         format="JPEG",
     )
 
     large_thumbnail = ImageSpecField(
         source="original",
-        processors=[ResizeToFit(300, 300)],
+        processors=[ResizeToFit(*RENDITIONS["large_thumbnail"])],
         format="JPEG",
     )
 
     small = ImageSpecField(
         source="original",
-        processors=[ResizeToFit(700, 700)],
+        processors=[ResizeToFit(*RENDITIONS["small"])],
         format="JPEG",
     )
 
     medium = ImageSpecField(
         source="original",
-        processors=[ResizeToFit(1000, 1000)],
+        processors=[ResizeToFit(*RENDITIONS["medium"])],
         format="JPEG",
     )
 
     large = ImageSpecField(
         source="original",
-        processors=[ResizeToFit(1500, 1500)],
+        processors=[ResizeToFit(*RENDITIONS["large"])],
         format="JPEG",
     )
 
     slideshow = ImageSpecField(
         source="original",
-        processors=[ResizeToFit(2400, 1600)],
+        processors=[ResizeToFit(*RENDITIONS["slideshow"])],
         format="JPEG",
     )
 
@@ -63,3 +81,92 @@ class Picture(BaseFile):
         through=UUIDTaggedItem,
         help_text="The tags for this picture",
     )
+
+    renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="The manifest of generated renditions of this picture. Maps rendition name to url, width, height and size in bytes.",
+    )
+
+    def create_renditions(self):
+        """Generate all renditions of this picture and record them in the renditions manifest.
+
+        The original is decoded once and the renditions are saved under the
+        names imagekit uses for the ImageSpecFields, see pictures.renditions.
+        This is the only place the manifest is written, API responses only read it.
+        """
+        renditions = {}
+        with self.original.open("rb") as f:
+            for name, size, content in render_renditions(f, self.RENDITIONS):
+                cachefile = getattr(self, name)
+                data = content.getvalue()
+                if cachefile.storage.exists(cachefile.name):
+                    cachefile.storage.delete(cachefile.name)
+                cachefile.storage.save(cachefile.name, ContentFile(data))
+                # let imagekit know the file exists so it is not generated again
+                cachefile.cachefile_backend.set_state(cachefile, CacheFileState.EXISTS)
+                renditions[name] = {
+                    "url": cachefile.storage.url(cachefile.name),
+                    "width": size[0],
+                    "height": size[1],
+                    "bytes": len(data),
+                }
+        self.renditions = renditions
+        if self.thumbnail_url == settings.DEFAULT_THUMBNAIL_URLS["picture"]:
+            # use the large_thumbnail size as thumbnail
+            self.thumbnail_url = renditions["large_thumbnail"]["url"]
+        # use .update() to avoid overwriting other fields changed meanwhile
+        Picture.objects.filter(uuid=self.uuid).update(
+            renditions=self.renditions,
+            thumbnail_url=self.thumbnail_url,
+        )
+        return renditions
+
+
+class RenditionJob(models.Model):
+    """A queued job to generate the renditions of a picture.
+
+    Jobs are processed by the rendition_worker management command, which
+    claims them with SELECT ... FOR UPDATE SKIP LOCKED and a lease, so any
+    number of workers can run in parallel. The renditions are created outside
+    the claiming transaction, and jobs of a worker which dies are claimed again
+    when the lease runs out. Jobs are deleted when done.
+    """
+
+    class Meta:
+        ordering = ["created"]
+
+    uuid = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+        help_text="The unique ID (UUID4) of this object.",
+    )
+
+    picture = models.ForeignKey(
+        Picture,
+        on_delete=models.CASCADE,
+        related_name="rendition_jobs",
+        help_text="The picture to generate renditions for.",
+    )
+
+    created = models.DateTimeField(
+        auto_now_add=True,
+        help_text="The date and time when this job was queued.",
+    )
+
+    attempts = models.PositiveIntegerField(
+        default=0,
+        help_text="The number of failed attempts to process this job.",
+    )
+
+    error = models.TextField(
+        blank=True,
+        help_text="The error from the last failed attempt to process this job.",
+    )
+
+    claimed_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="The job is being processed by a worker until this time, after which it can be claimed again.",
+    )
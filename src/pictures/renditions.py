@@ -0,0 +1,51 @@
+"""The rendition engine used to create the ImageSpecField renditions of pictures.
+
+Generating each ImageSpecField with imagekit decodes and resizes the full
+original once per rendition. This engine decodes the original once, letting
+the JPEG decoder scale down by up to 8x while decoding (draft mode) or using
+reducing_gap for other formats, and then creates each rendition from the
+next larger one, largest first.
+
+The output has the same dimensions as imagekit's ResizeToFit would produce,
+since the target sizes are always calculated from the original size.
+"""
+from PIL import Image
+from pilkit.processors.utils import resolve_palette
+from pilkit.utils import img_to_fobj
+from pilkit.utils import open_image
+
+
+def get_fit_size(size, box):
+    """Return the size of an image resized to fit inside box, rounded like pilkit's ResizeToFit."""
+    ratio = min(box[0] / size[0], box[1] / size[1])
+    return int(round(size[0] * ratio)), int(round(size[1] * ratio))
+
+
+def render_renditions(source, boxes, format="JPEG"):
+    """Resize the image in the file source to fit inside each of the boxes.
+
+    boxes is a dict of (width, height) tuples keyed by rendition name. Yields a
+    tuple of name, (width, height) and a file object with the encoded image for
+    each rendition, largest first.
+    """
+    image = open_image(source)
+    original_size = image.size
+    sizes = {name: get_fit_size(original_size, box) for name, box in boxes.items()}
+
+    # let the JPEG decoder scale down while decoding, it keeps the
+    # image at least as large as the largest rendition. This does
+    # nothing for other formats.
+    image.draft(None, max(sizes.values()))
+    image = resolve_palette(image)
+    decoded = image
+
+    for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        if image is decoded:
+            # box-reduce big images before resampling
+            image = decoded.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        else:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        yield name, size, img_to_fobj(image, format)
+        if size[0] > decoded.size[0] or size[1] > decoded.size[1]:
+            # this rendition was upscaled, make the next one from the decoded original
+            image = decoded
@@ -6,4 +6,4 @@ from pictures.models import Picture
 class PictureOutSchema(ModelSchema):
     class Config:
         model = Picture
-        model_fields = "__all__"
+        model_exclude = ["search_vector"]
@@ -0,0 +1,48 @@
+from io import BytesIO
+
+from django.test import TestCase
+from imagekit.processors import ResizeToFit
+from PIL import Image
+from pilkit.utils import process_image
+
+from .models import Picture
+from .renditions import render_renditions
+
+
+class TestRenditions(TestCase):
+    """Tests for the rendition engine."""
+
+    def get_image(self, size, format, mode="RGB"):
+        f = BytesIO()
+        Image.new(mode, size, color=128).save(f, format=format)
+        f.seek(0)
+        return f
+
+    def test_render_renditions_matches_imagekit(self):
+        """Make sure the cascaded renditions have the same size as the imagekit ResizeToFit renditions."""
+        for size, format, mode in [
+            ((4000, 3000), "JPEG", "RGB"),
+            ((1234, 4321), "JPEG", "L"),
+            ((3001, 1999), "PNG", "RGBA"),
+            ((500, 158), "PNG", "P"),
+            ((150, 90), "JPEG", "RGB"),
+        ]:
+            source = self.get_image(size, format, mode)
+            renditions = list(render_renditions(source, Picture.RENDITIONS))
+            # largest first
+            assert [r[1] for r in renditions] == sorted(
+                [r[1] for r in renditions],
+                reverse=True,
+            )
+            for name, rendition_size, content in renditions:
+                source.seek(0)
+                expected = Image.open(
+                    process_image(
+                        Image.open(source),
+                        processors=[ResizeToFit(*Picture.RENDITIONS[name])],
+                        format="JPEG",
+                    ),
+                )
+                image = Image.open(content)
+                assert image.format == "JPEG"
+                assert image.size == rendition_size == expected.size, (size, format, name)
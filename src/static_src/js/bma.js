@@ -167,38 +167,156 @@ async function uploadFiles() {
     metadata.license = license.options[license.selectedIndex].value;
     metadata.attribution = document.getElementById("id_attribution").value;
 
-    // loop over formdatas, add metadata to each, and submit each
-    // TODO: batch into groups of some reasonable size
-    console.log("looping over formdatas ...");
+    // ask the server which files already exist so they can be skipped
+    console.log("checking digests ...");
+    let existing = await checkDigests(formdatas.map(fd => fd.digest));
+
+    // skip the files the server already has
+    let pending = [];
     for (let fd of formdatas) {
-        console.log("adding digest to metadata ...");
-        metadata.digest = fd.digest;
-        console.log("adding metadata to formdata ...");
-        fd.append("metadata", JSON.stringify(metadata));
-        console.log("calling uploadFile ...");
+        if (fd.digest in existing) {
+            UpdateStatus(fd.digest, "check", "Already uploaded - file UUID " + existing[fd.digest]);
+        } else {
+            pending.push(fd);
+        }
+    }
+
+    // split the rest into batches of files sharing the metadata
+    let batches = [];
+    for (let i = 0; i < pending.length; i += uploadBatchSize) {
+        batches.push(pending.slice(i, i + uploadBatchSize));
+    }
+
+    // keep up to uploadConcurrency batches in flight, each worker takes the next batch when done
+    console.log("uploading " + pending.length + " files in " + batches.length + " batches ...");
+    let progress = {
+        start: performance.now(),
+        bytes: pending.reduce((total, fd) => total + fd.get("f").size, 0),
+        done: 0,
+    };
+    concurrency = uploadConcurrency;
+    let workers = [];
+    for (let i = 0; i < uploadConcurrency; i++) {
+        workers.push(uploadWorker(i, batches, metadata, progress));
+    }
+    await Promise.all(workers);
+    UpdateProgress(progress);
+}
+
+// the number of batches currently allowed in flight, lowered when the server is busy
+var concurrency;
+
+async function uploadWorker(index, batches, metadata, progress) {
+    // upload batches until there are none left, or the concurrency was lowered below this worker
+    while (batches.length && index < concurrency) {
+        let batch = batches.shift();
         try {
-            response = await uploadFile(fd);
-            UpdateStatus(fd.digest, "check", "Upload OK - file UUID " + response.uuid);
+            let results = await uploadBatchWithRetry(batch, metadata);
+            results.forEach((result, i) => {
+                let digest = batch[i].digest;
+                if (result.status == 201) {
+                    UpdateStatus(digest, "check", "Upload OK - file UUID " + result.file.uuid);
+                } else if (result.status == 409) {
+                    UpdateStatus(digest, "check", "Already uploaded - file UUID " + result.details.files[0]);
+                } else {
+                    UpdateStatus(digest, "exclamation-times", "Upload error: " + result.message);
+                }
+            });
         } catch (error) {
-            UpdateStatus(fd.digest, "exclamation-times", "Upload error: " + error);
+            batch.forEach(fd => UpdateStatus(fd.digest, "exclamation-times", "Upload error: " + error));
         }
-    };
+        progress.done += batch.reduce((total, fd) => total + fd.get("f").size, 0);
+        UpdateProgress(progress);
+    }
+}
+
+async function uploadBatchWithRetry(batch, metadata) {
+    // upload a batch, retrying network errors and busy or failing servers with exponential backoff
+    for (let attempt = 0; ; attempt++) {
+        let delay;
+        try {
+            return await uploadBatch(batch, metadata);
+        } catch (error) {
+            if (!error.retry || attempt >= uploadRetries) {
+                throw error;
+            }
+            if (error.status == 429) {
+                // the server is saturated, run fewer uploads in parallel from now on
+                concurrency = Math.max(1, concurrency - 1);
+                console.log("server busy, lowering upload concurrency to " + concurrency);
+            }
+            // use the Retry-After from the server if it sent one, add jitter so workers do not retry in lockstep
+            delay = (error.retryAfter || 2 ** attempt) * 1000 * (1 + Math.random() / 2);
+        }
+        console.log("retrying upload in " + Math.round(delay) + " ms ...");
+        batch.forEach(fd => UpdateStatus(fd.digest, "spinner", "Retrying upload..."));
+        await new Promise(resolve => setTimeout(resolve, delay));
+    }
+}
+
+function UpdateProgress(progress) {
+    // show the amount uploaded and the aggregate throughput of all workers
+    let seconds = (performance.now() - progress.start) / 1000;
+    let mbps = progress.done * 8 / seconds / 1000000;
+    document.getElementById("upload-progress").innerHTML = "Uploaded " + progress.done.toLocaleString() + " of " + progress.bytes.toLocaleString() + " bytes (" + mbps.toFixed(1) + " Mbit/s)";
 }
 
-async function uploadFile(fd) {
-    console.log("uploading " + fd.digest + "...");
-    response = await fetch('/api/v1/json/files/upload/', {
+async function checkDigests(digests) {
+    // return an object with the uuid of the existing file for each known digest
+    response = await fetch('/api/v1/json/files/digests/', {
         method: "POST",
         headers: {
+            'Content-Type': 'application/json',
             'X-CSRFToken': document.getElementsByName("csrfmiddlewaretoken")[0].value
         },
-        body: fd
+        body: JSON.stringify({"digests": digests})
     })
     if (!response.ok) {
-        UpdateStatus(fd.digest, "exclamation-times", "Upload error: response status " + response.status);
-        throw new Error("Response status " + response.status);
+        // upload everything if the check fails
+        console.log("digest check failed with response status " + response.status);
+        return {};
+    }
+    let data = await response.json();
+    return data.bma_response;
+}
+
+// the number of files sent in each upload request
+var uploadBatchSize = 20;
+// the number of upload requests in flight at the same time
+var uploadConcurrency = 3;
+// the number of times a failed upload request is retried
+var uploadRetries = 5;
+
+async function uploadBatch(batch, metadata) {
+    // upload a batch of files and return the result for each file
+    console.log("uploading a batch of " + batch.length + " files...");
+    let formData = new FormData();
+    batch.forEach(fd => formData.append("files", fd.get("f")));
+    formData.append("metadata", JSON.stringify({...metadata, digests: batch.map(fd => fd.digest)}));
+    let response;
+    try {
+        response = await fetch('/api/v1/json/files/upload/batch/', {
+            method: "POST",
+            headers: {
+                'X-CSRFToken': document.getElementsByName("csrfmiddlewaretoken")[0].value
+            },
+            body: formData
+        })
+    } catch (error) {
+        // network errors are retried
+        error.retry = true;
+        throw error;
+    }
+    if (!response.ok) {
+        let error = new Error("Response status " + response.status);
+        error.status = response.status;
+        // retry when the server is busy or had a temporary problem
+        error.retry = response.status == 429 || response.status >= 500;
+        error.retryAfter = parseInt(response.headers.get("Retry-After")) || null;
+        throw error;
     }
-    return response.json();
+    let data = await response.json();
+    return data.bma_response;
 }
 
 var thumbnailMaxWidth = 400;
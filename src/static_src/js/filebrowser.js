@@ -150,12 +150,55 @@
             };
 
 
-            $this.log("getting files with url: " + url);
+            // page through the results using the cursor from each response
+            let files = [];
+            let cursor = null;
+            do {
+                if (cursor) {
+                    url.searchParams.set("cursor", cursor);
+                };
+                $this.log("getting files with url: " + url);
+                const response = await fetch(url);
+                if (!response.ok) {
+                    throw new Error(`HTTP error, status = ${response.status}`);
+                }
+                const json = await response.json();
+                files = files.concat(json.bma_response);
+                cursor = json.next_cursor;
+                $this.updateStatus("Got " + files.length + " files...", true);
+            } while (cursor);
+            return files;
+        };
+
+
+        // show the number of files for each filetype, status and license in the select options
+        $this.updateFacets = async function() {
+            let url = new URL($this.baseUrl);
+            url.pathname = "/api/v1/json/files/facets/";
+            // only use the search so the counts of the options which are not selected are shown too
+            const search = $this.container.querySelector("input[name='" + $this.prefix + "search']").value;
+            if (search) {
+                url.searchParams.append("search", search);
+            };
             const response = await fetch(url);
             if (!response.ok) {
-                throw new Error(`HTTP error, status = ${response.status}`);
-            }
-            return await response.json();
+                $this.log("unable to get facets, status = " + response.status);
+                return;
+            };
+            const facets = (await response.json()).bma_response;
+            const selects = {
+                "type": facets.filetypes,
+                "status": facets.statuses,
+                "license": facets.licenses,
+            };
+            for (const [name, counts] of Object.entries(selects)) {
+                const options = $this.container.querySelectorAll("select[name='" + $this.prefix + name + "'] > option");
+                options.forEach(function(o) {
+                    // remember the label without the count
+                    o.dataset.label ??= o.text;
+                    o.text = o.dataset.label + " (" + (counts[o.value] || 0) + ")";
+                });
+            };
         };
 
 
@@ -453,10 +496,10 @@
             // disable form
             $this.disableForm();
 
-            // get files from server
+            // get facet counts and files from server
+            $this.updateFacets();
             $this.updateStatus("Getting data...", true);
-            let response = await $this.getFiles();
-            let data = response.bma_response;
+            let data = await $this.getFiles();
             $this.updateStatus("Processing " + data.length + " files...", true);
 
             // remove files that are in the filebrowser but not in the json
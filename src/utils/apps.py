@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed
 
 
 class UtilsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "utils"
+
+    def ready(self):
+        from .models import UUIDTaggedItem
+        from .search import update_search_vector_on_tag_change
+
+        m2m_changed.connect(update_search_vector_on_tag_change, sender=UUIDTaggedItem)
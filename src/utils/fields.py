@@ -0,0 +1,87 @@
+"""Sparse fieldsets, where clients ask for a subset of the fields of each object.
+
+The list and get endpoints take a fields parameter with the names of the
+fields to return. A schema with only those fields and their resolvers is
+built for the response, so the resolvers for the other fields never run, and
+the queryset is narrowed to the columns the requested fields need.
+"""
+import functools
+import typing
+from typing import List
+
+from ninja import Schema
+from ninja.errors import ValidationError
+
+
+def validate_fields(schema, fields):
+    """Return the fields as a tuple in the field order of schema, without duplicates.
+
+    Raise a ValidationError if fields has names which are not fields of schema.
+    The returned tuple is used as cache key for the sparse schemas, so the
+    order and repetitions in the request do not make new schemas.
+    """
+    unknown = [name for name in fields if name not in schema.model_fields]
+    if unknown:
+        raise ValidationError(
+            [{"loc": ["query", "fields"], "msg": f"Unknown fields: {', '.join(unknown)}"}],
+        )
+    return tuple(name for name in schema.model_fields if name in fields)
+
+
+# the fields tuples come from clients, so only the most used sparse schemas are kept
+@functools.lru_cache(maxsize=256)
+def get_sparse_schema(schema, fields):
+    """Return a schema with only the fields of schema named in the fields tuple, and their resolvers."""
+    namespace = {"__annotations__": {}, "__doc__": schema.__doc__}
+    for name in fields:
+        field = schema.model_fields[name]
+        namespace["__annotations__"][name] = field.annotation
+        namespace[name] = field
+        resolver = getattr(schema, f"resolve_{name}", None)
+        if resolver:
+            namespace[f"resolve_{name}"] = staticmethod(resolver)
+    return type(f"Sparse{schema.__name__}", (Schema,), namespace)
+
+
+@functools.lru_cache(maxsize=256)
+def get_sparse_response_schema(response_schema, fields):
+    """Return response_schema with the objects in bma_response limited to the fields tuple."""
+    annotation = response_schema.model_fields["bma_response"].annotation
+    if typing.get_origin(annotation) is list:
+        bma_response = List[get_sparse_schema(typing.get_args(annotation)[0], fields)]
+    else:
+        bma_response = get_sparse_schema(annotation, fields)
+    return type(
+        response_schema.__name__,
+        (response_schema,),
+        {"__annotations__": {"bma_response": bma_response}},
+    )
+
+
+def sparse_response(request, api, response_schema, fields, data):
+    """Return a response with data serialised using response_schema limited to fields.
+
+    fields must be the tuple returned by validate_fields(). The endpoint returns
+    this response directly, because ninja would validate data against the full
+    response schema.
+    """
+    schema = get_sparse_response_schema(response_schema, tuple(fields))
+    result = schema.model_validate(data, context={"request": request})
+    return api.create_response(request, result.model_dump(), status=200)
+
+
+def get_deferred_fields(model, fields, columns, required=()):
+    """Return the names of the concrete model fields not needed to serialise fields.
+
+    columns maps a response field to the model fields it needs, a response field
+    not in columns needs the model field with the same name, if there is one.
+    The required model fields and the primary key are never deferred.
+    """
+    needed = set(required)
+    for name in fields:
+        needed.update(columns.get(name, [name]))
+    return [
+        field.name
+        for field in model._meta.concrete_fields
+        if field.name not in needed and not field.primary_key
+    ]
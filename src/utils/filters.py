@@ -1,4 +1,7 @@
+from typing import List
+
 from django.db import models
+from ninja import Field
 from ninja import Schema
 
 
@@ -13,6 +16,21 @@ class SortingChoices(models.TextChoices):
     created_desc = ("created_desc", "Created (descending)")
     updated_asc = ("updated_asc", "Updated (ascending)")
     updated_desc = ("updated_desc", "Updated (descending)")
+    relevance_desc = ("relevance_desc", "Search relevance (descending)")
+
+
+class SearchModeChoices(models.TextChoices):
+    """The search modes for files and albums."""
+
+    fulltext = ("fulltext", "Full text search in titles, descriptions and tags")
+    fuzzy = ("fuzzy", "Typo tolerant search in titles and filenames")
+
+
+class StreamChoices(models.TextChoices):
+    """The formats for streamed lists, see utils.streaming."""
+
+    json = ("json", "A JSON document like the normal response")
+    ndjson = ("ndjson", "Newline delimited JSON with one object per line")
 
 
 class ListFilters(Schema):
@@ -20,5 +38,10 @@ class ListFilters(Schema):
 
     limit: int = 100
     offset: int = None
+    cursor: str = None
     search: str = None
+    search_mode: SearchModeChoices = None
+    similarity_threshold: float = Field(None, ge=0, le=1)
     sorting: SortingChoices = None
+    fields: List[str] = None
+    total: bool = False
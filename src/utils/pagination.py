@@ -0,0 +1,118 @@
+"""Sorting and pagination shared between the list endpoints.
+
+Lists can be paginated with offset and limit, or with an opaque cursor.
+The cursor encodes the value of the active sort field and the uuid of the
+last object on the previous page, so the next page is found with an indexed
+range query instead of counting past all the previous rows.
+"""
+import base64
+import binascii
+import json
+
+import orjson
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from ninja.errors import ValidationError
+
+
+def get_sorting(sorting, default="created"):
+    """Return the field name and direction for a SortingChoices value."""
+    if not sorting:
+        return default, False
+    if sorting.endswith("_asc"):
+        # remove _asc
+        return sorting[:-4], False
+    else:
+        # remove _desc
+        return sorting[:-5], True
+
+
+def encode_cursor(sorting, value, uuid):
+    """Return an opaque cursor pointing after the object with the given sort value and uuid."""
+    return base64.urlsafe_b64encode(orjson.dumps([sorting or "", value, uuid])).decode()
+
+
+def decode_cursor(cursor):
+    """Return the sorting, sort value and uuid from a cursor made by encode_cursor()."""
+    try:
+        sorting, value, uuid = orjson.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, orjson.JSONDecodeError, ValueError, TypeError):
+        raise ValidationError([{"loc": ["query", "cursor"], "msg": "Invalid cursor"}])
+    return sorting, value, uuid
+
+
+def get_page_queryset(queryset, filters):
+    """Return queryset sorted and starting after the cursor or offset in filters, the limit is not applied."""
+    field, descending = get_sorting(filters.sorting)
+    if field not in queryset.query.annotations:
+        try:
+            queryset.model._meta.get_field(field)
+        except FieldDoesNotExist:
+            # relevance is only annotated when searching, see utils.search
+            raise ValidationError(
+                [{"loc": ["query", "sorting"], "msg": f"Sorting by {field} requires a search"}],
+            )
+    prefix = "-" if descending else ""
+    # always break ties on uuid so the order is stable and the cursor unique
+    queryset = queryset.order_by(f"{prefix}{field}", f"{prefix}uuid")
+
+    if filters.cursor:
+        sorting, value, uuid = decode_cursor(filters.cursor)
+        if sorting != (filters.sorting or ""):
+            raise ValidationError(
+                [{"loc": ["query", "cursor"], "msg": "Cursor does not match sorting"}],
+            )
+        if field not in queryset.query.annotations:
+            value = queryset.model._meta.get_field(field).to_python(value)
+        lookup = "lt" if descending else "gt"
+        # the first condition is redundant but lets postgres use an index range scan
+        queryset = queryset.filter(
+            Q(**{f"{field}__{lookup}e": value}),
+            Q(**{f"{field}__{lookup}": value})
+            | Q(**{field: value, f"uuid__{lookup}": uuid}),
+        )
+    elif filters.offset:
+        queryset = queryset[filters.offset :]
+    return queryset
+
+
+def get_next_cursor(last, filters):
+    """Return the cursor for the page after the last object."""
+    field, _ = get_sorting(filters.sorting)
+    return encode_cursor(filters.sorting, getattr(last, field), last.uuid)
+
+
+def paginate(queryset, filters):
+    """Sort and paginate queryset according to the sorting, cursor, offset and limit filters.
+
+    Returns a tuple of the list of objects and the cursor for the next page,
+    or None if this is the last page.
+    """
+    queryset = get_page_queryset(queryset, filters)
+    if not filters.limit:
+        return list(queryset), None
+
+    # get one extra object to find out if there is a next page
+    objects = list(queryset[: filters.limit + 1])
+    if len(objects) <= filters.limit:
+        return objects, None
+    objects = objects[: filters.limit]
+    return objects, get_next_cursor(objects[-1], filters)
+
+
+def get_total(queryset):
+    """Return a tuple of the number of objects in queryset and True if the number is exact.
+
+    Counting everything costs as much as listing it, so at most
+    TOTAL_EXACT_THRESHOLD objects are counted. If there are more, the row
+    estimate of the Postgres planner is returned instead, which is never lower
+    than the number counted.
+    """
+    queryset = queryset.order_by()
+    threshold = settings.TOTAL_EXACT_THRESHOLD
+    count = queryset[: threshold + 1].count()
+    if count <= threshold:
+        return count, True
+    plan = json.loads(queryset.explain(format="json"))
+    return max(int(plan[0]["Plan"]["Plan Rows"]), count), False
@@ -1,20 +1,168 @@
-from utils.schema import ApiMessageSchema, ApiResponseSchema, ObjectPermissionSchema
-from guardian.shortcuts import get_user_perms, get_group_perms, get_perms
-from users.models import User
+import functools
 import logging
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from guardian.core import ObjectPermissionChecker
+from guardian.ctypes import get_content_type
+from guardian.shortcuts import assign_perm
+from guardian.utils import get_anonymous_user as guardian_get_anonymous_user
+from guardian.utils import get_group_obj_perms_model
+from guardian.utils import get_identity
+from guardian.utils import get_user_obj_perms_model
+
+from utils.schema import ObjectPermissionSchema
 
 logger = logging.getLogger("bma")
 
+
+@functools.cache
+def get_anonymous_user():
+    """Return the guardian anonymous user, cached for the lifetime of the process.
+
+    Guardian looks the user up in the database whenever it checks permissions
+    for an AnonymousUser. The user never changes, so it is only looked up once.
+    Tests which flush the database must clear the cache with cache_clear().
+    """
+    return guardian_get_anonymous_user()
+
+
+def get_permission_user(request):
+    """Return the user of the request, or the cached anonymous user if the request is not authenticated."""
+    if request.user.is_authenticated:
+        return request.user
+    return get_anonymous_user()
+
+
+def get_permission_checker(request):
+    """Return the guardian ObjectPermissionChecker for the user of the request.
+
+    The checker is created on first use and caches the permissions of each
+    object it checks, so repeated checks on a request cost no queries.
+    """
+    if not hasattr(request, "bma_permission_checker"):
+        request.bma_permission_checker = ObjectPermissionChecker(get_permission_user(request))
+    return request.bma_permission_checker
+
+
+def has_object_permission(request, perm, obj):
+    """Return True if the user of the request has the permission perm for obj."""
+    return get_permission_checker(request).has_perm(perm, obj)
+
+
 def get_object_permissions_schema(obj, request):
-    user = request.user
-    user_perms = list(get_user_perms(user, obj))
-    user_perms.sort()
-    group_perms = list(get_group_perms(user, obj))
-    group_perms.sort()
-    effective_perms = list(get_perms(user, obj))
-    effective_perms.sort()
-    return ObjectPermissionSchema(
-        user_permissions=user_perms,
-        group_permissions=group_perms,
-        effective_permissions=effective_perms,
+    """Return the permissions the current user has for obj.
+
+    Uses the request-scoped map built by prefetch_object_permissions() when
+    possible, otherwise the permissions are loaded for the object. The
+    permission checker cache is not used, the permissions may have changed
+    since the check.
+    """
+    prefetched = getattr(request, "bma_object_permissions", {})
+    if str(obj.pk) in prefetched:
+        return prefetched[str(obj.pk)]
+    return get_object_permissions_map([obj], get_permission_user(request))[str(obj.pk)]
+
+
+def _get_perms_by_pk(model, ctype, pks, **filters):
+    """Return a dict of permission codename sets keyed by object pk for a guardian object permission model."""
+    if model.objects.is_generic():
+        filters.update({"content_type": ctype, "object_pk__in": pks})
+        pk_field = "object_pk"
+    else:
+        filters["content_object_id__in"] = pks
+        pk_field = "content_object_id"
+    perms = defaultdict(set)
+    for pk, codename in model.objects.filter(**filters).values_list(
+        pk_field,
+        "permission__codename",
+    ):
+        perms[str(pk)].add(codename)
+    return perms
+
+
+def get_object_permissions_map(objects, user):
+    """Return a dict of ObjectPermissionSchema objects keyed by object pk.
+
+    All objects must share the same guardian content type. The user, group and
+    effective permissions are loaded for all objects in a fixed number of queries,
+    regardless of the number of objects.
+    """
+    objects = list(objects)
+    if not objects:
+        return {}
+    user, _ = get_identity(user)
+    ctype = get_content_type(objects[0])
+    pks = [str(obj.pk) for obj in objects]
+
+    user_perms = _get_perms_by_pk(
+        get_user_obj_perms_model(objects[0]),
+        ctype,
+        pks,
+        user=user,
+    )
+    group_perms = _get_perms_by_pk(
+        get_group_obj_perms_model(objects[0]),
+        ctype,
+        pks,
+        group__user=user,
+    )
+    if user.is_active and user.is_superuser:
+        # superusers have all permissions for the content type, same as guardian
+        all_perms = set(
+            Permission.objects.filter(content_type=ctype).values_list(
+                "codename",
+                flat=True,
+            ),
+        )
+
+    permissions = {}
+    for pk in pks:
+        if not user.is_active:
+            effective_perms = set()
+        elif user.is_superuser:
+            effective_perms = all_perms
+        else:
+            effective_perms = user_perms[pk] | group_perms[pk]
+        permissions[pk] = ObjectPermissionSchema(
+            user_permissions=sorted(user_perms[pk]),
+            group_permissions=sorted(group_perms[pk]),
+            effective_permissions=sorted(effective_perms),
+        )
+    return permissions
+
+
+def prefetch_object_permissions(request, objects):
+    """Load permissions for all objects and save them in the request-scoped map used by get_object_permissions_schema().
+
+    The permissions are also prefetched by the permission checker of the
+    request, so has_object_permission() needs no queries for the objects.
+    """
+    objects = list(objects)
+    permissions = get_object_permissions_map(objects, get_permission_user(request))
+    if not hasattr(request, "bma_object_permissions"):
+        request.bma_object_permissions = {}
+    request.bma_object_permissions.update(permissions)
+    get_permission_checker(request).prefetch_perms(objects)
+
+
+def assign_owner_permissions(codenames, owners, model):
+    """Assign the permissions in codenames to the owner of each object.
+
+    owners is a dict of owner ids keyed by object pk. Guardian's bulk assignment
+    is used, so the number of queries depends on the number of owners and
+    permissions, not the number of objects.
+    """
+    if not owners:
+        return
+    permissions = list(
+        Permission.objects.filter(content_type=get_content_type(model), codename__in=codenames),
     )
+    users = get_user_model().objects.in_bulk(set(owners.values()))
+    objects_by_owner = defaultdict(list)
+    for pk, owner_id in owners.items():
+        objects_by_owner[owner_id].append(model(pk=pk))
+    for owner_id, objects in objects_by_owner.items():
+        for permission in permissions:
+            assign_perm(permission, users[owner_id], objects)
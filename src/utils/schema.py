@@ -32,11 +32,27 @@ class ApiMessageSchema(Schema):
         )
 
 
+def get_response_envelope(request):
+    """Return the bma_request, message and details of a response, for responses built without a response schema."""
+    return ApiMessageSchema.model_validate({}, context={"request": request}).model_dump()
+
+
 class ApiResponseSchema(ApiMessageSchema, Schema):
     """The schema used for all API responses."""
     bma_response: Optional[Any]
 
 
+class ApiListResponseSchema(ApiResponseSchema):
+    """The schema used for API responses with a list of objects.
+
+    The total number of objects is only included when asked for, and may be an
+    estimate for big lists, see utils.pagination.get_total().
+    """
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+    total_exact: Optional[bool] = None
+
+
 class ObjectPermissionSchema(Schema):
     """The schema used to include current users permissions for objects."""
     user_permissions: List[str]
@@ -0,0 +1,122 @@
+"""Full text search shared between the file_list and album_list endpoints.
+
+Files and albums have a search_vector column with the title (weight A), the
+description (weight B) and the tag names (weight C). The column is updated
+when the object is saved and when its tags change, and it has a GIN index
+so a search is an index lookup instead of a sequential scan.
+
+The fuzzy search mode instead uses trigram word similarity on titles and
+filenames, backed by gin_trgm_ops indexes, to find misspelled words.
+"""
+import operator
+from contextlib import contextmanager
+from functools import reduce
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
+from django.contrib.postgres.search import SearchVector
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db import transaction
+from django.db.models import F
+from django.db.models import FloatField
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import Subquery
+from django.db.models import TextField
+from django.db.models import Value
+from django.db.models.functions import Cast
+from django.db.models.functions import Coalesce
+from django.db.models.functions import Greatest
+
+from .models import UUIDTaggedItem
+
+# the text search configuration used for both the search vectors and the queries
+SEARCH_CONFIG = "english"
+
+
+def get_search_vector(tagged_item_model=UUIDTaggedItem):
+    """Return an expression building the weighted search vector for an object.
+
+    The tagged item model can be passed so the expression also works with
+    the historical models in migrations.
+    """
+    tags = (
+        tagged_item_model.objects.filter(object_id=OuterRef("uuid"))
+        .values("object_id")
+        .annotate(names=StringAgg("tag__name", delimiter=" "))
+        .values("names")
+    )
+    return (
+        SearchVector("title", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("description", weight="B", config=SEARCH_CONFIG)
+        + SearchVector(
+            Coalesce(Subquery(tags), Value(""), output_field=TextField()),
+            weight="C",
+            config=SEARCH_CONFIG,
+        )
+    )
+
+
+def update_search_vectors(queryset, tagged_item_model=UUIDTaggedItem):
+    """Update the search vector of all objects in queryset with a single query."""
+    return queryset.update(search_vector=get_search_vector(tagged_item_model))
+
+
+def search(queryset, text):
+    """Filter queryset to the objects matching the search text and annotate the relevance.
+
+    The search text supports the web search syntax, like "quoted phrases",
+    OR and -excluded words.
+    """
+    query = SearchQuery(text, search_type="websearch", config=SEARCH_CONFIG)
+    return queryset.filter(search_vector=query).annotate(
+        # ts_rank() returns a real, cast it so the value survives the round trip through a cursor
+        relevance=Cast(SearchRank(F("search_vector"), query), FloatField()),
+    )
+
+
+def fuzzy_search(queryset, text, fields):
+    """Filter queryset to the objects with a word similar to the search text in one of fields.
+
+    The relevance is annotated as the best trigram word similarity of the fields.
+    The filter uses the gin_trgm_ops index on each field, and the threshold is the
+    pg_trgm.word_similarity_threshold setting, see similarity_threshold().
+    """
+    query = reduce(
+        operator.or_,
+        (Q(**{f"{field}__trigram_word_similar": text}) for field in fields),
+    )
+    similarities = [TrigramWordSimilarity(text, field) for field in fields]
+    relevance = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+    return queryset.filter(query).annotate(relevance=Cast(relevance, FloatField()))
+
+
+@contextmanager
+def similarity_threshold(threshold):
+    """Use threshold as the trigram word similarity threshold for the queries inside the block.
+
+    The setting only lasts until the end of the transaction, so the block runs
+    in one. The pg_trgm default of 0.6 is used if threshold is None, and no
+    transaction is started.
+    """
+    if threshold is None:
+        yield
+        return
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                [str(threshold)],
+            )
+        yield
+
+
+def update_search_vector_on_tag_change(sender, instance, action, **kwargs):
+    """Update the search vector of an object when its tags change."""
+    if action in ("post_add", "post_remove", "post_clear") and hasattr(
+        instance,
+        "update_search_vector",
+    ):
+        instance.update_search_vector()
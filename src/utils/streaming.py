@@ -0,0 +1,118 @@
+"""Streamed list responses, for listings too big to build in memory.
+
+The rows are read from the database with a server side cursor and serialised
+one chunk at a time while the response is sent, so the memory used by the
+worker does not grow with the number of rows. The json format is the same
+document as the normal list response. The ndjson format has one object per
+line, followed by a line with only the next_cursor if there is a next page.
+If the total was asked for, the last ndjson line is always there and also
+has the total.
+"""
+import orjson
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from .filters import StreamChoices
+from .pagination import get_next_cursor
+from .pagination import get_page_queryset
+from .pagination import get_total
+from .schema import get_response_envelope
+from .search import similarity_threshold
+
+
+def iterate_chunks(iterable, chunk_size):
+    """Yield lists of up to chunk_size items from iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iterate_page(queryset, filters, chunk_size):
+    """Yield the objects of a queryset from get_page_queryset() in chunks, like utils.pagination.paginate().
+
+    The last item yielded is the cursor for the next page, or None if this is the last page.
+    """
+    if filters.limit:
+        # get one extra object to find out if there is a next page
+        queryset = queryset[: filters.limit + 1]
+    count = 0
+    last = None
+    for chunk in iterate_chunks(queryset.iterator(chunk_size=chunk_size), chunk_size):
+        if filters.limit and count + len(chunk) > filters.limit:
+            chunk = chunk[: filters.limit - count]
+            if chunk:
+                yield chunk
+            yield get_next_cursor(chunk[-1] if chunk else last, filters)
+            return
+        count += len(chunk)
+        last = chunk[-1]
+        yield chunk
+    yield None
+
+
+def stream_rows(queryset, filters, serialize, chunk_size=None):
+    """Yield the serialised objects of the page from get_page_queryset() in chunks, and the next cursor.
+
+    serialize is called with each chunk of objects and returns a list of dicts.
+    """
+    # the query runs while the response is sent, after the view has returned. Without a
+    # similarity threshold there is no transaction, and the server side cursor is declared
+    # WITH HOLD, so no transaction is left open while a slow client reads the response
+    with similarity_threshold(filters.similarity_threshold):
+        for chunk in iterate_page(queryset, filters, chunk_size or settings.STREAM_CHUNK_SIZE):
+            if chunk is None or isinstance(chunk, str):
+                yield chunk
+                return
+            yield [orjson.dumps(obj) for obj in serialize(chunk)]
+
+
+def stream_json(request, rows, extra=None):
+    """Yield a JSON document like the normal list response, with the objects from stream_rows() and the extra keys."""
+    envelope = get_response_envelope(request)
+    envelope.update(extra or {})
+    # leave the object open and add the list of objects and the cursor at the end
+    yield orjson.dumps(envelope)[:-1] + b',"bma_response":['
+    first = True
+    for chunk in rows:
+        if chunk is None or isinstance(chunk, str):
+            yield b'],"next_cursor":' + orjson.dumps(chunk) + b"}"
+            return
+        yield (b"" if first else b",") + b",".join(chunk)
+        first = False
+
+
+def stream_ndjson(request, rows, extra=None):
+    """Yield one object from stream_rows() per line, and the next cursor and extra keys on the last line.
+
+    Without extra keys the last line is only there if there is a next page.
+    """
+    for chunk in rows:
+        if chunk is None or isinstance(chunk, str):
+            if chunk or extra:
+                yield orjson.dumps({"next_cursor": chunk, **(extra or {})}) + b"\n"
+            return
+        yield b"\n".join(chunk) + b"\n"
+
+
+def stream_response(request, queryset, filters, serialize, total_queryset=None):
+    """Return a StreamingHttpResponse with the page of queryset in the format from filters.stream.
+
+    serialize is called with each chunk of objects and returns a list of dicts.
+    If filters.total is set, total_queryset, or queryset, is counted for the total.
+    """
+    # invalid sorting and cursors must be found before the response starts, and before counting
+    page = get_page_queryset(queryset, filters)
+    extra = {}
+    if filters.total:
+        with similarity_threshold(filters.similarity_threshold):
+            extra["total"], extra["total_exact"] = get_total(queryset if total_queryset is None else total_queryset)
+    rows = stream_rows(page, filters, serialize)
+    if filters.stream == StreamChoices.ndjson:
+        return StreamingHttpResponse(stream_ndjson(request, rows, extra), content_type="application/x-ndjson")
+    extra = {"total": None, "total_exact": None, **extra}
+    return StreamingHttpResponse(stream_json(request, rows, extra), content_type="application/json")
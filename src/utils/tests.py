@@ -146,7 +146,7 @@ class ApiTestBase(TestCase):
         assert response.status_code == expect_status_code
         if expect_status_code == 422:
             return
-        data = response.json()
+        data = response.json()["bma_response"]
         assert "uuid" in data
         if not title:
             title = Path(filepath).name
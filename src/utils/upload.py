@@ -1,8 +1,117 @@
+import hashlib
+from functools import wraps
 from pathlib import Path
 
+from django.conf import settings
+from django.db import connection
+from django.core.files.uploadhandler import MemoryFileUploadHandler
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
 
 def get_upload_path(instance, filename):
     """Return the upload path under MEDIA_ROOT for this file."""
     return Path(
         f"user_{instance.owner.uuid}/{instance.filetype}/bma_{instance.filetype}_{instance.uuid}{Path(filename).suffix.lower()}",
     )
+
+
+class SHA256UploadHandlerMixin:
+    """Calculate the SHA-256 digest of uploaded files while the chunks are received.
+
+    The digest is available as the sha256 attribute of the uploaded file, so
+    the file does not have to be read again to hash it.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # the memory handler raises StopFutureHandlers when it takes the file
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # this handler stored the chunk, a chunk passed on is hashed by the next handler
+            self.sha256.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.sha256 = self.sha256.hexdigest()
+        return uploaded_file
+
+
+class SHA256MemoryFileUploadHandler(SHA256UploadHandlerMixin, MemoryFileUploadHandler):
+    """Keep small uploads in memory and hash them while they are received."""
+
+
+class SHA256TemporaryFileUploadHandler(SHA256UploadHandlerMixin, TemporaryFileUploadHandler):
+    """Stream large uploads to a temporary file and hash them while they are received."""
+
+
+def get_sha256(uploaded_file):
+    """Return the SHA-256 hex digest of an uploaded file.
+
+    Uses the digest calculated by the upload handlers when possible,
+    otherwise the file is read to calculate it.
+    """
+    if getattr(uploaded_file, "sha256", None):
+        return uploaded_file.sha256
+    sha256 = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# the first key of the Postgres advisory locks used as upload slots, the second key is the slot number
+UPLOAD_SLOT_LOCK_KEY = 0x626D61
+
+
+def acquire_upload_slot():
+    """Lock a free upload slot and return its number, or None if all UPLOAD_MAX_CONCURRENCY slots are taken.
+
+    The slots are Postgres advisory locks, so they are shared by all processes
+    and released by the database if a process dies while holding one.
+    """
+    with connection.cursor() as cursor:
+        for slot in range(settings.UPLOAD_MAX_CONCURRENCY):
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [UPLOAD_SLOT_LOCK_KEY, slot])
+            if cursor.fetchone()[0]:
+                return slot
+    return None
+
+
+def release_upload_slot(slot):
+    """Unlock an upload slot from acquire_upload_slot()."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [UPLOAD_SLOT_LOCK_KEY, slot])
+
+
+def limit_concurrent_uploads(router):
+    """Return a decorator which rejects uploads with 429 Too Many Requests when the server is handling too many.
+
+    Used with decorate_view() on upload endpoints of router, so uploads are
+    rejected before the file is processed. The Retry-After header tells the
+    client when to retry.
+    """
+
+    def decorator(run):
+        @wraps(run)
+        def wrapper(request, *args, **kwargs):
+            slot = acquire_upload_slot()
+            if slot is None:
+                response = router.api.create_response(
+                    request,
+                    {"message": "Too many uploads in progress, try again later"},
+                    status=429,
+                )
+                response["Retry-After"] = str(settings.UPLOAD_RETRY_AFTER)
+                return response
+            try:
+                return run(request, *args, **kwargs)
+            finally:
+                release_upload_slot(slot)
+
+        return wrapper
+
+    return decorator
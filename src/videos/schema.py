@@ -6,4 +6,4 @@ from videos.models import Video
 class VideoOutSchema(ModelSchema):
     class Config:
         model = Video
-        model_fields = "__all__"
+        model_exclude = ["search_vector"]